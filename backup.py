@@ -0,0 +1,194 @@
+"""Online snapshots of the SQLite database, with rotation and restore
+
+Snapshots are taken with SQLite's backup API from a connection of their
+own, so neither the repository thread nor writers wait for them.
+
+Run from the project root (stop the bot before restoring):
+    python -m backup create | list | verify <snapshot> | restore <snapshot>
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from config import (
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_PAUSE,
+    DATABASE_FILE,
+)
+
+
+def _stem(database_file):
+    return os.path.splitext(os.path.basename(database_file))[0]
+
+
+def list_snapshots(directory=BACKUP_DIR, database_file=DATABASE_FILE):
+    """Paths of the snapshots of `database_file`, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    prefix = _stem(database_file) + "-"
+    # Timestamped names sort chronologically
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(".db")
+    )
+
+
+def copy_database(source, target_file, pages, pause):
+    """Copy the database open on `source` to target_file, `pages` pages per step
+
+    The whole copy reads one snapshot inside a read transaction. In WAL mode
+    writers on other connections are not blocked by it, and their commits
+    don't restart the copy the way they would between independent steps.
+    """
+    target = sqlite3.connect(target_file)
+    try:
+        source.execute("BEGIN")
+        try:
+            # The first read pins the snapshot
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(
+                target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause)
+            )
+        finally:
+            source.execute("ROLLBACK")
+        # A self-contained file, without -wal and -shm companions
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+
+
+def check_integrity(path):
+    """Problems reported by PRAGMA integrity_check; empty for a sound database"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    except sqlite3.DatabaseError as e:
+        # Damage to the header or the schema stops the check itself
+        return [str(e)]
+    finally:
+        conn.close()
+    problems = [row[0] for row in rows]
+    return [] if problems == ["ok"] else problems
+
+
+def rotate_snapshots(directory=BACKUP_DIR, database_file=DATABASE_FILE, keep=BACKUP_KEEP):
+    """Delete all but the newest `keep` snapshots (0 keeps them all); returns how many were deleted"""
+    if keep <= 0:
+        return 0
+    removed = 0
+    for path in list_snapshots(directory, database_file)[:-keep]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Error removing snapshot {path}: {e}")
+            continue
+        removed += 1
+    return removed
+
+
+def create_backup(
+    database_file=DATABASE_FILE,
+    directory=BACKUP_DIR,
+    keep=BACKUP_KEEP,
+    pages=BACKUP_PAGES_PER_STEP,
+    pause=BACKUP_STEP_PAUSE,
+):
+    """Write a verified snapshot of the database and rotate old ones; returns its path
+
+    Blocking: runs for as long as the copy and the integrity check take.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{_stem(database_file)}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    # Only complete, verified snapshots get the .db name
+    partial = path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    source = sqlite3.connect(database_file, isolation_level=None)
+    try:
+        source.execute("PRAGMA busy_timeout = 5000")
+        copy_database(source, partial, pages, pause)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        source.close()
+
+    problems = check_integrity(partial)
+    if problems:
+        os.remove(partial)
+        raise sqlite3.DatabaseError(f"Snapshot failed the integrity check: {'; '.join(problems[:5])}")
+    os.replace(partial, path)
+
+    removed = rotate_snapshots(directory, database_file, keep)
+    logging.info(
+        f"Database snapshot {path} written ({os.path.getsize(path) / 2 ** 20:.1f} MB), "
+        f"{removed} old snapshots removed"
+    )
+    return path
+
+
+def restore_backup(snapshot, database_file=DATABASE_FILE, directory=BACKUP_DIR):
+    """Replace the database with a verified snapshot; the bot must be stopped
+
+    The current database is snapshotted first, without rotating old
+    snapshots. Returns the path of that copy, or None if there was no
+    database.
+    """
+    problems = check_integrity(snapshot)
+    if problems:
+        raise sqlite3.DatabaseError(f"{snapshot} failed the integrity check: {'; '.join(problems[:5])}")
+
+    saved = None
+    if os.path.exists(database_file):
+        saved = create_backup(database_file, directory, keep=0)
+
+    source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    target = sqlite3.connect(database_file)
+    try:
+        # Through the backup API the live file, its WAL and any reader stay consistent
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    logging.info(f"Database {database_file} restored from {snapshot}")
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="write a snapshot now")
+    commands.add_parser("list", help="list snapshots, oldest first")
+    verify = commands.add_parser("verify", help="run the integrity check on a snapshot")
+    verify.add_argument("snapshot")
+    restore = commands.add_parser("restore", help="replace the database with a snapshot")
+    restore.add_argument("snapshot")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "create":
+        print(create_backup())
+    elif args.command == "list":
+        for path in list_snapshots():
+            print(f"{path}  {os.path.getsize(path) / 2 ** 20:.1f} MB")
+    elif args.command == "verify":
+        problems = check_integrity(args.snapshot)
+        for problem in problems:
+            print(problem)
+        print("ok" if not problems else f"{len(problems)} problems")
+        raise SystemExit(1 if problems else 0)
+    elif args.command == "restore":
+        saved = restore_backup(args.snapshot)
+        if saved:
+            print(f"Previous database saved as {saved}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Online backup: scheduler latency while a large database is being snapshotted
+
+Builds a throwaway database of `size_mb` (queued deliveries plus filler
+rows standing in for a long history), then runs scheduler-like ticks, each
+claiming and releasing a delivery on the repository thread, first alone
+and then while backup.create_backup copies the database in page steps.
+
+Run from the project root:
+    python -m benchmarks.bench_backup [size_mb] [pages_per_step] [step_pause]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from backup import create_backup
+from database import ArticleRepository
+
+SIZE_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+PAGES = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+PAUSE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.005
+DELIVERIES = 1000
+TICK_INTERVAL = 0.01
+BASELINE_SECONDS = 10
+LEASE = timedelta(minutes=10)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, timings):
+    print(f"{name:<9} {len(timings)} ticks"
+          f"  p50 {percentile(timings, 0.5) * 1000:.2f} ms"
+          f"  p95 {percentile(timings, 0.95) * 1000:.2f} ms"
+          f"  p99 {percentile(timings, 0.99) * 1000:.2f} ms"
+          f"  max {max(timings) * 1000:.2f} ms")
+
+
+def build(path):
+    repo = ArticleRepository(path)
+    repo.initialize()
+    repo.add_articles(
+        [(f"Текст {number}", f"Пост {number}", None, None, None, None) for number in range(DELIVERIES)],
+        ["@bench"],
+    )
+    repo.close()
+
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE filler (data BLOB)")
+    with conn:
+        # 64 KB rows, a megabyte per 16
+        conn.executemany(
+            "INSERT INTO filler VALUES (randomblob(65536))", ([] for _ in range(SIZE_MB * 16))
+        )
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+async def ticks(repo, deliveries, stop):
+    """Claim and release deliveries round-robin until `stop` is set; returns tick latencies"""
+    timings = []
+    number = 0
+    while not stop.is_set():
+        delivery_id = deliveries[number % len(deliveries)]
+        number += 1
+        began = time.perf_counter()
+        await repo.run(repo.claim_delivery, delivery_id, "bench", LEASE)
+        await repo.run(repo.release_delivery, delivery_id, "bench")
+        timings.append(time.perf_counter() - began)
+        await asyncio.sleep(TICK_INTERVAL)
+    return timings
+
+
+async def main():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    started = time.perf_counter()
+    build(path)
+    print(f"database  {os.path.getsize(path) / 2 ** 20:.0f} MB built in {time.perf_counter() - started:.1f} s")
+
+    repo = ArticleRepository(path)
+    deliveries = [row[0] for row in repo.call(repo.get_queued_deliveries)]
+
+    stop = asyncio.Event()
+    task = asyncio.create_task(ticks(repo, deliveries, stop))
+    await asyncio.sleep(BASELINE_SECONDS)
+    stop.set()
+    report("baseline", await task)
+
+    stop = asyncio.Event()
+    task = asyncio.create_task(ticks(repo, deliveries, stop))
+    started = time.perf_counter()
+    snapshot = await asyncio.to_thread(
+        create_backup, path, os.path.join(directory, "backups"), 1, PAGES, PAUSE
+    )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    report("backup", await task)
+    size = os.path.getsize(snapshot) / 2 ** 20
+    print(f"snapshot  {size:.0f} MB copied and verified in {elapsed:.1f} s ({size / elapsed:.0f} MB/s), "
+          f"{PAGES} pages per step, {PAUSE * 1000:.0f} ms pauses")
+    repo.call(repo.close)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""Per-operation latency of database.py: connection per call vs long-lived repository
+
+The first two sections run the same statements, one per call, with a
+connection opened for each call and on the repository's long-lived
+connection, so they compare the connection handling alone. The third
+times the repository methods the bot calls, which do more per call:
+add_article prepares the post, fans out deliveries and indexes MinHash
+bands, get_article_by_id looks up the next delivery slot and
+delete_article also updates deliveries and signatures. Its numbers are
+not comparable with the first section.
+
+Run from the project root:
+    python -m benchmarks.bench_database [iterations]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import ArticleRepository, migrate
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+class ConnectPerCall:
+    """Replica of the original database.py: one connection per operation"""
+
+    def __init__(self, database_file):
+        self.database_file = database_file
+        conn = sqlite3.connect(database_file)
+        migrate(conn)
+        conn.close()
+
+    def _execute(self, sql, params=(), fetch=None):
+        conn = sqlite3.connect(self.database_file)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        result = getattr(cursor, fetch)() if fetch else cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return result
+
+    def add_article(self, text, processed_text, image_path=None, image_file_id=None, channels=()):
+        return self._execute(
+            "INSERT INTO articles (text, processed_text, image_path, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (text, processed_text, image_path, "queued", datetime.now()),
+        )
+
+    def get_article_by_id(self, article_id):
+        return self._execute(
+            "SELECT * FROM articles WHERE id = ? AND status = 'queued'", (article_id,), "fetchone"
+        )
+
+    # Scheduling moved to per-channel deliveries; same single-row UPDATE as before
+    def update_delivery_scheduled(self, article_id, scheduled_at):
+        self._execute("UPDATE articles SET scheduled_at = ? WHERE id = ?", (scheduled_at, article_id))
+
+    def delete_article(self, article_id):
+        self._execute("UPDATE articles SET status = 'deleted' WHERE id = ?", (article_id,))
+
+
+class SharedConnection(ConnectPerCall):
+    """The same statements on the repository's tuned, long-lived connection"""
+
+    def __init__(self, repository):
+        self.conn = repository.conn
+        migrate(self.conn)
+
+    def _execute(self, sql, params=(), fetch=None):
+        cursor = self.conn.execute(sql, params)
+        result = getattr(cursor, fetch)() if fetch else cursor.lastrowid
+        self.conn.commit()
+        return result
+
+
+def measure(name, func, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<24} {elapsed / len(args_list) * 1e6:9.1f} us/op")
+
+
+def run_sync(label, store):
+    print(label)
+    ids = range(1, ITERATIONS + 1)
+    when = datetime.now() + timedelta(hours=1)
+    article = ("text", "<b>processed</b>", None, None, ("@bench",))
+    measure("add_article", store.add_article, [article] * ITERATIONS)
+    measure("get_article_by_id", store.get_article_by_id, [(i,) for i in ids])
+    measure("update_scheduled", store.update_delivery_scheduled, [(i, when) for i in ids])
+    measure("delete_article", store.delete_article, [(i,) for i in ids])
+
+
+async def run_async(repository):
+    print("repository via worker thread (awaited from the event loop)")
+    start = time.perf_counter()
+    for i in range(1, ITERATIONS + 1):
+        await repository.run(repository.get_article_by_id, i)
+    elapsed = time.perf_counter() - start
+    print(f"  {'get_article_by_id':<24} {elapsed / ITERATIONS * 1e6:9.1f} us/op")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        run_sync("connection per call (before)", ConnectPerCall(os.path.join(tmp, "before.db")))
+
+        shared = ArticleRepository(os.path.join(tmp, "shared.db"))
+        run_sync("long-lived connection, same statements (after)", SharedConnection(shared))
+        shared.close()
+
+        repository = ArticleRepository(os.path.join(tmp, "after.db"))
+        repository.initialize()
+        run_sync("repository methods (more work per call, see above)", repository)
+        asyncio.run(run_async(repository))
+        repository.close()
+
+
+if __name__ == "__main__":
+    main()
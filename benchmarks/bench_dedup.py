@@ -0,0 +1,138 @@
+"""Near-duplicate index: lookup latency and hit rate over a large article history
+
+Builds a throwaway database holding the index of `history` synthetic source
+texts (words drawn from a Zipf-distributed vocabulary, like news prose),
+then looks up reworded copies of indexed texts and fresh texts. Copies are
+made by replacing a share of the words and dropping a sentence, the way two
+outlets retell the same news.
+
+Run from the project root:
+    python -m benchmarks.bench_dedup [history] [queries]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from config import DEDUP_THRESHOLD
+from database import ArticleRepository, _index_text
+from dedup import signature
+
+HISTORY = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+QUERIES = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+VOCABULARY = 20_000
+LETTERS = "абвгдежзийклмнопрстуфхцчшщыэюя"
+EDIT_RATES = (0.05, 0.15, 0.3)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class TextGenerator:
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.words = [
+            "".join(self.rng.choice(LETTERS) for _ in range(self.rng.randint(2, 11)))
+            for _ in range(VOCABULARY)
+        ]
+        self.cum_weights = list(accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+
+    def sentence(self):
+        words = self.rng.choices(self.words, cum_weights=self.cum_weights, k=self.rng.randint(6, 20))
+        return " ".join(words).capitalize() + "."
+
+    def text(self):
+        return " ".join(self.sentence() for _ in range(self.rng.randint(4, 20)))
+
+    def reword(self, text, rate):
+        """Replace `rate` of the words and drop one sentence"""
+        sentences = text.split(". ")
+        if len(sentences) > 2:
+            del sentences[self.rng.randrange(len(sentences))]
+        words = ". ".join(sentences).split()
+        for index in self.rng.sample(range(len(words)), int(len(words) * rate)):
+            words[index] = self.rng.choice(self.words)
+        return " ".join(words)
+
+
+def report(name, timings):
+    print(f"{name:<10} p50 {percentile(timings, 0.5) * 1e6:.0f} us"
+          f"  p95 {percentile(timings, 0.95) * 1e6:.0f} us"
+          f"  p99 {percentile(timings, 0.99) * 1e6:.0f} us"
+          f"  max {max(timings) * 1e6:.0f} us")
+
+
+def main():
+    generator = TextGenerator()
+    repo = ArticleRepository(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    repo.initialize()
+
+    now = datetime.now()
+    texts = [generator.text() for _ in range(HISTORY)]
+    kept = texts[HISTORY // QUERIES - 1::HISTORY // QUERIES or 1][:QUERIES]
+    start = time.perf_counter()
+    with repo.conn:
+        for article_id, text in enumerate(texts, start=1):
+            _index_text(repo.conn, article_id, text, now)
+    elapsed = time.perf_counter() - start
+    # Move the index out of the WAL into the database file, as the automatic
+    # checkpoints of a running bot do, so lookups read it through mmap
+    repo.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = os.path.getsize(repo.database_file)
+    print(f"history   {HISTORY} texts indexed in {elapsed:.1f} s "
+          f"({elapsed / HISTORY * 1e6:.0f} us each), database {size / 2 ** 20:.0f} MB")
+
+    not_before = now - timedelta(days=1)
+    queries = {f"copy {rate:.0%}": [generator.reword(text, rate) for text in kept] for rate in EDIT_RATES}
+    queries["fresh"] = [generator.text() for _ in kept]
+
+    signing = []
+    for name, texts in queries.items():
+        lookups = []
+        flagged = 0
+        for text in texts:
+            began = time.perf_counter()
+            sig = signature(text)
+            signed = time.perf_counter()
+            matches = repo.find_similar(sig, DEDUP_THRESHOLD, not_before)
+            lookups.append(time.perf_counter() - signed)
+            signing.append(signed - began)
+            flagged += bool(matches)
+        print(f"{name:<10} flagged {flagged}/{len(texts)}"
+              f"  lookup p50 {percentile(lookups, 0.5) * 1e6:.0f} us"
+              f"  p95 {percentile(lookups, 0.95) * 1e6:.0f} us"
+              f"  p99 {percentile(lookups, 0.99) * 1e6:.0f} us")
+    report("signature", signing)
+
+    # What a handler awaits: the lookup plus the hop to the SQLite thread
+    async def through_executor():
+        timings = []
+        for text in queries["copy 15%"]:
+            sig = signature(text)
+            began = time.perf_counter()
+            await repo.run(repo.find_similar, sig, DEDUP_THRESHOLD, not_before)
+            timings.append(time.perf_counter() - began)
+        return timings
+
+    report("awaited", asyncio.run(through_executor()))
+
+    # Enqueueing a text that was just checked, the way a submission goes
+    indexing = []
+    for article_id, text in enumerate(queries["fresh"], start=HISTORY + 1):
+        repo.find_similar(signature(text), DEDUP_THRESHOLD, not_before)
+        began = time.perf_counter()
+        with repo.conn:
+            _index_text(repo.conn, article_id, text, now)
+        indexing.append(time.perf_counter() - began)
+    report("index", indexing)
+    repo.close()
+
+
+if __name__ == "__main__":
+    main()
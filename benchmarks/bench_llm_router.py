@@ -0,0 +1,124 @@
+"""Hedged LLM routing: tail latency with one model versus the router
+
+Starts benchmarks.fake_llm with two models of the same typical latency,
+where a share of requests stall before the first token the way an
+overloaded provider does, and sends the same streamed rewrites once to
+the primary model alone and once through the router with the second model
+as a fallback. Reports time to the first token and to the complete text,
+and how many requests were hedged.
+
+Run from the project root:
+    python -m benchmarks.bench_llm_router [--requests 300] [--stall-rate 0.03] ...
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.fake_llm import FakeLLM
+
+PRIMARY = "fake-primary"
+FALLBACK = "fake-fallback"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="seconds between chunks")
+    parser.add_argument("--stall-rate", type=float, default=0.03, help="share of stalled requests")
+    parser.add_argument("--stall-latency", type=float, default=3.0, help="extra seconds of a stall")
+    parser.add_argument("--hedge-delay", type=float, default=1.0,
+                        help="hedge delay until the p95 latency is known")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, latencies):
+    print(
+        f"{name:<22} p50 {percentile(latencies, 0.5) * 1000:.0f} ms"
+        f"  p95 {percentile(latencies, 0.95) * 1000:.0f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+        f"  max {max(latencies) * 1000:.0f} ms"
+    )
+
+
+async def run(service, args):
+    first_tokens = []
+    totals = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(number):
+        async with semaphore:
+            started = time.perf_counter()
+            first = None
+            # force skips the rewrite cache so every request reaches the server
+            async for _ in service.stream_rewrite(f"Новость номер {number}", force=True):
+                if first is None:
+                    first = time.perf_counter() - started
+            first_tokens.append(first)
+            totals.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(number) for number in range(args.requests)))
+    return first_tokens, totals
+
+
+async def main():
+    args = parse_args()
+    llm = FakeLLM(
+        latency=args.latency, token_delay=args.token_delay,
+        stall_rate=args.stall_rate, stall_latency=args.stall_latency, seed=args.seed,
+    )
+    await llm.start()
+
+    # config.py reads these at import time
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update({
+        "BOT_TOKEN": "123456:bench",
+        "API_KEY": "bench",
+        "METRICS_PORT": "0",
+    })
+    from config import TEXT_PROCESSING_PROMPT
+    from database import close_database, initialize_database
+    from llm import RewriteService
+    from metrics import llm_hedged_requests
+
+    logging.getLogger().setLevel(logging.WARNING)
+    initialize_database()
+    services = {
+        "single model": RewriteService(
+            "bench", llm.url, PRIMARY, TEXT_PROCESSING_PROMPT,
+            max_concurrency=args.concurrency * 2, hedge_delay=0,
+        ),
+        "hedged router": RewriteService(
+            "bench", llm.url, PRIMARY, TEXT_PROCESSING_PROMPT,
+            max_concurrency=args.concurrency * 2, fallbacks=[FALLBACK], hedge_delay=args.hedge_delay,
+        ),
+    }
+    try:
+        for name, service in services.items():
+            before = dict(llm.model_requests)
+            first_tokens, totals = await run(service, args)
+            report(f"{name} first token", first_tokens)
+            report(f"{name} complete", totals)
+            sent = {model: count - before.get(model, 0) for model, count in llm.model_requests.items()}
+            print(f"{'':<22} requests " + ", ".join(f"{model} {count}" for model, count in sent.items()))
+            await service.close()
+    finally:
+        await close_database()
+        await llm.stop()
+
+    hedged = {winner: count for (winner,), count in llm_hedged_requests._values.items()}
+    print(f"hedged    {sum(hedged.values())} requests, {hedged.get('hedge', 0)} won by the hedge")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""Throughput of formatting.TelegramHTMLSanitizer against the HTMLParser version it replaced
+
+Both run over the fuzz corpus and over long posts built from the rewrite
+prompt's example, and report MB/s of input.
+
+Run from the project root:
+    python -m benchmarks.bench_sanitize [documents] [rounds]
+"""
+import re
+import sys
+import time
+from html import escape, unescape
+from html.parser import HTMLParser
+
+from benchmarks.sanitize_corpus import CASES, generate
+from config import TEXT_PROCESSING_PROMPT
+from formatting import TelegramHTMLSanitizer, sanitize_html_for_telegram
+
+DOCUMENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+class LegacySanitizer(HTMLParser):
+    """The previous sanitizer, kept verbatim as the baseline"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.result = []
+        self.allowed_tags = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'code', 'pre'}
+        self.tag_stack = []
+        self.dropped_tags = set()
+        self.unclosed_tags = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.allowed_tags:
+            self.result.append(f'<{tag}>')
+            self.tag_stack.append(tag)
+        elif tag in ['ul', 'ol']:
+            self.result.append('\n')
+        elif tag == 'li':
+            self.result.append('• ')
+        else:
+            self.dropped_tags.add(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.allowed_tags and self.tag_stack and self.tag_stack[-1] == tag:
+            self.result.append(f'</{tag}>')
+            self.tag_stack.pop()
+        elif tag == 'li':
+            self.result.append('\n')
+        elif tag in ['ul', 'ol']:
+            self.result.append('\n')
+        elif tag in self.allowed_tags:
+            self.dropped_tags.add(f'/{tag}')
+        else:
+            self.dropped_tags.add(tag)
+
+    def handle_data(self, data):
+        self.result.append(escape(data, quote=False))
+
+    def handle_entityref(self, name):
+        if name in ('lt', 'gt', 'amp', 'quot'):
+            self.result.append(f'&{name};')
+        elif unescape(f'&{name};') != f'&{name};':
+            self.handle_data(unescape(f'&{name};'))
+        else:
+            self.handle_data(f'&{name}')
+
+    def handle_charref(self, name):
+        self.result.append(f'&#{name};')
+
+    def get_sanitized_text(self):
+        while self.tag_stack:
+            tag = self.tag_stack.pop()
+            self.unclosed_tags.add(tag)
+            self.result.append(f'</{tag}>')
+        text = ''.join(self.result)
+        text = re.sub(r'\n{3,}', '\n\n', text)
+        return text.strip()
+
+
+def legacy_sanitize(text):
+    parser = LegacySanitizer()
+    parser.feed(text)
+    parser.close()
+    return parser.get_sanitized_text()
+
+
+def prompt_posts(count):
+    """Article-sized posts made of the prompt's example with some formatting added"""
+    example = TEXT_PROCESSING_PROMPT.split("делай примерно также:")[1].strip()
+    paragraphs = [p for p in re.split(r"\n\s*\n", example) if p.strip()]
+    posts = []
+    for i in range(count):
+        body = []
+        for j in range(len(paragraphs) * (1 + i % 4)):
+            paragraph = paragraphs[j % len(paragraphs)]
+            body.append(f"<b>{paragraph}</b>" if j % 3 == 0 else f"<p>{paragraph} &amp; <i>more</i></p>")
+        posts.append("\n\n".join(body))
+    return posts
+
+
+def throughput(label, sanitize, documents):
+    size = sum(len(document.encode("utf-8")) for document in documents) * ROUNDS
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for document in documents:
+            sanitize(document)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {size / elapsed / 1e6:6.2f} MB/s  {elapsed / ROUNDS / len(documents) * 1e6:8.1f} us/doc")
+    return size / elapsed
+
+
+def main():
+    corpora = {
+        "fuzz": CASES + generate(DOCUMENTS),
+        "posts": prompt_posts(DOCUMENTS // 10 or 1),
+    }
+    sanitizer = TelegramHTMLSanitizer()
+    for name, documents in corpora.items():
+        size = sum(len(document.encode("utf-8")) for document in documents)
+        print(f"{name}: {len(documents)} documents, {size / 1e6:.2f} MB")
+        legacy = throughput("  HTMLParser (old)", legacy_sanitize, documents)
+        fresh = throughput("  sanitize_html_for_telegram", sanitize_html_for_telegram, documents)
+        reused = throughput("  reused sanitizer", sanitizer.sanitize, documents)
+        print(f"  speedup {fresh / legacy:.2f}x, {reused / legacy:.2f}x reused")
+
+
+if __name__ == "__main__":
+    main()
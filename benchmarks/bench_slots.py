@@ -0,0 +1,50 @@
+"""Slot allocation throughput for slots.SlotAllocator
+
+Run from the project root:
+    python -m benchmarks.bench_slots [articles]
+"""
+import random
+import sys
+import time
+from datetime import datetime
+
+from config import POST_BLACKOUT_DATES, POST_TIMES, POST_WEEKDAYS
+from slots import SlotAllocator, parse_template
+
+ARTICLES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+
+def main():
+    template = parse_template(POST_TIMES, POST_WEEKDAYS, POST_BLACKOUT_DATES)
+    allocator = SlotAllocator(template)
+    now = datetime.now()
+
+    start = time.perf_counter()
+    slots = [allocator.allocate(now) for _ in range(ARTICLES)]
+    elapsed = time.perf_counter() - start
+    print(f"allocate  {ARTICLES} articles: {elapsed:.3f} s ({elapsed / ARTICLES * 1e6:.2f} us/op)")
+    print(f"          horizon reaches {slots[-1]:%Y-%m-%d}")
+
+    released = random.sample(slots, ARTICLES // 10)
+    start = time.perf_counter()
+    for slot in released:
+        allocator.release(slot)
+    elapsed = time.perf_counter() - start
+    print(f"release   {len(released)} slots: {elapsed / len(released) * 1e6:.2f} us/op")
+
+    start = time.perf_counter()
+    refilled = [allocator.allocate(now) for _ in released]
+    elapsed = time.perf_counter() - start
+    print(f"reuse     {len(refilled)} slots: {elapsed / len(refilled) * 1e6:.2f} us/op")
+    assert sorted(refilled) == sorted(released)
+
+    fresh = SlotAllocator(template)
+    start = time.perf_counter()
+    for slot in slots:
+        fresh.reserve(slot)
+    elapsed = time.perf_counter() - start
+    print(f"reserve   {ARTICLES} loaded slots: {elapsed / ARTICLES * 1e6:.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
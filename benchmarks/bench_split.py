@@ -0,0 +1,104 @@
+"""Per-article cost of splitting long posts into caption and continuation messages
+
+The corpus is every processed article over the caption limit found in the
+given database (queued and archived), topped up with long posts built from
+the example post in the rewrite prompt.
+
+Run from the project root:
+    python -m benchmarks.bench_split [articles.db] [rounds]
+"""
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from config import TEXT_PROCESSING_PROMPT
+from formatting import (
+    CAPTION_MAX_LENGTH,
+    TelegramHTMLSanitizer,
+    prepare_post,
+    sanitize_html_for_telegram,
+    visible_length,
+)
+
+DATABASE = sys.argv[1] if len(sys.argv) > 1 else "articles.db"
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+MIN_CORPUS = 50
+
+
+def database_posts(path):
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    try:
+        return [
+            row[0]
+            for table in ("articles", "articles_archive")
+            for row in conn.execute(f"SELECT processed_text FROM {table} WHERE processed_text IS NOT NULL")
+        ]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+def example_posts(count):
+    """Long posts made of the prompt's example post with some formatting added"""
+    example = TEXT_PROCESSING_PROMPT.split("делай примерно также:")[1].strip()
+    paragraphs = [p for p in re.split(r"\n\s*\n", example) if p.strip()]
+    posts = []
+    for i in range(count):
+        body = []
+        for j in range(len(paragraphs) * (2 + i % 4)):
+            paragraph = paragraphs[j % len(paragraphs)]
+            body.append(f"<b>{paragraph}</b>" if j % 3 == 0 else paragraph)
+        posts.append("\n\n".join(body))
+    return posts
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    corpus = [
+        sanitize_html_for_telegram(text)
+        for text in database_posts(DATABASE)
+    ]
+    corpus = [html for html in corpus if visible_length(html) > CAPTION_MAX_LENGTH]
+    real = len(corpus)
+    corpus += [sanitize_html_for_telegram(text) for text in example_posts(max(0, MIN_CORPUS - real))]
+
+    sizes = [len(html.encode("utf-8")) for html in corpus]
+    print(f"corpus    {len(corpus)} long posts ({real} from {DATABASE}), "
+          f"{min(sizes)}-{max(sizes)} bytes, mean {sum(sizes) // len(sizes)}")
+
+    timings = []
+    parts = 0
+    parser = TelegramHTMLSanitizer()
+    for html in corpus:
+        # Splitting works from what the sanitizer recorded, as in prepare_post
+        parser.sanitize(html)
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            result = parser.split(CAPTION_MAX_LENGTH)
+        timings.append((time.perf_counter() - start) / ROUNDS)
+        parts += len(result)
+    print(f"split     mean {sum(timings) / len(timings) * 1e6:.1f} us"
+          f"  p99 {percentile(timings, 0.99) * 1e6:.1f} us"
+          f"  max {max(timings) * 1e6:.1f} us per article, {parts / len(corpus):.1f} parts")
+
+    timings = []
+    for html in corpus:
+        start = time.perf_counter()
+        for _ in range(ROUNDS // 10 or 1):
+            prepare_post(html, has_image=True)
+        timings.append((time.perf_counter() - start) / (ROUNDS // 10 or 1))
+    print(f"prepare   mean {sum(timings) / len(timings) * 1e6:.1f} us"
+          f"  p99 {percentile(timings, 0.99) * 1e6:.1f} us per article (sanitize + split)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Replay updates against the webhook server: requests per second and handler latency
+
+Updates are handled inline (not in the background) so each response time
+covers the full handler, including its calls to a local fake Telegram API.
+Pass a JSON array or JSONL file of recorded updates, or run without one to
+replay synthetic admin commands ("-" does the same when passing counts).
+
+Run from the project root:
+    python -m benchmarks.bench_webhook [updates.jsonl] [requests] [concurrency]
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+ADMIN_ID = 505429653
+
+
+def synthetic_updates():
+    for update_id, command in enumerate(["/start", "/help", "/queue"], start=1):
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": ADMIN_ID, "type": "private"},
+                "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "admin"},
+                "text": command,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def replay(url, secret, updates):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+    source = itertools.cycle(updates)
+    latencies = []
+    errors = 0
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=updates[0], headers={}) as response:
+            assert response.status == 401, f"missing secret accepted: {response.status}"
+
+        async def worker(count):
+            nonlocal errors
+            for _ in range(count):
+                update = next(source)
+                started = time.perf_counter()
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        share, extra = divmod(REQUESTS, CONCURRENCY)
+        await asyncio.gather(
+            *(worker(share + (i < extra)) for i in range(CONCURRENCY))
+        )
+        elapsed = time.perf_counter() - started
+
+    return latencies, elapsed, errors
+
+
+async def main():
+    if len(sys.argv) > 1 and sys.argv[1] != "-":
+        updates = load_updates(sys.argv[1])
+    else:
+        updates = list(synthetic_updates())
+
+    # bot.py opens articles.db in the working directory; keep it away from real data
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+    # config.py reads it at import time; 0 turns the metrics server off
+    os.environ["METRICS_PORT"] = "0"
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp import web
+
+    import bot as bot_module
+    from benchmarks.fake_telegram import FakeTelegram
+
+    # Per-update access and event logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    telegram = FakeTelegram()
+    await telegram.start()
+    bot_module.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(telegram.url))
+
+    runner = web.AppRunner(bot_module.create_webhook_app(handle_in_background=False))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{bot_module.WEBHOOK_PATH}"
+
+    try:
+        latencies, elapsed, errors = await replay(url, bot_module.WEBHOOK_SECRET, updates)
+    finally:
+        await runner.cleanup()
+        await bot_module.bot.session.close()
+        await telegram.stop()
+
+    print(f"replayed  {len(latencies)} updates ({len(updates)} distinct), concurrency {CONCURRENCY}")
+    print(f"throughput {len(latencies) / elapsed:.0f} req/s, {errors} errors")
+    print(
+        f"latency   p50 {percentile(latencies, 0.5) * 1000:.1f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+        f"  max {max(latencies) * 1000:.1f} ms"
+    )
+    print(f"telegram  {len(telegram.calls)} API calls")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
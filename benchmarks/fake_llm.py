@@ -0,0 +1,144 @@
+"""Minimal local stand-in for an OpenAI-compatible chat completions API
+
+Answers /chat/completions under any prefix (so both LLM_BASE_URL
+http://host:port/api/v1 and http://host:port/v1 work), streamed or not,
+with a canned channel post and token usage. `latency` delays the first
+token (`model_latency` overrides it per requested model), `token_delay`
+every following chunk, and `error_rate` makes that share of requests fail
+with a rate limit or a server error. `stall_rate` of the requests wait
+`stall_latency` more before the first token, like an overloaded provider.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+POST = (
+    "⚓️ <b>{title}</b>\n\n"
+    "🔹 <b>Детали</b>\n"
+    "Судовладелец продал балкер постройки 2020 года за $64 млн. "
+    "Судно перейдёт к новому владельцу в конце года.\n\n"
+    "🔹 <b>Контекст рынка</b>\n"
+    "- Последняя аналогичная сделка прошла в декабре.\n"
+    "- Средний возраст флота — четыре года.\n\n"
+    "#сделкибалкеры #залоговыйлоцман"
+)
+
+
+class FakeLLM:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_delay=0.0, chunk_size=16,
+                 error_rate=0.0, model_latency=None, stall_rate=0.0, stall_latency=0.0, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_delay = token_delay
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.model_latency = model_latency or {}
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.requests = 0
+        self.model_requests = {}
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api/v1"
+
+    def _content(self, messages):
+        text = messages[-1]["content"] if messages else ""
+        title = " ".join(text.split()[:6]) or "Публикация"
+        return POST.format(title=title.replace("<", "&lt;"))
+
+    def _usage(self, messages, content):
+        # About four characters per token is close enough for load tests
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    async def _handle(self, request):
+        self.requests += 1
+        body = await request.json()
+        model = body.get("model", "fake")
+        self.model_requests[model] = self.model_requests.get(model, 0) + 1
+        latency = self.model_latency.get(model, self.latency)
+        if self._random.random() < self.stall_rate:
+            latency += self.stall_latency
+        if latency:
+            await asyncio.sleep(latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            if self._random.random() < 0.5:
+                return web.json_response(
+                    {"error": {"message": "Rate limit exceeded", "code": 429}}, status=429
+                )
+            return web.json_response(
+                {"error": {"message": "Upstream error", "code": 502}}, status=502
+            )
+
+        messages = body.get("messages", [])
+        content = self._content(messages)
+        usage = self._usage(messages, content)
+        completion_id = f"chatcmpl-{next(self._ids)}"
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices, **extra):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        for start in range(0, len(content), self.chunk_size):
+            if start and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            piece = content[start:start + self.chunk_size]
+            await send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/{prefix:.*}chat/completions", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Port 0 binds an ephemeral port; read back the real one
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
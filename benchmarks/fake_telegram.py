@@ -0,0 +1,135 @@
+"""Minimal local stand-in for the Telegram Bot API
+
+Answers every method with a plausible result so handlers can run without
+network access. Point a bot at it with:
+    bot.session = AiohttpSession(api=TelegramAPIServer.from_base(server.url))
+
+`latency` delays every answer; `error_rate` makes that share of sends to
+channels (chat ids starting with @) fail with a flood wait or a server
+error, the failures the publisher is meant to retry.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+# Methods whose result is a bare True rather than a Message
+TRUE_METHODS = {
+    "answercallbackquery",
+    "deletemessage",
+    "deletewebhook",
+    "sendchataction",
+    "setwebhook",
+}
+
+
+def _chat_id(value):
+    # Channels are addressed by @username; give them a stable negative id
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1000000000000
+
+
+# Methods that publish to a channel and may get injected errors
+SEND_METHODS = {"sendmessage", "sendphoto", "sendmediagroup"}
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, retry_after=1, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = []
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _handle(self, request):
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls.append((method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if (
+            method in SEND_METHODS
+            and str(params.get("chat_id", "")).startswith("@")
+            and self._random.random() < self.error_rate
+        ):
+            self.errors += 1
+            return self._error()
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _error(self):
+        if self._random.random() < 0.5:
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        return web.json_response(
+            {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+        )
+
+    def _result(self, method, params):
+        if method in TRUE_METHODS:
+            return True
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": _chat_id(params.get("chat_id")), "type": "private"},
+        }
+        if "text" in params:
+            message["text"] = str(params["text"])
+        if "caption" in params:
+            message["caption"] = str(params["caption"])
+        if method == "sendphoto":
+            message["photo"] = self._photo()
+        if method == "sendmediagroup":
+            media = params.get("media") or []
+            if isinstance(media, str):
+                # Multipart requests carry the media list as a JSON string
+                media = json.loads(media)
+            messages = [message]
+            for _ in media[1:]:
+                messages.append(dict(message, message_id=next(self._message_ids)))
+            return [dict(part, photo=self._photo()) for part in messages]
+        return message
+
+    def _photo(self):
+        # Sizes of the sent photo, largest last, as handlers read photo[-1]
+        file_id = f"fake-photo-{next(self._file_ids)}"
+        return [
+            {"file_id": f"{file_id}-s", "file_unique_id": f"{file_id}-s", "width": 90, "height": 90},
+            {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280},
+        ]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Port 0 binds an ephemeral port; read back the real one
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
@@ -0,0 +1,88 @@
+"""Fuzz formatting.TelegramHTMLSanitizer against its output invariants
+
+Every document from benchmarks.sanitize_corpus is sanitized whole and in
+random chunks, and the result is checked to be markup Telegram accepts:
+only supported tags, properly nested, no bare < or &, no blank-line runs,
+and the same output however the input was chunked.
+
+Run from the project root:
+    python -m benchmarks.fuzz_sanitize [documents] [seed]
+"""
+import random
+import re
+import sys
+import time
+
+from benchmarks.sanitize_corpus import CASES, generate
+from formatting import TelegramHTMLSanitizer, split_post, visible_length
+
+DOCUMENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+# Limits of split_post's first part (the caption) and of the rest
+FIRST_LIMIT = 200
+LIMIT = 400
+
+OUTPUT_TAG = re.compile(
+    r'<(?:(b|strong|i|em|u|ins|s|strike|del|pre|code|tg-spoiler|blockquote)'
+    r'|a href="[^"<>]*"|code class="language-[\w+#.-]+"|blockquote expandable)>'
+    r'|</(b|strong|i|em|u|ins|s|strike|del|pre|code|tg-spoiler|blockquote|a)>'
+)
+ENTITY = re.compile(r"&(?:lt|gt|amp|quot|#\d+|#[xX][0-9a-fA-F]+);")
+
+
+def check(html):
+    """Raise AssertionError if `html` is not markup Telegram would accept"""
+    stack = []
+    pos = 0
+    for match in re.finditer(r"<[^>]*>", html):
+        assert "<" not in html[pos:match.start()], f"bare < in {html!r}"
+        pos = match.end()
+        tag = OUTPUT_TAG.fullmatch(match.group())
+        assert tag, f"unsupported tag {match.group()!r} in {html!r}"
+        if tag.group(2):
+            assert stack and stack.pop() == tag.group(2), f"misnested {match.group()!r} in {html!r}"
+        else:
+            stack.append(re.match(r"<([\w-]+)", match.group()).group(1))
+    assert "<" not in html[pos:], f"bare < in {html!r}"
+    assert not stack, f"unclosed {stack} in {html!r}"
+    text = re.sub(r"<[^>]*>", "", html)
+    assert ">" not in text, f"bare > in {html!r}"
+    assert "&" not in ENTITY.sub("", text), f"bare & in {html!r}"
+    assert "\n\n\n" not in html, f"blank-line run in {html!r}"
+    assert html == html.strip(), f"untrimmed {html!r}"
+
+
+def chunked(sanitizer, document, rng):
+    sanitizer.reset()
+    pos = 0
+    while pos < len(document):
+        size = rng.randint(1, 16)
+        sanitizer.feed(document[pos:pos + size])
+        pos += size
+    sanitizer.close()
+    return sanitizer.get_sanitized_text()
+
+
+def main():
+    rng = random.Random(SEED)
+    documents = CASES + generate(DOCUMENTS, SEED)
+    sanitizer = TelegramHTMLSanitizer()
+    slowest = (0, "")
+    start = time.perf_counter()
+    for document in documents:
+        began = time.perf_counter()
+        html = sanitizer.sanitize(document)
+        slowest = max(slowest, (time.perf_counter() - began, document))
+        check(html)
+        assert chunked(sanitizer, document, rng) == html, f"chunking changed output of {document!r}"
+        for index, part in enumerate(split_post(html, FIRST_LIMIT, LIMIT)):
+            check(part)
+            limit = FIRST_LIMIT if index == 0 else LIMIT
+            assert visible_length(part) <= limit, f"part {index} over {limit} in {html!r}"
+    elapsed = time.perf_counter() - start
+    print(f"fuzz      {len(documents)} documents passed in {elapsed:.2f} s, "
+          f"slowest {slowest[0] * 1e3:.2f} ms ({len(slowest[1])} chars)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""End-to-end load test against local fake Telegram and LLM servers
+
+Runs the real dispatcher, database.py, slot allocators, post scheduler and
+publisher in one process, with the network replaced by benchmarks.fake_telegram
+and benchmarks.fake_llm. Three phases:
+
+  submit   synthetic admins each walk /new_article -> text -> Skip through the
+           dispatcher, with the rewrite streamed from the fake LLM
+  enqueue  thousands of articles are inserted and assigned slots
+  post     every queued delivery is made due at once and published
+
+Each phase reports throughput and p50/p95/p99 latency; the whole run also
+reports how long the event loop was blocked. Nothing touches real data:
+the database lives in a temporary directory.
+
+Run from the project root:
+    python -m benchmarks.load_test [--admins 20] [--articles 5000] [--llm-latency 0.2] ...
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.fake_telegram import FakeTelegram
+
+CHANNELS = "@load_one,@load_two"
+# Synthetic admins get ids well away from real users
+FIRST_ADMIN_ID = 9_000_000_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--admins", type=int, default=20, help="concurrent synthetic admins")
+    parser.add_argument("--submissions", type=int, default=5, help="/new_article flows per admin")
+    parser.add_argument("--articles", type=int, default=5000, help="articles enqueued in bulk")
+    parser.add_argument("--batch", type=int, default=500, help="articles per add_articles call")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="seconds per Bot API call")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0,
+                        help="share of channel sends failing with 429 or 500")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument("--llm-token-delay", type=float, default=0.005, help="seconds between chunks")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of failing completions")
+    parser.add_argument("--post-timeout", type=float, default=600, help="give up posting after this")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, latencies, elapsed, unit="ops"):
+    if not latencies:
+        print(f"{name:<9} nothing measured")
+        return
+    print(
+        f"{name:<9} {len(latencies)} {unit} in {elapsed:.2f} s ({len(latencies) / elapsed:.1f}/s)"
+        f"  p50 {percentile(latencies, 0.5) * 1000:.1f} ms"
+        f"  p95 {percentile(latencies, 0.95) * 1000:.1f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+        f"  max {max(latencies) * 1000:.1f} ms"
+    )
+
+
+class LoopMonitor:
+    """Samples event loop lag with short sleeps; lag above `threshold` counts as blocking"""
+
+    def __init__(self, interval=0.005, threshold=0.01):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self):
+        blocked = [lag for lag in self.lags if lag > self.threshold]
+        print(
+            f"loop      blocked {sum(blocked):.2f} s in {len(blocked)} stalls over "
+            f"{self.threshold * 1000:.0f} ms, max lag {max(self.lags, default=0) * 1000:.1f} ms, "
+            f"p99 lag {percentile(self.lags, 0.99) * 1000 if self.lags else 0:.1f} ms"
+        )
+
+
+def article_text(rng, number):
+    words = ["судно", "балкер", "верфь", "фрахт", "танкер", "контейнеровоз", "порт", "сделка"]
+    sentences = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(6, 14))).capitalize() + "."
+        for _ in range(rng.randint(3, 40))
+    ]
+    return f"Новость {number}. " + " ".join(sentences)
+
+
+class Admin:
+    """A synthetic admin talking to the dispatcher in their own private chat"""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, bot_module, user_id):
+        self.bot_module = bot_module
+        self.user_id = user_id
+        self._message_ids = itertools.count(1)
+
+    def _update(self, text):
+        from aiogram.types import Update
+
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"admin{self.user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update.model_validate(
+            {"update_id": next(self._update_ids), "message": message},
+            context={"bot": self.bot_module.bot},
+        )
+
+    async def send(self, text):
+        """Feed one message through the dispatcher and return how long handling took"""
+        started = time.perf_counter()
+        await self.bot_module.dp.feed_update(self.bot_module.bot, self._update(text))
+        return time.perf_counter() - started
+
+
+async def submit_phase(bot_module, args, rng):
+    admins = [Admin(bot_module, FIRST_ADMIN_ID + i) for i in range(args.admins)]
+    bot_module.ADMIN_USER_IDS.update(admin.user_id for admin in admins)
+    updates, flows = [], []
+
+    async def run(admin):
+        for _ in range(args.submissions):
+            started = time.perf_counter()
+            for text in ("/new_article", article_text(rng, admin.user_id), "Skip"):
+                updates.append(await admin.send(text))
+            flows.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(admin) for admin in admins))
+    elapsed = time.perf_counter() - started
+    report("submit", flows, elapsed, "flows")
+    report("  update", updates, elapsed, "updates")
+
+
+async def enqueue_phase(bot_module, args, rng):
+    from database import add_articles
+    from formatting import prepare_post
+
+    latencies = []
+    started = time.perf_counter()
+    for offset in range(0, args.articles, args.batch):
+        batch = []
+        for number in range(offset, min(args.articles, offset + args.batch)):
+            processed = article_text(rng, number)
+            # About a third of the posts carry an image already uploaded to Telegram
+            file_id = f"fake-file-{number}" if number % 3 == 0 else None
+            batch.append((processed, processed, None, file_id, None, prepare_post(processed, bool(file_id))))
+        began = time.perf_counter()
+        await add_articles(batch, channels=bot_module.CHANNELS)
+        latencies.append(time.perf_counter() - began)
+    inserted = time.perf_counter() - started
+    report("insert", latencies, inserted, "batches")
+
+    began = time.perf_counter()
+    await bot_module.schedule_new_articles()
+    print(f"schedule  slots for all deliveries in {time.perf_counter() - began:.2f} s")
+
+
+async def post_phase(bot_module, args):
+    from database import count_by_status, get_queued_deliveries
+
+    scheduler = bot_module.post_scheduler
+    post_delivery = scheduler._post_callback
+    latencies = []
+    attempted = set()
+
+    async def timed(delivery_id):
+        began = time.perf_counter()
+        try:
+            await post_delivery(delivery_id)
+        finally:
+            latencies.append(time.perf_counter() - began)
+            attempted.add(delivery_id)
+
+    scheduler._post_callback = timed
+    deliveries = await get_queued_deliveries()
+    now = datetime.now()
+    started = time.perf_counter()
+    for delivery_id, _, _, _ in deliveries:
+        scheduler.schedule(delivery_id, now)
+
+    deadline = started + args.post_timeout
+    # Failed sends go back on the schedule with a backoff of minutes; don't wait for them
+    while len(attempted) < len(deliveries) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    scheduler._post_callback = post_delivery
+
+    counts = await count_by_status()
+    report("post", latencies, elapsed, "attempts")
+    print(
+        "          deliveries "
+        + ", ".join(f"{status} {count}" for (table, status), count in sorted(counts.items())
+                    if table == "deliveries")
+    )
+
+
+async def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    telegram = FakeTelegram(latency=args.telegram_latency, error_rate=args.telegram_error_rate, seed=args.seed)
+    llm = FakeLLM(
+        latency=args.llm_latency, token_delay=args.llm_token_delay,
+        error_rate=args.llm_error_rate, seed=args.seed,
+    )
+    await telegram.start()
+    await llm.start()
+
+    # config.py reads these at import time; bot.py opens articles.db in the working directory
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update({
+        "BOT_TOKEN": "123456:load-test",
+        "API_KEY": "load-test",
+        "LLM_BASE_URL": llm.url,
+        "CHANNELS": CHANNELS,
+        "METRICS_PORT": "0",
+        "STREAM_EDIT_INTERVAL": "0.1",
+        # Synthetic texts share a tiny vocabulary and would all be flagged as duplicates
+        "DEDUP_WINDOW_DAYS": "0",
+        # Measure the bot, not Telegram's rate limits
+        "PUBLISH_GLOBAL_RATE": "100000",
+        "PUBLISH_CHAT_RATE_PER_MINUTE": "6000000",
+        "PUBLISH_CONCURRENCY": "32",
+    })
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+
+    # Per-update logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    bot_module.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(telegram.url))
+
+    monitor = LoopMonitor()
+    monitor.start()
+    await bot_module.on_startup()
+    try:
+        await submit_phase(bot_module, args, rng)
+        await enqueue_phase(bot_module, args, rng)
+        await post_phase(bot_module, args)
+    finally:
+        await monitor.stop()
+        await bot_module.on_shutdown()
+        await bot_module.bot.session.close()
+        await llm.stop()
+        await telegram.stop()
+
+    monitor.report()
+    print(f"telegram  {len(telegram.calls)} API calls, {telegram.errors} injected errors")
+    print(f"llm       {llm.requests} requests, {llm.errors} injected errors")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""Inputs for the HTML sanitizer fuzzer and benchmark
+
+CASES are hand-picked inputs the old sanitizer got wrong or that sit on
+a parser edge. generate() builds random documents out of well-formed,
+broken and hostile fragments; the same seed always gives the same corpus.
+"""
+import random
+
+CASES = [
+    "",
+    "   \n\n  ",
+    "plain text",
+    "<b>bold</b> <i>italic</i> <u>under</u> <s>strike</s>",
+    "<b><i>interleaved</b> text after</i> tail",
+    "<i>unclosed <b>twice",
+    "</b>closing first<b>",
+    "a < b > c & d",
+    "AT&T &copy; &nbsp; &amp &ampx &#60; &#x3C; &#x; &#; &unknown;",
+    "<3 and <-- not tags -->",
+    "<!-- comment --><!DOCTYPE html><?xml version='1.0'?>after",
+    '<a href="https://example.com/?a=1&b=2">link</a>',
+    "<a href='tg://user?id=1'>single quotes</a> <a href=bare>bare</a>",
+    '<a>no href</a> <a href="x"><a href="y">nested</a></a>',
+    '<a href="x" onclick="alert(1)">attributes</a>',
+    '<span class="tg-spoiler">spoiler</span> <tg-spoiler>spoiler</tg-spoiler> <span>plain</span>',
+    "<blockquote>quote</blockquote><blockquote expandable>long quote</blockquote>",
+    '<pre><code class="language-python">print("<b>")</code></pre>',
+    '<pre><code class="language-&quot;><script>">x</code></pre>',
+    "<code><b>no formatting</b> in code</code>",
+    "<ul><li>one</li><li>two<ol><li>nested</li></ol></li></ul>",
+    "line<br>break<br/>again<BR />upper",
+    "<P>Upper <B>case</B> tags</P>",
+    "<script>alert('x')</script><style>p {}</style>",
+    "\n\n\n\n\nmany\n\n\n\n\nblank\n\n\n\n\nlines\n\n\n",
+    "<b>\n\n\n\n</b>\n\n\n\n<i>split runs</i>",
+    "<a href=\"x\n" + "y\">newline in attribute</a>",
+    "<" + " " * 1000 + "unterminated",
+    "&" * 500,
+    "<b>" * 200 + "deep" + "</b>" * 200,
+    "<b>" * 200 + "never closed",
+    "emoji 😀 and кириллица <b>жирный</b>",
+]
+
+FRAGMENTS = [
+    "word", "слово", "😀", " ", "  ", "\n", "\n\n\n", "\t",
+    "<b>", "</b>", "<strong>", "</strong>", "<i>", "</i>", "<em>", "</em>", "<u>", "</u>",
+    "<s>", "</s>", "<del>", "</del>", "<code>", "</code>", "<pre>", "</pre>",
+    '<code class="language-py">', '<a href="https://example.com/a?b=1&c=2">', "<a>", "</a>",
+    '<span class="tg-spoiler">', "<span>", "</span>", "<tg-spoiler>", "</tg-spoiler>",
+    "<blockquote>", "<blockquote expandable>", "</blockquote>",
+    "<ul>", "</ul>", "<ol>", "</ol>", "<li>", "</li>", "<br>", "<p>", "</p>", "<div class=x>", "</div>",
+    "<", ">", "&", "&amp;", "&lt;", "&gt;", "&quot;", "&copy;", "&nbsp;", "&#1076;", "&#x1F600;", "&bogus;",
+    "<!-- c -->", "<!DOCTYPE html>", '<img src="x.png">', "<script>", "</script>",
+    "<b", "a href=", '"', "'", "=", "/", "</", "<1>",
+]
+
+
+def generate(count, seed=0, size=200):
+    """`count` random documents of about `size` fragments each"""
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        length = rng.randint(1, size * 2)
+        documents.append("".join(rng.choice(FRAGMENTS) for _ in range(length)))
+    return documents
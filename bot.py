@@ -1,43 +1,128 @@
 import asyncio
+import json
 import logging
+import signal
+import socket
 import sys
+import uuid
+import time
+from collections import defaultdict, namedtuple
+from contextlib import aclosing
 from datetime import datetime, timedelta
+from typing import Optional
 import os
+from aiohttp import web
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from html import escape
-import re
-from html.parser import HTMLParser
 
 from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     Message,
     ReplyKeyboardMarkup,
     KeyboardButton,
     ReplyKeyboardRemove,
     FSInputFile,
+    InputMediaPhoto,
 )
 
 from config import (
     BOT_TOKEN,
-    API_KEY,
-    TEXT_PROCESSING_PROMPT,
-    CHANNEL_NAME,
-    MODEL,
+    CHANNELS,
+    CHANNEL_SCHEDULES,
+    POST_TIMES,
+    POST_WEEKDAYS,
+    POST_BLACKOUT_DATES,
+    IMAGE_MAX_AGE_DAYS,
+    IMAGE_DIR_MAX_MB,
+    IMAGE_DOWNLOAD_CONCURRENCY,
+    IMAGE_MAX_SIDE,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_WORKERS,
+    PUBLISH_GLOBAL_RATE,
+    PUBLISH_CHAT_RATE_PER_MINUTE,
+    PUBLISH_CONCURRENCY,
+    PUBLISH_MAX_ATTEMPTS,
+    POST_MAX_FAILURES,
+    FAILED_ARTICLE_RETENTION_DAYS,
+    POST_LEASE_SECONDS,
+    STREAM_EDIT_INTERVAL,
+    BULK_CONCURRENCY,
+    DEDUP_THRESHOLD,
+    DEDUP_WINDOW_DAYS,
+    FSM_STORAGE,
+    FSM_STATE_TTL_HOURS,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    METRICS_HOST,
+    METRICS_PORT,
+    BACKUP_INTERVAL_HOURS,
 )
 from database import (
     initialize_database,
+    rebuild_derived_data,
+    close_database,
     add_article,
+    add_articles,
     get_queued_articles,
+    get_queue_page,
     get_article_by_id,
     delete_article,
-    update_time_scheduled,
+    get_queued_deliveries,
+    get_article_deliveries,
+    get_unscheduled_deliveries,
+    update_delivery_scheduled,
+    claim_delivery,
+    renew_delivery_lease,
+    record_delivery_part,
+    release_delivery,
+    mark_delivery_posted,
+    record_delivery_failure,
+    mark_delivery_failed,
+    mark_delivery_unconfirmed,
+    requeue_unconfirmed,
+    recover_expired_claims,
+    update_image_file_id,
+    get_queued_image_paths,
+    set_image_paths,
+    update_album_file_ids,
+    archive_finished_articles,
+    count_by_status,
+    find_similar,
+    evict_signatures,
+)
+from llm import rewrite_service
+from post_scheduler import PostScheduler
+from slots import SlotAllocator, parse_template
+from backup import create_backup
+from images import ALBUM_MAX_SIZE, IMAGES_DIR, AlbumCollector, ImagePipeline, cleanup_images
+from publisher import Publisher, PublishOutcomeUnknown
+from bulk import parse_document, split_text
+from dedup import signature, similarity
+from formatting import MODE_PHOTO, PreparedPost, prepare_post, sanitize_html_for_telegram
+from fsm_storage import SQLiteStorage, create_storage
+from metrics import (
+    MetricsServer,
+    backup_last_success,
+    backup_seconds,
+    backups,
+    post_failures,
+    post_seconds,
+    queue_depth,
+    registry,
 )
-from openai import OpenAI
 import functools
 
 # Configure logging
@@ -46,16 +131,28 @@ logging.basicConfig(level=logging.INFO)
 # Admin user IDs
 ADMIN_USER_IDS = {505429653, 409472138}
 
+# Identifies this process in delivery claims, so several instances can share the queue
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+POST_LEASE = timedelta(seconds=POST_LEASE_SECONDS)
+
+
+def new_claim():
+    """Token for one claim of a delivery; a later claim of it, even by this process, gets another"""
+    return f"{WORKER_ID}:{uuid.uuid4().hex}"
+
 def admin_required(func):
     """Decorator to check if user is admin before executing command"""
     
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        # Extract message from args (first argument)
+        # Extract message or callback query from args (first argument)
         message = args[0] if args else kwargs.get('message')
         user_id = message.from_user.id
         if user_id not in ADMIN_USER_IDS:
-            await message.reply("❌ Доступ запрещен. Эта команда доступна только администраторам.")
+            if isinstance(message, CallbackQuery):
+                await message.answer("❌ Доступ запрещен.", show_alert=True)
+            else:
+                await message.reply("❌ Доступ запрещен. Эта команда доступна только администраторам.")
             logging.warning(f"Unauthorized access attempt by user {user_id} (@{message.from_user.username})")
             return
         return await func(*args, **kwargs)
@@ -63,18 +160,50 @@ def admin_required(func):
 
 # Initialize bot and dispatcher
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# Initialize database
+# Initialize database before the FSM storage, which may live in it
 initialize_database()
 
+storage = create_storage(FSM_STORAGE, timedelta(hours=FSM_STATE_TTL_HOURS))
+dp = Dispatcher(storage=storage)
+
 # Create router for article submission
 article_router = Router()
 
+# Local image copies are a fallback for when a file_id stops working, so they
+# are fetched in the background instead of holding up the admin
+image_pipeline = ImagePipeline(
+    IMAGES_DIR,
+    bot.download,
+    concurrency=IMAGE_DOWNLOAD_CONCURRENCY,
+    max_side=IMAGE_MAX_SIDE,
+    quality=IMAGE_JPEG_QUALITY,
+    workers=IMAGE_WORKERS,
+)
+album_collector = AlbumCollector()
+
+
+def store_images(article_id, file_ids):
+    """Download local copies of an article's images in the background"""
+    image_pipeline.submit(file_ids, functools.partial(set_image_paths, article_id))
+
+
+async def collect_album(message):
+    """The photo messages of the album `message` belongs to, in order
+
+    Returns None for every part but the one that completes the album.
+    """
+    if not message.media_group_id:
+        return [message]
+    # Each photo of an album arrives as its own update
+    messages = await album_collector.collect(message.media_group_id, message)
+    if messages is None:
+        return None
+    return sorted(messages, key=lambda part: part.message_id)[:ALBUM_MAX_SIZE]
+
 
 class ArticleSubmission(StatesGroup):
     waiting_for_text = State()
+    confirming_duplicate = State()
     waiting_for_image = State()
 
 
@@ -84,10 +213,11 @@ async def start_command(message: Message):
     help_text = """Добро пожаловать в ShipAI! 🚢
 
 Доступные команды:
-/new_article - Добавить публикацию в очередь
+/new_article [@канал ...] - Добавить публикацию в очередь (по умолчанию во все каналы)
+/bulk [@канал ...] - Массовый импорт публикаций
 /queue - Посмотреть очередь публикаций
 /delete id - Удалить публикацию из очереди
-/post_now id - Отправить публикацию немедленно в канал
+/post_now id - Отправить публикацию немедленно во все её каналы
 /cancel - Отменить текущую операцию
 /help - Показать это сообщение
 
@@ -101,56 +231,201 @@ async def start_command(message: Message):
 @admin_required
 async def help_command(message: Message):
     help_text = """Доступные команды:
-/new_article - Добавить публикацию в очередь
+/new_article [@канал ...] - Добавить публикацию в очередь (по умолчанию во все каналы)
+/bulk [@канал ...] - Массовый импорт публикаций
 /queue - Посмотреть очередь публикаций
 /delete id - Удалить публикацию из очереди
-/post_now id - Отправить публикацию немедленно в канал
+/post_now id - Отправить публикацию немедленно во все её каналы
 /cancel - Отменить текущую операцию
 /help - Показать это сообщение"""
 
     await message.reply(help_text)
 
 
+async def parse_target_channels(message):
+    """Channels listed after the command, or all configured ones; None if any is unknown"""
+    channels = message.text.split()[1:] or CHANNELS
+    unknown = [channel for channel in channels if channel not in CHANNELS]
+    if unknown:
+        await message.reply(
+            f"Неизвестные каналы: {', '.join(unknown)}. Доступные: {', '.join(CHANNELS)}"
+        )
+        return None
+    return channels
+
+
 @article_router.message(Command("new_article"))
 @admin_required
 async def new_article_command(message: Message, state: FSMContext):
+    channels = await parse_target_channels(message)
+    if channels is None:
+        return
+
+    await state.update_data(channels=channels)
     await message.reply("Отправьте текст оригинальной публикации.")
     await state.set_state(ArticleSubmission.waiting_for_text)
 
 
+# Stop events of rewrites currently streaming, by admin user id
+active_rewrites = {}
+
+# Telegram rejects messages longer than this
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+stop_rewrite_keyboard = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="Остановить", callback_data="stop_rewrite")]]
+)
+
+
+async def edit_preview(preview, text, **kwargs):
+    """Edit the streaming preview; returns False if Telegram rejected the edit"""
+    if not text:
+        return False
+    try:
+        await preview.edit_text(text[:TELEGRAM_MESSAGE_LIMIT], **kwargs)
+        return True
+    except TelegramBadRequest as e:
+        # Usually "message is not modified" or a partial tag in HTML mode
+        logging.debug(f"Preview edit skipped: {e}")
+        return False
+
+
+async def stream_rewrite_preview(preview, original_text, stop_event):
+    """Stream the rewrite into the preview message; returns None if the admin stopped it"""
+    processed_text = ""
+    last_edit = 0
+    async with aclosing(rewrite_service.stream_rewrite(original_text)) as chunks:
+        async for processed_text in chunks:
+            if stop_event.is_set():
+                return None
+            # Edits are throttled to stay inside Telegram's edit rate limits
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL:
+                last_edit = now
+                # Partial HTML is shown as plain text until the rewrite is complete
+                await edit_preview(
+                    preview, processed_text, parse_mode=None, reply_markup=stop_rewrite_keyboard
+                )
+
+    if not await edit_preview(preview, sanitize_html_for_telegram(processed_text)):
+        await edit_preview(preview, processed_text, parse_mode=None)
+    return processed_text
+
+
+def format_post_warnings(warnings):
+    """Problems found while preparing the post, as a block to append to a reply"""
+    if not warnings:
+        return ""
+    return "\n\n" + "\n".join(f"⚠️ {escape(warning)}" for warning in warnings)
+
+
+DUPLICATE_STATUSES = {
+    "queued": "в очереди",
+    "posted": "опубликована",
+    "failed": "не отправлена",
+}
+
+
+async def find_duplicates(sig):
+    """Recent articles whose original text is a likely copy, as (id, similarity, status)"""
+    if sig is None or DEDUP_WINDOW_DAYS <= 0:
+        return []
+    not_before = datetime.now() - timedelta(days=DEDUP_WINDOW_DAYS)
+    return await find_similar(sig, DEDUP_THRESHOLD, not_before)
+
+
+def format_duplicate(article_id, score, status):
+    status = DUPLICATE_STATUSES.get(status, "в архиве")
+    return f"#{article_id} ({score:.0%}, {status})"
+
+
+@article_router.callback_query(F.data == "stop_rewrite")
+async def stop_rewrite_callback(callback: CallbackQuery):
+    stop_event = active_rewrites.get(callback.from_user.id)
+    if stop_event:
+        stop_event.set()
+    await callback.answer("Обработка остановлена")
+
+
 @article_router.message(ArticleSubmission.waiting_for_text)
 async def process_article_text(message: Message, state: FSMContext):
     original_text = message.text
-    await message.reply("Текст в обработке...")
+    # Checked before the rewrite so copies of the same news don't cost an LLM call
+    duplicates = await find_duplicates(signature(original_text or ""))
+    if duplicates:
+        await state.update_data(original_text=original_text)
+        await state.set_state(ArticleSubmission.confirming_duplicate)
+        keyboard = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="Continue")], [KeyboardButton(text="Cancel")]],
+            resize_keyboard=True,
+        )
+        await message.reply(
+            "⚠️ Похожие публикации уже есть: "
+            + ", ".join(format_duplicate(*duplicate) for duplicate in duplicates)
+            + ".\n\nContinue - всё равно обработать текст, Cancel - отменить.",
+            reply_markup=keyboard,
+        )
+        return
+    await rewrite_article_text(message, state, original_text)
 
-    try:
-        client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=API_KEY)
 
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "user", "content": TEXT_PROCESSING_PROMPT},
-                {"role": "user", "content": original_text},
-            ],
-        )
+@article_router.message(
+    ArticleSubmission.confirming_duplicate, F.text.casefold() == "continue"
+)
+async def confirm_duplicate_text(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await rewrite_article_text(message, state, data["original_text"])
+
 
-        processed_text = completion.choices[0].message.content
+async def rewrite_article_text(message, state, original_text):
+    """Stream the rewrite of a submitted text and ask for the image"""
+    preview = await message.reply("Текст в обработке...", reply_markup=stop_rewrite_keyboard)
+    stop_event = active_rewrites[message.from_user.id] = asyncio.Event()
+
+    try:
+        processed_text = await stream_rewrite_preview(preview, original_text, stop_event)
+        if processed_text is None:
+            await edit_preview(preview, "Обработка остановлена.")
+            await state.clear()
+            return
+
+        # Prepared once for the warnings and kept for add_article if an image follows
+        post = prepare_post(processed_text, has_image=True)
+        if not post.parts:
+            await message.reply(
+                "Обработанный текст пуст, статья не добавлена. Пожалуйста, попробуйте еще раз."
+                + format_post_warnings(post.warnings)
+            )
+            await state.clear()
+            return
 
         # Create keyboard for image submission
         keyboard = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="Skip")], [KeyboardButton(text="Cancel")]],
+            keyboard=[
+                [KeyboardButton(text="Skip")],
+                [KeyboardButton(text="Regenerate")],
+                [KeyboardButton(text="Cancel")],
+            ],
             resize_keyboard=True,
         )
 
         await message.reply(
-            "Текст обработан успешно! Пожалуйста, отправьте изображение (необязательно) или нажмите Skip, чтобы продолжить без изображения.",
+            "Текст обработан успешно! Пожалуйста, отправьте изображение или альбом (необязательно) или нажмите Skip, чтобы продолжить без изображения. Regenerate - обработать текст заново."
+            + format_post_warnings(post.warnings),
             reply_markup=keyboard,
         )
         await state.update_data(
-            original_text=original_text, processed_text=processed_text
+            original_text=original_text, processed_text=processed_text, post=list(post)
         )
         await state.set_state(ArticleSubmission.waiting_for_image)
 
+    except asyncio.TimeoutError:
+        logging.error("Timed out processing text")
+        await message.reply(
+            "Ошибка при обработке текста. Пожалуйста, попробуйте еще раз."
+        )
+        await state.clear()
+
     except Exception as e:
         logging.error(f"Error processing text: {e}")
         await message.reply(
@@ -158,13 +433,21 @@ async def process_article_text(message: Message, state: FSMContext):
         )
         await state.clear()
 
+    finally:
+        active_rewrites.pop(message.from_user.id, None)
+
 
 @article_router.message(
     ArticleSubmission.waiting_for_image, F.text.casefold() == "skip"
 )
 async def skip_article_image(message: Message, state: FSMContext):
     data = await state.get_data()
-    add_article(data["original_text"], data["processed_text"])
+    await add_article(
+        data["original_text"],
+        data["processed_text"],
+        channels=data.get("channels", CHANNELS),
+    )
+    await schedule_new_articles()
 
     await message.reply(
         "Статья добавлена в очередь без изображения!",
@@ -172,10 +455,11 @@ async def skip_article_image(message: Message, state: FSMContext):
     )
 
     help_text = """Доступные команды:
-/new_article - Добавить публикацию в очередь
+/new_article [@канал ...] - Добавить публикацию в очередь (по умолчанию во все каналы)
+/bulk [@канал ...] - Массовый импорт публикаций
 /queue - Посмотреть очередь публикаций
 /delete id - Удалить публикацию из очереди
-/post_now id - Отправить публикацию немедленно в канал
+/post_now id - Отправить публикацию немедленно во все её каналы
 /cancel - Отменить текущую операцию
 /help - Показать это сообщение"""
 
@@ -184,6 +468,37 @@ async def skip_article_image(message: Message, state: FSMContext):
     await state.clear()
 
 
+@article_router.message(
+    ArticleSubmission.waiting_for_image, F.text.casefold() == "regenerate"
+)
+async def regenerate_article_text(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await message.reply("Текст в обработке...")
+
+    try:
+        # Bypass the rewrite cache and pay for a fresh completion
+        processed_text = await rewrite_service.rewrite(data["original_text"], force=True)
+    except Exception as e:
+        logging.error(f"Error regenerating text: {e}")
+        await message.reply(
+            "Ошибка при обработке текста. Пожалуйста, попробуйте еще раз."
+        )
+        return
+
+    post = prepare_post(processed_text, has_image=True)
+    if not post.parts:
+        await message.reply(
+            "Обработанный текст пуст, сохранён прежний вариант. Нажмите Regenerate ещё раз или Skip."
+            + format_post_warnings(post.warnings)
+        )
+        return
+    await state.update_data(processed_text=processed_text, post=list(post))
+    await message.reply(
+        "Текст обработан заново! Отправьте изображение (необязательно) или нажмите Skip."
+        + format_post_warnings(post.warnings)
+    )
+
+
 @article_router.message(Command("cancel"))
 @admin_required
 async def cancel_command_handler(message: Message, state: FSMContext):
@@ -193,6 +508,9 @@ async def cancel_command_handler(message: Message, state: FSMContext):
         return
 
     logging.info("Cancelling state %r", current_state)
+    stop_event = active_rewrites.get(message.from_user.id)
+    if stop_event:
+        stop_event.set()
     await state.clear()
     await message.reply("Операция отменена.", reply_markup=ReplyKeyboardRemove())
 
@@ -206,32 +524,42 @@ async def cancel_text_handler(message: Message, state: FSMContext):
         return
 
     logging.info("Cancelling state %r", current_state)
+    stop_event = active_rewrites.get(message.from_user.id)
+    if stop_event:
+        stop_event.set()
     await state.clear()
     await message.reply("Операция отменена.", reply_markup=ReplyKeyboardRemove())
 
 
 @article_router.message(ArticleSubmission.waiting_for_image, F.content_type == "photo")
 async def process_article_image(message: Message, state: FSMContext):
-    photo = message.photo[-1]
-
-    # Create images directory if it doesn't exist
-    os.makedirs("images", exist_ok=True)
-
-    image_path = f"images/{photo.file_unique_id}.jpg"
-    await bot.download(photo, destination=image_path)
+    messages = await collect_album(message)
+    if messages is None:
+        return
+    file_ids = [part.photo[-1].file_id for part in messages]
 
     data = await state.get_data()
-    add_article(data["original_text"], data["processed_text"], image_path=image_path)
-
-    await message.reply(
-        "Статья с изображением добавлена в очередь!", reply_markup=ReplyKeyboardRemove()
+    article_id = await add_article(
+        data["original_text"],
+        data["processed_text"],
+        image_file_id=file_ids[0],
+        channels=data.get("channels", CHANNELS),
+        # Prepared for a photo when the text came in; sessions from before have none
+        post=PreparedPost(*data["post"]) if data.get("post") else None,
+        album=file_ids if len(file_ids) > 1 else None,
     )
+    store_images(article_id, file_ids)
+    await schedule_new_articles()
+
+    added = "Статья с изображением" if len(file_ids) == 1 else f"Статья с альбомом из {len(file_ids)} фото"
+    await message.reply(f"{added} добавлена в очередь!", reply_markup=ReplyKeyboardRemove())
     help_text = """
 Доступные команды:
-/new_article - Добавить публикацию в очередь
+/new_article [@канал ...] - Добавить публикацию в очередь (по умолчанию во все каналы)
+/bulk [@канал ...] - Массовый импорт публикаций
 /queue - Посмотреть очередь публикаций
 /delete id - Удалить публикацию из очереди
-/post_now id - Отправить публикацию немедленно в канал
+/post_now id - Отправить публикацию немедленно во все её каналы
 /cancel - Отменить текущую операцию
 /help - Показать это сообщение
 """
@@ -240,23 +568,309 @@ async def process_article_image(message: Message, state: FSMContext):
     await state.clear()
 
 
+# Bulk import router
+bulk_router = Router()
+
+
+class BulkImport(StatesGroup):
+    collecting = State()
+
+
+# Serialises updates of the collected items when an album arrives as parallel updates
+bulk_locks = defaultdict(asyncio.Lock)
+
+
+async def collect_bulk_items(message, state, items, errors=()):
+    async with bulk_locks[message.from_user.id]:
+        data = await state.get_data()
+        bulk_items = data.get("bulk_items", []) + items
+        bulk_errors = data.get("bulk_errors", []) + list(errors)
+        await state.update_data(bulk_items=bulk_items, bulk_errors=bulk_errors)
+
+    reply = f"Добавлено: {len(items)}, всего: {len(bulk_items)}."
+    if errors:
+        reply += f" Пропущено: {len(errors)}."
+    await message.reply(reply + " Отправьте ещё или /done для обработки.")
+
+
+@bulk_router.message(Command("bulk"))
+@admin_required
+async def bulk_command(message: Message, state: FSMContext):
+    channels = await parse_target_channels(message)
+    if channels is None:
+        return
+
+    await state.set_state(BulkImport.collecting)
+    await state.update_data(channels=channels, bulk_items=[], bulk_errors=[])
+    await message.reply(
+        "Отправьте публикации для массового импорта:\n"
+        "• текст, где публикации разделены строкой ---\n"
+        "• документ .txt (разделитель ---) или .jsonl ({\"text\": \"...\"} на строку)\n"
+        "• пересланные сообщения или альбомы (подпись фото становится текстом)\n\n"
+        "Когда всё отправлено, нажмите /done."
+    )
+
+
+@bulk_router.message(BulkImport.collecting, Command("done"))
+async def bulk_done(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    items = data.get("bulk_items", [])
+    if not items:
+        await message.reply("Нет публикаций для импорта.")
+        return
+    await run_bulk_import(
+        message, items, data.get("channels", CHANNELS), data.get("bulk_errors", [])
+    )
+
+
+@bulk_router.message(BulkImport.collecting, F.document)
+async def bulk_document(message: Message, state: FSMContext):
+    content = await bot.download(message.document)
+    try:
+        texts, errors = parse_document(message.document.file_name, content.read())
+    except UnicodeDecodeError:
+        await message.reply("Документ должен быть в кодировке UTF-8.")
+        return
+    errors = [f"{message.document.file_name}, {error}" for error in errors]
+    await collect_bulk_items(message, state, [{"text": text} for text in texts], errors)
+
+
+@bulk_router.message(BulkImport.collecting, F.photo)
+async def bulk_photo(message: Message, state: FSMContext):
+    messages = await collect_album(message)
+    if messages is None:
+        return
+    # An album is one publication; its caption sits on one of the photos
+    caption = next((part.caption for part in messages if part.caption), None)
+    if not caption:
+        await collect_bulk_items(message, state, [], ["фото без подписи"])
+        return
+    file_ids = [part.photo[-1].file_id for part in messages]
+    item = {"text": caption, "image_file_id": file_ids[0]}
+    if len(file_ids) > 1:
+        item["album"] = file_ids
+    await collect_bulk_items(message, state, [item])
+
+
+@bulk_router.message(BulkImport.collecting, F.text, ~F.text.startswith("/"))
+async def bulk_text(message: Message, state: FSMContext):
+    items = [{"text": text} for text in split_text(message.text)]
+    await collect_bulk_items(message, state, items)
+
+
+async def drop_duplicate_items(items):
+    """Split bulk items into (number, item) pairs to rewrite and notes about skipped copies
+
+    An item is skipped when it looks like a recent article or an earlier
+    item of the same import.
+    """
+    unique = []
+    duplicates = []
+    accepted = []
+    for number, item in enumerate(items, start=1):
+        sig = signature(item["text"])
+        matches = await find_duplicates(sig)
+        if matches:
+            duplicates.append(f"#{number}: похожа на {format_duplicate(*matches[0])}")
+            continue
+        if sig is not None and DEDUP_WINDOW_DAYS > 0:
+            earlier = next(
+                (
+                    other for other, other_sig in accepted
+                    if similarity(sig, other_sig) >= DEDUP_THRESHOLD
+                ),
+                None,
+            )
+            if earlier is not None:
+                duplicates.append(f"#{number}: повторяет #{earlier} из импорта")
+                continue
+            accepted.append((number, sig))
+        unique.append((number, item))
+    return unique, duplicates
+
+
+async def run_bulk_import(message, items, channels, errors):
+    """Rewrite collected items concurrently, then enqueue them in one transaction"""
+    progress = await message.reply(f"Обработка 0/{len(items)}...")
+    # Copies are dropped first so they don't cost an LLM call
+    unique, duplicates = await drop_duplicate_items(items)
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    done = 0
+    last_edit = 0
+
+    async def rewrite_item(item):
+        nonlocal done, last_edit
+        try:
+            async with semaphore:
+                return await rewrite_service.rewrite(item["text"])
+        finally:
+            done += 1
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL:
+                last_edit = now
+                await edit_preview(progress, f"Обработка {done}/{len(unique)}...")
+
+    results = await asyncio.gather(
+        *(rewrite_item(item) for _, item in unique), return_exceptions=True
+    )
+
+    articles = []
+    failures = list(errors)
+    warnings = []
+    for (number, item), result in zip(unique, results):
+        if isinstance(result, Exception):
+            logging.error(f"Bulk import item {number} failed: {result!r}")
+            failures.append(f"#{number}: {type(result).__name__}")
+        else:
+            post = prepare_post(result, bool(item.get("image_file_id")))
+            if not post.parts:
+                failures.extend(f"#{number}: {warning}" for warning in post.warnings)
+                continue
+            warnings.extend(f"#{number}: {warning}" for warning in post.warnings)
+            articles.append(
+                (item["text"], result, None, item.get("image_file_id"), item.get("album"), post)
+            )
+
+    if articles:
+        article_ids = await add_articles(articles, channels=channels)
+        for article_id, (_, _, _, image_file_id, album, _) in zip(article_ids, articles):
+            if image_file_id:
+                store_images(article_id, album or [image_file_id])
+        await schedule_new_articles()
+
+    summary = f"Импорт завершён: добавлено {len(articles)} из {len(items)}."
+    if failures:
+        summary += "\n\nОшибки:\n" + "\n".join(failures)
+    if duplicates:
+        summary += "\n\nДубликаты:\n" + "\n".join(duplicates)
+    if warnings:
+        summary += "\n\nПредупреждения:\n" + "\n".join(warnings)
+    if not await edit_preview(progress, summary, parse_mode=None):
+        await message.answer(summary[:TELEGRAM_MESSAGE_LIMIT], parse_mode=None)
+
+
 # Queue management router
 queue_router = Router()
 
 
+QUEUE_PAGE_SIZE = 10
+
+
+class QueuePage(CallbackData, prefix="queue_page"):
+    after_id: int = 0
+    before_id: Optional[int] = None
+
+
+class QueueArticle(CallbackData, prefix="queue_article"):
+    action: str
+    article_id: int
+    # Page to show afterwards: articles with ids above this one
+    after_id: int
+
+
+class UnconfirmedDelivery(CallbackData, prefix="unconfirmed"):
+    # "arrived": the unanswered part is in the channel, "resend": it is not
+    action: str
+    delivery_id: int
+
+
+def format_scheduled_at(scheduled_at):
+    if not scheduled_at:
+        return "не запланировано"
+    if isinstance(scheduled_at, str):
+        scheduled_at = datetime.fromisoformat(scheduled_at)
+    return scheduled_at.strftime("%d.%m.%Y %H:%M")
+
+
+async def render_queue_page(after_id=0, before_id=None):
+    """Text and keyboard of one queue page"""
+    rows, has_prev, has_next, total = await get_queue_page(after_id, before_id, QUEUE_PAGE_SIZE)
+    if not rows:
+        return "Очередь публикаций пуста.", None
+
+    # Each piece is escaped once and joined at the end, so rendering is linear in the page size
+    lines = [f"Очередь публикаций ({total}):\n"]
+    keyboard = []
+    page_after_id = rows[0][0] - 1
+    for article_id, preview, scheduled_at in rows:
+        lines.append(
+            f"<b>ID: {article_id}</b>\n{escape(preview)}...\n"
+            f"Запланировано на: {format_scheduled_at(scheduled_at)}\n"
+        )
+        keyboard.append([
+            InlineKeyboardButton(
+                text=f"🗑 {article_id}",
+                callback_data=QueueArticle(
+                    action="delete", article_id=article_id, after_id=page_after_id
+                ).pack(),
+            ),
+            InlineKeyboardButton(
+                text=f"🚀 {article_id}",
+                callback_data=QueueArticle(
+                    action="post", article_id=article_id, after_id=page_after_id
+                ).pack(),
+            ),
+        ])
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            text="« Назад", callback_data=QueuePage(before_id=rows[0][0]).pack()
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Вперёд »", callback_data=QueuePage(after_id=rows[-1][0]).pack()
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+async def show_queue_page(callback: CallbackQuery, after_id=0, before_id=None):
+    text, keyboard = await render_queue_page(after_id, before_id)
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # Re-rendering an unchanged page is not an error
+        if "message is not modified" not in str(e):
+            raise
+
+
 @queue_router.message(Command("queue"))
 @admin_required
 async def view_queue(message: Message):
-    articles = get_queued_articles()
-    if not articles:
-        await message.reply("Очередь публикаций пуста.")
-    else:
-        queue_message = "Очередь публикаций:\n\n"
-        for article in articles:
-            queue_message += f"ID: {article[0]}\n{article[2][:60]}...\nЗапланировано на: {article[6]}\n\n"
-            text = escape(queue_message)
+    text, keyboard = await render_queue_page()
+    await message.reply(text, parse_mode="HTML", reply_markup=keyboard)
+
 
-        await message.reply(text, parse_mode="HTML")
+@queue_router.callback_query(QueuePage.filter())
+@admin_required
+async def queue_page_callback(callback: CallbackQuery, callback_data: QueuePage):
+    await show_queue_page(callback, callback_data.after_id, callback_data.before_id)
+    await callback.answer()
+
+
+@queue_router.callback_query(QueueArticle.filter(F.action == "delete"))
+@admin_required
+async def queue_delete_callback(callback: CallbackQuery, callback_data: QueueArticle):
+    article_id = callback_data.article_id
+    for delivery_id, channel in await delete_article(article_id):
+        release_slot(delivery_id, channel)
+    await show_queue_page(callback, callback_data.after_id)
+    await callback.answer(f"Статья с ID {article_id} удалена из очереди.")
+
+
+@queue_router.callback_query(QueueArticle.filter(F.action == "post"))
+@admin_required
+async def queue_post_callback(callback: CallbackQuery, callback_data: QueueArticle):
+    article_id = callback_data.article_id
+    result = await post_article_now(article_id)
+    await show_queue_page(callback, callback_data.after_id)
+    await callback.answer(
+        post_now_reply(article_id, result) or f"Статья с ID {article_id} отправлена в канал!",
+        show_alert=bool(result and (result.failed or result.not_claimed)),
+    )
 
 
 @queue_router.message(Command("delete"))
@@ -272,7 +886,8 @@ async def delete_article_from_queue(message: Message):
             return
 
         article_id = int(command_args[1])
-        delete_article(article_id)
+        for delivery_id, channel in await delete_article(article_id):
+            release_slot(delivery_id, channel)
         await message.reply(f"Статья с ID {article_id} удалена из очереди.")
 
     except ValueError:
@@ -284,6 +899,69 @@ async def delete_article_from_queue(message: Message):
         )
 
 
+@queue_router.callback_query(UnconfirmedDelivery.filter())
+@admin_required
+async def unconfirmed_delivery_callback(callback: CallbackQuery, callback_data: UnconfirmedDelivery):
+    delivery_id = callback_data.delivery_id
+    if not await requeue_unconfirmed(delivery_id, callback_data.action == "arrived"):
+        await callback.answer("Эта отправка уже обработана.")
+        return
+    post_scheduler.schedule(delivery_id, datetime.now())
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer("Отправка продолжится в ближайшие секунды.")
+
+
+# Channels of a /post_now: sent, failed, and held by another claim (a scheduled
+# send or another instance) so that this one did not send them
+PostNowResult = namedtuple("PostNowResult", "posted failed not_claimed")
+
+
+async def post_article_now(article_id):
+    """Post an article to all of its pending channels in parallel
+
+    Returns a PostNowResult, or None if the article is not queued.
+    """
+    article = await get_article_by_id(article_id)
+    if not article:
+        return None
+
+    deliveries = await get_article_deliveries(article_id)
+    results = await asyncio.gather(
+        *(post_delivery_now(delivery_id) for delivery_id, _, _ in deliveries),
+        return_exceptions=True,
+    )
+    outcome = PostNowResult([], [], [])
+    for (_, channel, _), result in zip(deliveries, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error posting article {article_id} to {channel}: {result}")
+            outcome.failed.append(channel)
+        elif result:
+            outcome.posted.append(channel)
+        else:
+            outcome.not_claimed.append(channel)
+    return outcome
+
+
+def post_now_reply(article_id, result):
+    """What to tell the admin about a /post_now that did not fully succeed, else None"""
+    if result is None:
+        return f"Статья с ID {article_id} не найдена в очереди."
+    if not (result.posted or result.failed or result.not_claimed):
+        return f"У статьи с ID {article_id} нет каналов, ожидающих отправки."
+    lines = []
+    if result.failed:
+        lines.append(
+            f"Статья с ID {article_id} не отправлена в каналы: {', '.join(result.failed)}. "
+            "Публикация остаётся в очереди."
+        )
+    if result.not_claimed:
+        lines.append(
+            f"Статья с ID {article_id} не отправлена в каналы: {', '.join(result.not_claimed)}: "
+            "их уже отправляет другой процесс, или они уже отправлены."
+        )
+    return "\n".join(lines) or None
+
+
 @queue_router.message(Command("post_now"))
 @admin_required
 async def post_now_command(message: Message):
@@ -297,24 +975,18 @@ async def post_now_command(message: Message):
             return
 
         article_id = int(command_args[1])
-        article = get_article_by_id(article_id)
-
-        if not article:
-            await message.reply(f"Статья с ID {article_id} не найдена в очереди.")
+        reply = post_now_reply(article_id, await post_article_now(article_id))
+        if reply:
+            await message.reply(reply)
             return
-
-        # Extract article data
-        _, text, processed_text, image_url, status, created_at, scheduled_at = article
-
-        # Post the article immediately
-        await post_article_to_channel(article_id, processed_text, image_url)
         await message.reply(f"Статья с ID {article_id} отправлена немедленно в канал!")
 
         help_text = """Доступные команды:
-/new_article - Добавить публикацию в очередь
+/new_article [@канал ...] - Добавить публикацию в очередь (по умолчанию во все каналы)
+/bulk [@канал ...] - Массовый импорт публикаций
 /queue - Посмотреть очередь публикаций
 /delete id - Удалить публикацию из очереди
-/post_now id - Отправить публикацию немедленно в канал
+/post_now id - Отправить публикацию немедленно во все её каналы
 /cancel - Отменить текущую операцию
 /help - Показать это сообщение"""
 
@@ -331,6 +1003,7 @@ async def post_now_command(message: Message):
 
 # Register routers
 dp.include_router(article_router)
+dp.include_router(bulk_router)
 dp.include_router(queue_router)
 
 # Scheduling
@@ -339,218 +1012,394 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 scheduler = AsyncIOScheduler()
 
 
-class TelegramHTMLSanitizer(HTMLParser):
-    """HTML parser to sanitize content for Telegram"""
-    
-    def __init__(self):
-        super().__init__()
-        self.result = []
-        self.allowed_tags = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'code', 'pre'}
-        self.tag_stack = []
-        
-    def handle_starttag(self, tag, attrs):
-        if tag in self.allowed_tags:
-            self.result.append(f'<{tag}>')
-            self.tag_stack.append(tag)
-        elif tag in ['ul', 'ol']:
-            # Start of list - add newline
-            self.result.append('\n')
-        elif tag == 'li':
-            # List item - add bullet point
-            self.result.append('• ')
-            
-    def handle_endtag(self, tag):
-        if tag in self.allowed_tags and self.tag_stack and self.tag_stack[-1] == tag:
-            self.result.append(f'</{tag}>')
-            self.tag_stack.pop()
-        elif tag == 'li':
-            # End of list item - add newline
-            self.result.append('\n')
-        elif tag in ['ul', 'ol']:
-            # End of list - add extra newline
-            self.result.append('\n')
-            
-    def handle_data(self, data):
-        self.result.append(data)
-        
-    def get_sanitized_text(self):
-        # Close any unclosed tags
-        while self.tag_stack:
-            tag = self.tag_stack.pop()
-            self.result.append(f'</{tag}>')
-        
-        # Join and clean up extra whitespace
-        text = ''.join(self.result)
-        # Remove multiple consecutive newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        return text.strip()
+class ClaimLostError(Exception):
+    """Raised when a delivery's lease ran out and another worker took it over mid-send"""
 
 
-def sanitize_html_for_telegram(text):
-    """Sanitize HTML content for Telegram posting"""
+# Parts of the Bad Request descriptions Telegram gives for a file_id it no
+# longer accepts, e.g. "wrong file identifier/HTTP URL specified"
+FILE_ID_ERRORS = ("file identifier", "file_id", "file reference")
+
+
+def is_file_id_error(error):
+    """Whether a TelegramBadRequest blames the file_id rather than the rest of the message"""
+    description = str(error.message).lower()
+    return any(fragment in description for fragment in FILE_ID_ERRORS)
+
+
+async def send_article_photo(channel, article_id, caption, image_path=None, image_file_id=None):
+    """Send a photo post by Telegram file_id, uploading local bytes only as a fallback
+
+    Returns the sent message, or None when there is no usable image.
+    """
+    if image_file_id:
+        try:
+            return await publisher.publish(
+                channel,
+                lambda: bot.send_photo(chat_id=channel, photo=image_file_id, caption=caption),
+            )
+        except TelegramBadRequest as e:
+            # Anything else, e.g. a caption Telegram can't parse, would fail the upload too
+            if not is_file_id_error(e):
+                raise
+            logging.warning(f"Stored file_id for article {article_id} is no longer valid: {e}")
+
+    if not image_path or not os.path.exists(image_path):
+        return None
+
+    sent = await publisher.publish(
+        channel,
+        lambda: bot.send_photo(
+            chat_id=channel,
+            photo=FSInputFile(image_path),
+            caption=caption,
+        ),
+    )
+    # Remember the id Telegram assigned so the next send is a plain reference
+    await update_image_file_id(article_id, sent.photo[-1].file_id)
+    return sent
+
+
+async def send_article_album(channel, article_id, caption, album):
+    """Send an album as one media group by file_ids, uploading local copies as a fallback
+
+    Returns the first sent message, or None when the album can't be sent.
+    """
+    album = json.loads(album)
+
+    def media(sources):
+        return [
+            InputMediaPhoto(media=source, caption=caption if index == 0 else None)
+            for index, source in enumerate(sources)
+        ]
+
     try:
-        parser = TelegramHTMLSanitizer()
-        parser.feed(text)
-        return parser.get_sanitized_text()
-    except Exception as e:
-        logging.error(f"Error sanitizing HTML: {e}")
-        # Fallback: strip all HTML tags
-        clean_text = re.sub(r'<[^>]+>', '', text)
-        return clean_text
+        sent = await publisher.publish(
+            channel,
+            lambda: bot.send_media_group(
+                chat_id=channel, media=media([image["file_id"] for image in album])
+            ),
+            cost=len(album),
+        )
+        return sent[0]
+    except TelegramBadRequest as e:
+        if not is_file_id_error(e):
+            raise
+        logging.warning(f"Stored album file_ids for article {article_id} are no longer valid: {e}")
+
+    paths = [image["path"] for image in album if image["path"] and os.path.exists(image["path"])]
+    # A media group needs at least two photos; otherwise fall back to the cover alone
+    if len(paths) < 2:
+        return None
+    sent = await publisher.publish(
+        channel,
+        lambda: bot.send_media_group(
+            chat_id=channel, media=media([FSInputFile(path) for path in paths])
+        ),
+        cost=len(paths),
+    )
+    if len(paths) == len(album):
+        await update_album_file_ids(article_id, [message.photo[-1].file_id for message in sent])
+    return sent[0]
 
 
-async def post_article_to_channel(article_id, text, image_path=None):
+async def renew_lease(delivery_id, claim):
+    """Extend a claim's lease every third of it until cancelled or the claim is lost"""
+    while True:
+        await asyncio.sleep(POST_LEASE.total_seconds() / 3)
+        if not await renew_delivery_lease(delivery_id, claim, POST_LEASE):
+            return
+
+
+async def post_article_to_channel(
+    delivery_id, claim, channel, article_id, parts, mode, image_path=None, image_file_id=None,
+    album=None, sent_parts=0,
+):
+    """Send the unsent parts of a claimed delivery; raises if a send fails
+
+    `parts` is the JSON list from add_article: the caption or first message,
+    then continuation messages. Each part's message id is stored as soon as
+    Telegram accepts it, so a delivery taken over after a crash resumes
+    after the last recorded part instead of starting over. The lease is
+    renewed in the background meanwhile: waiting for the rate limits or a
+    flood wait can take longer than the lease itself.
+    """
+    parts = json.loads(parts)
+    renewal = asyncio.create_task(renew_lease(delivery_id, claim))
     try:
-        # Sanitize HTML content for Telegram
-        sanitized_text = sanitize_html_for_telegram(text)
-        
-        # Check if text is too long for caption (1700 bytes limit thats around 1024 chars)
-        text_bytes = len(sanitized_text.encode('utf-8'))
-        
-        if text_bytes > 1700:
-            # Text is too long for caption, send as text-only message
-            logging.info(f"Article {article_id} text too long ({text_bytes} bytes), sending as text-only")
-            await bot.send_message(chat_id=CHANNEL_NAME, text=sanitized_text)
-        else:
-            # Text fits in caption
-            if image_path and os.path.exists(image_path):
-                photo = FSInputFile(image_path)
-                await bot.send_photo(
-                    chat_id=CHANNEL_NAME,
-                    photo=photo,
-                    caption=sanitized_text,
-                )
-            else:
-                await bot.send_message(chat_id=CHANNEL_NAME, text=sanitized_text)
+        with post_seconds.time(channel=channel):
+            for index in range(sent_parts, len(parts)):
+                part = parts[index]
+                sent = None
+                if index == 0 and mode == MODE_PHOTO and album:
+                    sent = await send_article_album(channel, article_id, part, album)
+                if sent is None and index == 0 and mode == MODE_PHOTO:
+                    sent = await send_article_photo(channel, article_id, part, image_path, image_file_id)
+                if sent is None:
+                    sent = await publisher.publish(
+                        channel, lambda: bot.send_message(chat_id=channel, text=part)
+                    )
+                if not await record_delivery_part(delivery_id, claim, sent.message_id, POST_LEASE):
+                    raise ClaimLostError(f"Delivery {delivery_id} was taken over after part {index + 1}")
+    except Exception:
+        post_failures.inc(channel=channel)
+        raise
+    finally:
+        renewal.cancel()
+
+    logging.info(f"Статья {article_id} была опубликована успешно в {channel}!")
+
+
+async def report_unconfirmed_delivery(delivery_id, claim, article_id, channel, error):
+    """Hold a delivery whose send went unanswered and ask the admins to check the channel"""
+    await mark_delivery_unconfirmed(delivery_id, claim)
+    logging.error(f"Delivery {delivery_id} of article {article_id} to {channel} is unconfirmed: {error}")
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text="Уже в канале",
+            callback_data=UnconfirmedDelivery(action="arrived", delivery_id=delivery_id).pack(),
+        ),
+        InlineKeyboardButton(
+            text="Отправить снова",
+            callback_data=UnconfirmedDelivery(action="resend", delivery_id=delivery_id).pack(),
+        ),
+    ]])
+    for user_id in ADMIN_USER_IDS:
+        try:
+            await bot.send_message(
+                user_id,
+                f"Telegram не ответил при публикации статьи {article_id} в {channel}: "
+                "сообщение могло быть опубликовано. Проверьте канал.",
+                reply_markup=keyboard,
+            )
+        except Exception as e:
+            logging.error(f"Could not notify admin {user_id}: {e}")
 
-        # Mark article as posted
-        delete_article(article_id)
-        logging.info(f"Статья {article_id} была опубликована успешно!")
 
+async def post_scheduled_delivery(delivery_id):
+    """Called by the post scheduler when a delivery's time has come"""
+    claim = new_claim()
+    delivery = await claim_delivery(delivery_id, claim, POST_LEASE)
+    if not delivery:
+        # Posted, deleted or being sent by another worker
+        return
+
+    (
+        _, article_id, channel, parts, mode, image_path, image_file_id, album, scheduled_at,
+        sent_parts,
+    ) = delivery
+    logging.info(f"Posting article {article_id} to {channel} (scheduled for {scheduled_at})")
+    try:
+        await post_article_to_channel(
+            delivery_id, claim, channel, article_id, parts, mode, image_path, image_file_id, album,
+            sent_parts,
+        )
+    except ClaimLostError as e:
+        logging.warning(str(e))
+        return
+    except PublishOutcomeUnknown as e:
+        await report_unconfirmed_delivery(delivery_id, claim, article_id, channel, e)
+        return
     except Exception as e:
-        logging.error(f"Error posting article {article_id}: {e}")
+        failures = await record_delivery_failure(delivery_id, claim)
+        if failures >= POST_MAX_FAILURES:
+            # Dead letter: keep the row for inspection but stop retrying
+            await mark_delivery_failed(delivery_id)
+            # Nothing was posted in its slot, so give it back
+            if scheduled_at:
+                get_slot_allocator(channel).release(datetime.fromisoformat(str(scheduled_at)))
+            logging.error(
+                f"Article {article_id} marked as failed for {channel} after {failures} attempts: {e}"
+            )
+        else:
+            retry_at = datetime.now() + timedelta(minutes=2 ** failures)
+            post_scheduler.schedule(delivery_id, retry_at)
+            logging.error(f"Error posting article {article_id} to {channel}, retrying at {retry_at}: {e}")
+        return
 
+    await mark_delivery_posted(delivery_id, claim)
+    # Deliveries recovered from an expired claim may have no slot
+    if scheduled_at:
+        get_slot_allocator(channel).discard(datetime.fromisoformat(str(scheduled_at)))
 
-async def schedule_posts():
-    """
-    Database-driven scheduler that:
-    1. Posts articles that are ready (scheduled_at <= now)
-    2. Schedules new articles (scheduled_at is None)
+
+async def post_delivery_now(delivery_id):
+    """Post a delivery ahead of its slot, putting it back on the schedule if the send fails
+
+    Returns True once posted and False if it could not be claimed.
     """
-    articles = get_queued_articles()
-    if not articles:
+    claim = new_claim()
+    delivery = await claim_delivery(delivery_id, claim, POST_LEASE)
+    if not delivery:
+        # Another worker is sending it right now, or it is no longer queued;
+        # either way its timer stays as it is
+        return False
+    # Only a successful claim takes the delivery off the schedule
+    due_at = post_scheduler.remove(delivery_id)
+
+    _, article_id, channel, parts, mode, image_path, image_file_id, album, _, sent_parts = delivery
+    try:
+        await post_article_to_channel(
+            delivery_id, claim, channel, article_id, parts, mode, image_path, image_file_id, album,
+            sent_parts,
+        )
+    except ClaimLostError as e:
+        logging.warning(str(e))
+        return False
+    except PublishOutcomeUnknown as e:
+        await report_unconfirmed_delivery(delivery_id, claim, article_id, channel, e)
+        raise
+    except Exception:
+        await release_delivery(delivery_id, claim)
+        if due_at is not None:
+            post_scheduler.schedule(delivery_id, due_at)
+        raise
+    await mark_delivery_posted(delivery_id, claim)
+    if due_at is not None:
+        get_slot_allocator(channel).release(due_at)
+    return True
+
+
+async def recover_deliveries():
+    """Take over deliveries whose worker died mid-send, once their lease has run out"""
+    recovered = await recover_expired_claims()
+    for delivery_id, channel, _ in recovered:
+        post_scheduler.schedule(delivery_id, datetime.now())
+        logging.warning(f"Recovered delivery {delivery_id} to {channel} from an expired claim")
+
+
+publisher = Publisher(
+    global_rate=PUBLISH_GLOBAL_RATE,
+    chat_rate_per_minute=PUBLISH_CHAT_RATE_PER_MINUTE,
+    max_concurrency=PUBLISH_CONCURRENCY,
+    max_attempts=PUBLISH_MAX_ATTEMPTS,
+)
+# Keyed by delivery id: every (article, channel) pair has its own due time
+post_scheduler = PostScheduler(post_scheduled_delivery)
+# One slot allocator per channel, created on first use
+slot_allocators = {}
+# Serialises slot assignment so concurrent submissions don't take the same slot
+slot_lock = asyncio.Lock()
+
+
+def get_slot_allocator(channel):
+    allocator = slot_allocators.get(channel)
+    if allocator is None:
+        schedule = CHANNEL_SCHEDULES.get(channel, {})
+        template = parse_template(
+            schedule.get("times", POST_TIMES),
+            schedule.get("weekdays", POST_WEEKDAYS),
+            schedule.get("blackout_dates", POST_BLACKOUT_DATES),
+        )
+        allocator = slot_allocators[channel] = SlotAllocator(template)
+    return allocator
+
+
+async def schedule_new_articles():
+    """Assign free time slots to queued deliveries that don't have one yet"""
+    async with slot_lock:
+        for delivery_id, channel in await get_unscheduled_deliveries():
+            post_time = get_slot_allocator(channel).allocate()
+            await update_delivery_scheduled(delivery_id, post_time)
+            post_scheduler.schedule(delivery_id, post_time)
+            logging.info(f"Scheduled delivery {delivery_id} to {channel} for posting at {post_time}")
+
+
+def release_slot(delivery_id, channel):
+    """Drop a delivery from the post scheduler and free its slot"""
+    due_at = post_scheduler.remove(delivery_id)
+    if due_at is not None:
+        get_slot_allocator(channel).release(due_at)
+
+
+async def load_scheduled_articles():
+    """Fill the post scheduler from the database on startup"""
+    for delivery_id, article_id, channel, scheduled_at in await get_queued_deliveries():
+        if not scheduled_at:
+            continue
+        try:
+            if isinstance(scheduled_at, str):
+                scheduled_time = datetime.fromisoformat(scheduled_at)
+            else:
+                scheduled_time = scheduled_at
+            get_slot_allocator(channel).reserve(scheduled_time)
+            post_scheduler.schedule(delivery_id, scheduled_time)
+        except Exception as e:
+            logging.error(f"Error parsing scheduled_at for delivery {delivery_id}: {e}")
+
+    logging.info(f"Loaded {len(post_scheduler)} scheduled deliveries")
+    await schedule_new_articles()
+
+
+async def archive_articles():
+    """Move posted, deleted and old failed articles to the archive table"""
+    archived = await archive_finished_articles(
+        datetime.now() - timedelta(days=FAILED_ARTICLE_RETENTION_DAYS)
+    )
+    if archived:
+        logging.info(f"Archived {archived} finished articles")
+
+
+async def cleanup_image_files():
+    """Evict old local image copies, keeping those of queued articles"""
+    keep = await get_queued_image_paths()
+    removed = await asyncio.to_thread(
+        cleanup_images,
+        IMAGES_DIR,
+        IMAGE_MAX_AGE_DAYS,
+        IMAGE_DIR_MAX_MB * 1024 * 1024,
+        keep,
+    )
+    if removed:
+        logging.info(f"Removed {removed} cached images")
+
+
+async def evict_duplicate_index():
+    """Drop near-duplicate index entries older than the dedup window"""
+    evicted = await evict_signatures(datetime.now() - timedelta(days=DEDUP_WINDOW_DAYS))
+    if evicted:
+        logging.info(f"Evicted {evicted} texts from the duplicate index")
+
+
+async def evict_rewrite_cache_entries():
+    """Drop expired and least recently used rewrites from the cache"""
+    evicted = await rewrite_service.evict_cache()
+    if evicted:
+        logging.info(f"Evicted {evicted} cached rewrites")
+
+
+async def backup_database():
+    """Write a verified database snapshot in a thread while the bot keeps running"""
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(create_backup)
+    except Exception as e:
+        backups.inc(result="error")
+        logging.error(f"Database backup failed: {e}")
         return
+    backups.inc(result="ok")
+    backup_seconds.observe(time.perf_counter() - started)
+    backup_last_success.set(time.time())
 
-    now = datetime.now()
-    logging.info(f"Scheduler running at {now}")
 
-    # STEP 1: Check for articles ready to post
-    ready_articles = []
-    scheduled_articles = []
-    unscheduled_articles = []
-    
-    for article in articles:
-        article_id, text, processed_text, image_path, status, created_at, scheduled_at = article
-        
-        if scheduled_at:  # Article has a scheduled time
-            try:
-                # Parse the scheduled time from database
-                if isinstance(scheduled_at, str):
-                    scheduled_time = datetime.fromisoformat(scheduled_at)
-                else:
-                    scheduled_time = scheduled_at
-                
-                if scheduled_time <= now:
-                    # Article is ready to post
-                    ready_articles.append(article)
-                else:
-                    # Article is scheduled for future
-                    scheduled_articles.append((article, scheduled_time))
-            except Exception as e:
-                logging.error(f"Error parsing scheduled_at for article {article_id}: {e}")
-        else:
-            # Article needs to be scheduled
-            unscheduled_articles.append(article)
-    
-    # Post ready articles immediately
-    for article in ready_articles:
-        article_id, text, processed_text, image_path, status, created_at, scheduled_at = article
-        logging.info(f"Posting article {article_id} (scheduled for {scheduled_at})")
-        await post_article_to_channel(article_id, processed_text, image_path)
-    
-    # STEP 2: Schedule new articles if any
-    if unscheduled_articles:
-        logging.info(f"Found {len(unscheduled_articles)} unscheduled articles to schedule")
-        
-        # Get current time slots
-        today_9am = now.replace(hour=9, minute=0, second=0, microsecond=0)
-        today_8pm = now.replace(hour=20, minute=0, second=0, microsecond=0)
-        slot_interval_minutes = (11 * 60) // 5  # 132 minutes between posts
-
-        # Get all already scheduled times from database
-        occupied_slots = set()
-        for article, scheduled_time in scheduled_articles:
-            occupied_slots.add(scheduled_time)
-
-        # Generate potential time slots for multiple days
-        potential_slots = []
-        
-        # Calculate slots for today
-        time_slots_today = []
-        for i in range(5):
-            slot_time = today_9am + timedelta(minutes=slot_interval_minutes * i)
-            time_slots_today.append(slot_time)
-
-        # Determine which slots are available today based on current time
-        if now < today_9am:
-            # Before 9am, all slots for today are potentially available
-            potential_slots.extend(time_slots_today)
-        elif now > today_8pm:
-            # After 8pm, skip today and start with tomorrow
-            pass
-        else:
-            # During posting hours, find remaining slots for today
-            for slot_time in time_slots_today:
-                if slot_time > now:
-                    potential_slots.append(slot_time)
-
-        # Add slots for next few days to ensure we have enough slots
-        for day_offset in range(1, 8):  # Next 7 days
-            future_day_9am = today_9am + timedelta(days=day_offset)
-            for i in range(5):
-                slot_time = future_day_9am + timedelta(minutes=slot_interval_minutes * i)
-                potential_slots.append(slot_time)
-
-        # Filter out occupied slots to get truly available slots
-        available_slots = [slot for slot in potential_slots if slot not in occupied_slots]
-        
-        logging.info(f"Found {len(occupied_slots)} occupied slots, {len(available_slots)} available slots")
-
-        # Schedule unscheduled articles to available slots
-        for slot_index, article in enumerate(unscheduled_articles):
-            article_id, text, processed_text, image_path, status, created_at, scheduled_at = article
-
-            # Get the next available slot
-            if slot_index < len(available_slots):
-                post_time = available_slots[slot_index]
-                
-                # Update database with scheduled time
-                update_time_scheduled(article_id, post_time)
-                logging.info(f"Scheduled article {article_id} for posting at {post_time}")
-            else:
-                logging.warning(f"No available slots for article {article_id}")
-    
-    # Log summary
-    if ready_articles:
-        logging.info(f"Posted {len(ready_articles)} articles this run")
-    if scheduled_articles:
-        logging.info(f"Found {len(scheduled_articles)} articles scheduled for future")
-    if unscheduled_articles:
-        logging.info(f"Scheduled {min(len(unscheduled_articles), len(available_slots) if 'available_slots' in locals() else 0)} new articles")
+async def purge_fsm_states():
+    """Drop submissions abandoned for longer than the FSM TTL"""
+    if isinstance(storage, SQLiteStorage):
+        purged = await storage.purge_expired()
+        if purged:
+            logging.info(f"Purged {purged} expired FSM states")
 
 
-# Schedule the post scheduler to run every minute
-scheduler.add_job(schedule_posts, "interval", minutes=1)
+# Keep the hot articles table limited to the live queue
+scheduler.add_job(archive_articles, "cron", hour=4, minute=0)
+scheduler.add_job(cleanup_image_files, "cron", hour=4, minute=30)
+scheduler.add_job(evict_rewrite_cache_entries, "cron", hour=5, minute=0)
+scheduler.add_job(purge_fsm_states, "cron", hour=5, minute=30)
+scheduler.add_job(evict_duplicate_index, "cron", hour=6, minute=0)
+if BACKUP_INTERVAL_HOURS:
+    scheduler.add_job(backup_database, "interval", hours=BACKUP_INTERVAL_HOURS)
+# Deliveries abandoned by a worker that died are picked up once their lease expires
+scheduler.add_job(recover_deliveries, "interval", minutes=5)
 
 
 async def test_posting():
@@ -583,7 +1432,7 @@ At vero eos et accusamus et iusto odio dignissimos ducimus qui blanditiis praese
     
     # Add test articles to database
     for i, article in enumerate(test_articles, 1):
-        add_article(article["original"], article["processed"])
+        await add_article(article["original"], article["processed"], channels=CHANNELS)
         logging.info(f"Added test article {i} to database")
     
     # Get current time and schedule for +2 minutes
@@ -591,28 +1440,19 @@ At vero eos et accusamus et iusto odio dignissimos ducimus qui blanditiis praese
     test_time = now + timedelta(minutes=2)
     
     # Get the newly added articles
-    articles = get_queued_articles()
+    articles = await get_queued_articles()
     recent_articles = articles[-len(test_articles):]  # Get the last N articles
     
     # Schedule each test article for posting
     for i, article in enumerate(recent_articles):
         article_id = article[0]
-        processed_text = article[2]
-        image_path = article[3]
         
         # Schedule each article 30 seconds apart starting from +2 minutes
         post_time = test_time + timedelta(seconds=30 * i)
         
-        update_time_scheduled(article_id, post_time)
-        
-        job_id = f"test_article_{article_id}"
-        scheduler.add_job(
-            post_article_to_channel,
-            "date",
-            run_date=post_time,
-            args=[article_id, processed_text, image_path],
-            id=job_id,
-        )
+        for delivery_id, channel, _ in await get_article_deliveries(article_id):
+            await update_delivery_scheduled(delivery_id, post_time)
+            post_scheduler.schedule(delivery_id, post_time)
         
         logging.info(f"Scheduled test article {article_id} for posting at {post_time}")
     
@@ -620,12 +1460,96 @@ At vero eos et accusamus et iusto odio dignissimos ducimus qui blanditiis praese
     print("Posts will be sent every 30 seconds starting from +2 minutes")
 
 
-async def main():
-    # Start scheduler
+async def collect_queue_depth():
+    """Refresh the queue depth gauge before each metrics scrape"""
+    counts = await count_by_status()
+    queue_depth.clear()
+    for (table, status), count in counts.items():
+        queue_depth.set(count, table=table, status=status)
+    queue_depth.set(len(post_scheduler), table="scheduler", status="pending")
+
+
+registry.add_collector(collect_queue_depth)
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+
+async def on_startup():
     scheduler.start()
+    # Rows stored before a migration added their prepared post or signature
+    prepared, indexed = await rebuild_derived_data(
+        datetime.now() - timedelta(days=DEDUP_WINDOW_DAYS) if DEDUP_WINDOW_DAYS > 0 else None
+    )
+    if prepared or indexed:
+        logging.info(f"Prepared {prepared} queued posts and indexed {indexed} texts stored before migrations")
+    # Claims left by a crashed run go back to the queue before it is loaded
+    recovered = await recover_expired_claims()
+    if recovered:
+        logging.warning(f"Requeued {len(recovered)} deliveries interrupted mid-send")
+    await load_scheduled_articles()
+    post_scheduler.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+
+
+async def on_shutdown():
+    scheduler.shutdown(wait=False)
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await post_scheduler.stop()
+    await rewrite_service.close()
+    await image_pipeline.close()
+    await storage.close()
+    await close_database()
+
+
+# Both polling and the webhook server run these around update handling
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
+def create_webhook_app(handle_in_background=True):
+    """aiohttp app that checks the secret token and feeds updates to the dispatcher"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=handle_in_background,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook():
+    runner = web.AppRunner(create_webhook_app())
+    # Startup hooks run here, before the first update can arrive
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info(f"Listening for webhook updates on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        # The webhook stays registered so Telegram holds updates until the next start
+        await runner.cleanup()
+        await bot.session.close()
+
 
-    # Start bot polling
-    await dp.start_polling(bot)
+async def main():
+    if WEBHOOK_URL:
+        await run_webhook()
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
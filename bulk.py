@@ -0,0 +1,41 @@
+import json
+import re
+
+# A line with three or more dashes separates articles in a bulk text
+SEPARATOR = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+
+
+def split_text(text):
+    """Split a bulk text into article texts on separator lines"""
+    return [part.strip() for part in SEPARATOR.split(text) if part.strip()]
+
+
+def parse_jsonl(text):
+    """Parse one article per line: {"text": "..."} objects or plain JSON strings
+
+    Returns (texts, errors) where errors are human readable per-line problems.
+    """
+    texts = []
+    errors = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append(f"строка {line_number}: {e.msg}")
+            continue
+        value = item.get("text") if isinstance(item, dict) else item
+        if isinstance(value, str) and value.strip():
+            texts.append(value.strip())
+        else:
+            errors.append(f"строка {line_number}: нет текста")
+    return texts, errors
+
+
+def parse_document(file_name, content):
+    """Split an uploaded .jsonl or plain text document into article texts"""
+    text = content.decode("utf-8-sig")
+    if (file_name or "").lower().endswith(".jsonl"):
+        return parse_jsonl(text)
+    return split_text(text), []
@@ -1,4 +1,6 @@
 # Modified config.py:
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
 
@@ -7,8 +9,100 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_KEY = os.getenv("API_KEY")
 CHANNEL_NAME = os.getenv("CHANNEL_NAME", "@glebnft")
+# Channels every new article is published to, comma separated (defaults to CHANNEL_NAME)
+CHANNELS = [
+    channel.strip() for channel in (os.getenv("CHANNELS") or CHANNEL_NAME).split(",") if channel.strip()
+]
 MODEL = os.getenv("MODEL", "gpt-4.1-nano")
 DATABASE_FILE = os.getenv("DATABASE_FILE", "articles.db")
+# Posting slots: times of day, weekdays (Monday is 0, empty for every day)
+# and dates with no posts, all comma separated
+POST_TIMES = os.getenv("POST_TIMES", "09:00,11:12,13:24,15:36,17:48")
+POST_WEEKDAYS = os.getenv("POST_WEEKDAYS", "")
+POST_BLACKOUT_DATES = os.getenv("POST_BLACKOUT_DATES", "")
+# Per-channel overrides of the slots above as JSON, e.g.
+# {"@channel": {"times": "10:00,18:00", "weekdays": "0,1,2,3,4", "blackout_dates": ""}}
+CHANNEL_SCHEDULES = json.loads(os.getenv("CHANNEL_SCHEDULES", "{}"))
+# Local image copies: evicted after this many days or above this total size
+IMAGE_MAX_AGE_DAYS = int(os.getenv("IMAGE_MAX_AGE_DAYS", "30"))
+IMAGE_DIR_MAX_MB = int(os.getenv("IMAGE_DIR_MAX_MB", "500"))
+# Local copies are downloaded in the background, this many at a time. With
+# IMAGE_MAX_SIDE above 0 (and Pillow installed) they are shrunk to fit it and
+# re-encoded as JPEG in IMAGE_WORKERS processes
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.getenv("IMAGE_DOWNLOAD_CONCURRENCY", "4"))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "0"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Channel publishing: Telegram allows about 30 messages per second overall
+# and 20 per minute into one channel
+PUBLISH_GLOBAL_RATE = int(os.getenv("PUBLISH_GLOBAL_RATE", "30"))
+PUBLISH_CHAT_RATE_PER_MINUTE = int(os.getenv("PUBLISH_CHAT_RATE_PER_MINUTE", "20"))
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", "4"))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "5"))
+# Scheduled posts that fail this many times are marked 'failed'; failed
+# articles stay in the queue tables for this many days after submission
+POST_MAX_FAILURES = int(os.getenv("POST_MAX_FAILURES", "5"))
+FAILED_ARTICLE_RETENTION_DAYS = int(os.getenv("FAILED_ARTICLE_RETENTION_DAYS", "30"))
+# A worker sending a post holds it this long (renewed after every sent part);
+# if it dies, another worker or the next start takes the post over after that
+POST_LEASE_SECONDS = int(os.getenv("POST_LEASE_SECONDS", "600"))
+# LLM client settings
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Models tried after MODEL when it is slow or failing, as a JSON list of model
+# names or {"model", "base_url", "api_key"} objects for other endpoints
+LLM_FALLBACKS = json.loads(os.getenv("LLM_FALLBACKS", "[]"))
+# Seconds before a slow request is hedged on the next model, until its p95
+# latency is known; 0 only falls back on errors
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "15"))
+# Token budgets: the model's context window, the most source text sent in one
+# request (longer texts are summarized in chunks of this size first) and the
+# completion limit of the final rewrite
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "32000"))
+LLM_INPUT_TOKENS = int(os.getenv("LLM_INPUT_TOKENS", "8000"))
+REWRITE_MAX_TOKENS = int(os.getenv("REWRITE_MAX_TOKENS", "2000"))
+# Length of the post asked of the model, in characters; 0 leaves it to the prompt
+REWRITE_TARGET_LENGTH = int(os.getenv("REWRITE_TARGET_LENGTH", "0"))
+# USD per million tokens, for the cost metric when the provider doesn't report cost
+LLM_PROMPT_PRICE = float(os.getenv("LLM_PROMPT_PRICE", "0.1"))
+LLM_COMPLETION_PRICE = float(os.getenv("LLM_COMPLETION_PRICE", "0.4"))
+# Minimum seconds between edits of the streaming preview message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Parallel rewrites during a /bulk import
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "5"))
+# Rewrite cache: entries older than the TTL or beyond the size cap are evicted
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("REWRITE_CACHE_MAX_ENTRIES", "5000"))
+REWRITE_CACHE_TTL_DAYS = int(os.getenv("REWRITE_CACHE_TTL_DAYS", "30"))
+# Near-duplicate check: source texts at least this similar (estimated Jaccard
+# similarity of word pairs) to one added within the window are flagged before
+# the rewrite; DEDUP_WINDOW_DAYS=0 turns the check off
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.4"))
+DEDUP_WINDOW_DAYS = int(os.getenv("DEDUP_WINDOW_DAYS", "30"))
+# Online database snapshots every BACKUP_INTERVAL_HOURS (0 turns them off),
+# of which the newest BACKUP_KEEP are kept. The copy advances
+# BACKUP_PAGES_PER_STEP pages at a time with BACKUP_STEP_PAUSE seconds between steps
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+# FSM storage: "sqlite" (the articles database), "memory" or a redis:// URL
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+# Unfinished submissions untouched for this long are dropped
+FSM_STATE_TTL_HOURS = int(os.getenv("FSM_STATE_TTL_HOURS", "72"))
+# Webhook mode: set WEBHOOK_URL (the public https base) to receive updates over HTTP instead of polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Telegram sends it back in every request; by default derived from the token so all workers agree
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(
+    (BOT_TOKEN or "").encode()
+).hexdigest()
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; port 0 turns them off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
 # Prompt for Text Processing
 TEXT_PROCESSING_PROMPT = """
 Ты - редактор и копирайтер. Твоя задача преобразовать текст в готовую публикацию для телеграмм.   
@@ -45,5 +139,11 @@ TEXT_PROCESSING_PROMPT = """
 
 """
 
+# Prompt for summarizing one chunk of a source text too long for a single request
+CHUNK_SUMMARY_PROMPT = """
+Это часть {index} из {total} длинного текста. Сократи её примерно до {words} слов.
+Сохрани все факты, цифры, даты, названия компаний, судов и верфей. Ничего не добавляй от себя, пиши простым текстом без форматирования.
+"""
+
 # Database File
 DATABASE_FILE = "articles.db"
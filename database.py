@@ -1,16 +1,303 @@
+import asyncio
+import json
+import logging
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from config import DATABASE_FILE
+from config import CHANNEL_NAME, DATABASE_FILE
+from dedup import BANDS, band_keys, from_blob, signature, similarity, to_blob
+from formatting import prepare_post
+from metrics import db_query_seconds
 
+# Connection tuning applied once when the long-lived connection is opened
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
 
-def create_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
-    return conn
+# Columns returned for an article row, in the order handlers unpack them.
+# scheduled_at is the next pending delivery time across the article's channels.
+# The unary + keeps SQLite off the status index, which would scan every
+# queued delivery, and on the (article_id, channel) one; lookups of one
+# article's deliveries below do the same.
+ARTICLE_COLUMNS = """
+    id, text, processed_text, image_path, status, created_at,
+    (SELECT MIN(scheduled_at) FROM deliveries
+     WHERE article_id = articles.id AND +status = 'queued') AS scheduled_at,
+    image_file_id, post_parts, post_mode
+"""
+
+# Columns returned for a delivery joined with its article
+DELIVERY_COLUMNS = (
+    "d.id, d.article_id, d.channel, a.post_parts, a.post_mode, a.image_path, a.image_file_id, a.album, "
+    "d.scheduled_at"
+)
+
+# Statements are kept as constants so sqlite3 reuses its prepared copies
+INSERT_ARTICLE = """
+    INSERT INTO articles (
+        text, processed_text, image_path, image_file_id, status, created_at,
+        post_html, post_bytes, post_mode, post_parts, album
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_DELIVERY = "INSERT INTO deliveries (article_id, channel, status) VALUES (?, ?, 'queued')"
+SELECT_QUEUED = f"SELECT {ARTICLE_COLUMNS} FROM articles WHERE status = 'queued' ORDER BY id"
+SELECT_BY_ID = f"SELECT {ARTICLE_COLUMNS} FROM articles WHERE id = ? AND status = 'queued'"
+# Queue pages: id, a short prefix of the processed text and the next slot, keyset paginated by id
+QUEUE_PAGE_COLUMNS = """
+    id, substr(processed_text, 1, ?),
+    (SELECT MIN(scheduled_at) FROM deliveries
+     WHERE article_id = articles.id AND +status = 'queued')
+"""
+SELECT_QUEUE_PAGE_AFTER = (
+    f"SELECT {QUEUE_PAGE_COLUMNS} FROM articles WHERE status = 'queued' AND id > ? ORDER BY id LIMIT ?"
+)
+SELECT_QUEUE_PAGE_BEFORE = (
+    f"SELECT {QUEUE_PAGE_COLUMNS} FROM articles WHERE status = 'queued' AND id < ? ORDER BY id DESC LIMIT ?"
+)
+SELECT_QUEUED_BEFORE = "SELECT EXISTS (SELECT 1 FROM articles WHERE status = 'queued' AND id < ?)"
+SELECT_QUEUED_AFTER = "SELECT EXISTS (SELECT 1 FROM articles WHERE status = 'queued' AND id > ?)"
+COUNT_QUEUED = "SELECT COUNT(*) FROM articles WHERE status = 'queued'"
+COUNT_ARTICLES_BY_STATUS = "SELECT status, COUNT(*) FROM articles GROUP BY status"
+COUNT_DELIVERIES_BY_STATUS = "SELECT status, COUNT(*) FROM deliveries GROUP BY status"
+MARK_DELETED = "UPDATE articles SET status = 'deleted' WHERE id = ?"
+UPDATE_IMAGE_FILE_ID = "UPDATE articles SET image_file_id = ? WHERE id = ?"
+SELECT_QUEUED_IMAGE_PATHS = """
+    SELECT image_path FROM articles WHERE status = 'queued' AND image_path IS NOT NULL
+    UNION
+    SELECT json_extract(image.value, '$.path') FROM articles, json_each(articles.album) AS image
+    WHERE articles.status = 'queued' AND json_extract(image.value, '$.path') IS NOT NULL
+"""
+SELECT_ALBUM = "SELECT album FROM articles WHERE id = ?"
+# The cover (first image) of an album is mirrored in image_path and image_file_id
+UPDATE_IMAGE_PATHS = "UPDATE articles SET image_path = COALESCE(?, image_path), album = ? WHERE id = ?"
+UPDATE_ALBUM_FILE_IDS = "UPDATE articles SET image_file_id = ?, album = ? WHERE id = ?"
+SELECT_QUEUED_DELIVERIES = """
+    SELECT id, article_id, channel, scheduled_at FROM deliveries
+    WHERE status = 'queued' ORDER BY id
+"""
+SELECT_ARTICLE_DELIVERIES = """
+    SELECT id, channel, scheduled_at FROM deliveries
+    WHERE article_id = ? AND +status = 'queued' ORDER BY id
+"""
+SELECT_UNSCHEDULED_DELIVERIES = """
+    SELECT id, channel FROM deliveries
+    WHERE status = 'queued' AND scheduled_at IS NULL ORDER BY id
+"""
+SELECT_DELIVERY = f"""
+    SELECT {DELIVERY_COLUMNS} FROM deliveries d JOIN articles a ON a.id = d.article_id
+    WHERE d.id = ? AND d.status = 'queued'
+"""
+UPDATE_DELIVERY_SCHEDULED = "UPDATE deliveries SET scheduled_at = ? WHERE id = ?"
+# Claims: a delivery is 'sending' while one claim holds its lease. Every claim
+# has its own token, so once a lease ran out (the worker died or stalled) and
+# the delivery was taken over, the old holder's writes no longer match.
+CLAIM_DELIVERY = """
+    UPDATE deliveries SET status = 'sending', claimed_by = ?, lease_until = ?
+    WHERE id = ? AND (status = 'queued' OR (status = 'sending' AND lease_until < ?))
+"""
+SELECT_CLAIMED_DELIVERY = f"""
+    SELECT {DELIVERY_COLUMNS}, d.sent_parts FROM deliveries d JOIN articles a ON a.id = d.article_id
+    WHERE d.id = ? AND d.status = 'sending' AND d.claimed_by = ?
+"""
+RENEW_DELIVERY_LEASE = """
+    UPDATE deliveries SET lease_until = ? WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+RECORD_DELIVERY_PART = """
+    UPDATE deliveries SET
+        sent_parts = sent_parts + 1,
+        message_ids = json_insert(COALESCE(message_ids, '[]'), '$[#]', ?),
+        lease_until = ?
+    WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+MARK_DELIVERY_POSTED = """
+    UPDATE deliveries SET status = 'posted', posted_at = ?, claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+RELEASE_DELIVERY = """
+    UPDATE deliveries SET status = 'queued', claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+MARK_DELIVERY_FAILED = """
+    UPDATE deliveries SET status = 'failed', claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND status IN ('queued', 'sending')
+"""
+# The send failed without an answer from Telegram: an admin checks the
+# channel and requeues it, counting the part in flight as sent if it arrived
+MARK_DELIVERY_UNCONFIRMED = """
+    UPDATE deliveries SET status = 'unconfirmed', claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+REQUEUE_UNCONFIRMED = """
+    UPDATE deliveries SET status = 'queued', sent_parts = sent_parts + ?
+    WHERE id = ? AND status = 'unconfirmed'
+"""
+SELECT_EXPIRED_CLAIMS = """
+    SELECT id, channel, scheduled_at FROM deliveries
+    WHERE status = 'sending' AND lease_until < ? ORDER BY id
+"""
+RECOVER_EXPIRED_CLAIMS = """
+    UPDATE deliveries SET status = 'queued', claimed_by = NULL, lease_until = NULL
+    WHERE status = 'sending' AND lease_until < ?
+"""
+MARK_DELIVERIES_DELETED = (
+    "UPDATE deliveries SET status = 'deleted' WHERE article_id = ? AND +status = 'queued'"
+)
+RECORD_DELIVERY_FAILURE = """
+    UPDATE deliveries SET
+        attempts = attempts + 1, status = 'queued', claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND status = 'sending' AND claimed_by = ?
+"""
+SELECT_DELIVERY_ATTEMPTS = "SELECT attempts FROM deliveries WHERE id = ?"
+SELECT_DELIVERY_ARTICLE = "SELECT article_id FROM deliveries WHERE id = ?"
+# An article is finished once none of its deliveries is queued, being sent or unconfirmed:
+# it counts as posted if at least one channel got it, otherwise as failed
+FINISH_ARTICLE = """
+    UPDATE articles SET
+        status = CASE WHEN EXISTS (
+            SELECT 1 FROM deliveries WHERE article_id = articles.id AND +status = 'posted'
+        ) THEN 'posted' ELSE 'failed' END,
+        posted_at = (
+            SELECT MAX(posted_at) FROM deliveries WHERE article_id = articles.id
+        )
+    WHERE id = ? AND status = 'queued' AND NOT EXISTS (
+        SELECT 1 FROM deliveries
+        WHERE article_id = articles.id AND +status IN ('queued', 'sending', 'unconfirmed')
+    )
+"""
+# Posted and deleted articles are archived at once; failed ones are kept for
+# the admin to look into until they are older than the cutoff parameter
+FINISHED_ARTICLES = (
+    "SELECT id FROM articles WHERE status IN ('posted', 'deleted') "
+    "OR (status = 'failed' AND created_at < ?)"
+)
+ARCHIVE_FINISHED = f"""
+    INSERT INTO articles_archive (
+        id, text, processed_text, image_path, status, created_at, scheduled_at, posted_at,
+        image_file_id, attempts, archived_at
+    )
+    SELECT id, text, processed_text, image_path, status, created_at, scheduled_at, posted_at,
+        image_file_id, attempts, ?
+    FROM articles WHERE id IN ({FINISHED_ARTICLES})
+"""
+ARCHIVE_FINISHED_DELIVERIES = f"""
+    INSERT INTO deliveries_archive (
+        id, article_id, channel, status, scheduled_at, posted_at, attempts, message_ids
+    )
+    SELECT id, article_id, channel, status, scheduled_at, posted_at, attempts, message_ids
+    FROM deliveries
+    WHERE article_id IN ({FINISHED_ARTICLES})
+"""
+DELETE_FINISHED_DELIVERIES = f"DELETE FROM deliveries WHERE article_id IN ({FINISHED_ARTICLES})"
+DELETE_FINISHED = f"DELETE FROM articles WHERE id IN ({FINISHED_ARTICLES})"
+SELECT_CACHED_REWRITE = "SELECT processed_text FROM rewrite_cache WHERE key = ? AND created_at >= ?"
+TOUCH_CACHED_REWRITE = "UPDATE rewrite_cache SET last_used_at = ? WHERE key = ?"
+UPSERT_CACHED_REWRITE = """
+    INSERT INTO rewrite_cache (key, processed_text, created_at, last_used_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        processed_text = excluded.processed_text,
+        created_at = excluded.created_at,
+        last_used_at = excluded.last_used_at
+"""
+DELETE_EXPIRED_REWRITES = "DELETE FROM rewrite_cache WHERE created_at < ?"
+# Least recently used entries beyond the size cap
+DELETE_LRU_REWRITES = """
+    DELETE FROM rewrite_cache WHERE key IN (
+        SELECT key FROM rewrite_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+    )
+"""
+SELECT_FSM_RECORD = "SELECT state, data FROM fsm_states WHERE key = ? AND updated_at >= ?"
+UPSERT_FSM_STATE = """
+    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, '{}', ?)
+    ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+"""
+UPSERT_FSM_DATA = """
+    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, NULL, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+"""
+DELETE_EXPIRED_FSM = "DELETE FROM fsm_states WHERE updated_at < ?"
+# Near-duplicate index: a MinHash signature per original text plus one row per LSH band
+INSERT_SIGNATURE = (
+    "INSERT OR REPLACE INTO text_signatures (article_id, signature, created_at) VALUES (?, ?, ?)"
+)
+INSERT_BAND = "INSERT OR IGNORE INTO text_bands (band, article_id) VALUES (?, ?)"
+# Texts sharing a band are candidates; those sharing the most bands are compared
+# first. Only the newest entries of each band bucket are read, so a bucket that
+# common phrases have filled costs no more than any other
+BAND_BUCKET = "SELECT * FROM (SELECT article_id FROM text_bands WHERE band = ? ORDER BY article_id DESC LIMIT ?)"
+SELECT_BAND_CANDIDATES = f"""
+    SELECT s.article_id, s.signature FROM (
+        SELECT article_id, COUNT(*) AS shared FROM ({" UNION ALL ".join([BAND_BUCKET] * BANDS)})
+        GROUP BY article_id ORDER BY shared DESC LIMIT ?
+    ) AS c JOIN text_signatures s ON s.article_id = c.article_id
+    WHERE s.created_at >= ?
+"""
+# Rows written before the columns derived from them existed
+SELECT_UNPREPARED_ARTICLES = """
+    SELECT id, processed_text, image_path, image_file_id FROM articles
+    WHERE status = 'queued' AND post_parts IS NULL
+"""
+UPDATE_ARTICLE_POST = """
+    UPDATE articles SET post_html = ?, post_bytes = ?, post_mode = ?, post_parts = ? WHERE id = ?
+"""
+SELECT_UNINDEXED_TEXTS = """
+    SELECT id, text, created_at FROM articles a
+    WHERE status != 'deleted' AND created_at >= ?
+        AND NOT EXISTS (SELECT 1 FROM text_signatures s WHERE s.article_id = a.id)
+    UNION ALL
+    SELECT id, text, created_at FROM articles_archive a
+    WHERE status = 'posted' AND created_at >= ?
+        AND NOT EXISTS (SELECT 1 FROM text_signatures s WHERE s.article_id = a.id)
+"""
+SELECT_ANY_STATUS = """
+    SELECT status FROM articles WHERE id = ?
+    UNION ALL SELECT status FROM articles_archive WHERE id = ?
+    LIMIT 1
+"""
+# Bands are only reachable through their signature, so dropping the signature
+# unindexes an article; the orphaned band rows are swept with the expired ones
+DELETE_SIGNATURE = "DELETE FROM text_signatures WHERE article_id = ?"
+DELETE_EXPIRED_SIGNATURES = "DELETE FROM text_signatures WHERE created_at < ?"
+DELETE_ORPHAN_BANDS = """
+    DELETE FROM text_bands WHERE article_id NOT IN (SELECT article_id FROM text_signatures)
+"""
+
+
+def _backfill_deliveries(conn):
+    # Articles queued before multi-channel support target the original channel
+    conn.execute(
+        """
+        INSERT INTO deliveries (article_id, channel, status, scheduled_at, attempts)
+        SELECT id, ?, status, scheduled_at, attempts FROM articles
+        WHERE status IN ('queued', 'failed')
+        """,
+        (CHANNEL_NAME,),
+    )
+
+
+def _index_text(conn, article_id, text, created_at):
+    """Add a text to the near-duplicate index; False if it has no words to index"""
+    sig = signature(text or "")
+    if sig is None:
+        return False
+    conn.execute(INSERT_SIGNATURE, (article_id, to_blob(sig), created_at))
+    conn.executemany(INSERT_BAND, [(band, article_id) for band in band_keys(sig)])
+    return True
 
 
-def create_table(conn):
-    cursor = conn.cursor()
-    cursor.execute(
+# Schema migrations, applied in order. The index of the last applied
+# migration is stored in PRAGMA user_version; never edit a shipped entry,
+# append a new one instead. Columns derived by application code (prepared
+# posts, MinHash signatures) are not filled here, since what a migration
+# writes must not change with that code; rebuild_derived_data() fills them.
+MIGRATIONS = (
+    # 1: initial schema
+    (
         """
         CREATE TABLE IF NOT EXISTS articles (
             id INTEGER PRIMARY KEY,
@@ -21,66 +308,742 @@ def create_table(conn):
             created_at TIMESTAMP,
             scheduled_at TIMESTAMP
         )
-    """
+        """,
+    ),
+    # 2: due-time index, posted status and archive table for finished rows.
+    # The table is rebuilt with AUTOINCREMENT so ids of archived rows are never reused.
+    (
+        """
+        CREATE TABLE articles_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            processed_text TEXT,
+            image_path TEXT,
+            status TEXT,
+            created_at TIMESTAMP,
+            scheduled_at TIMESTAMP,
+            posted_at TIMESTAMP
+        )
+        """,
+        """
+        INSERT INTO articles_new (id, text, processed_text, image_path, status, created_at, scheduled_at)
+        SELECT id, text, processed_text, image_path, status, created_at, scheduled_at FROM articles
+        """,
+        "DROP TABLE articles",
+        "ALTER TABLE articles_new RENAME TO articles",
+        "CREATE INDEX idx_articles_status_scheduled ON articles (status, scheduled_at)",
+        """
+        CREATE TABLE IF NOT EXISTS articles_archive (
+            id INTEGER PRIMARY KEY,
+            text TEXT,
+            processed_text TEXT,
+            image_path TEXT,
+            status TEXT,
+            created_at TIMESTAMP,
+            scheduled_at TIMESTAMP,
+            posted_at TIMESTAMP,
+            archived_at TIMESTAMP
+        )
+        """,
+    ),
+    # 3: Telegram file_id of the article image, so posts don't re-upload it
+    (
+        "ALTER TABLE articles ADD COLUMN image_file_id TEXT",
+        "ALTER TABLE articles_archive ADD COLUMN image_file_id TEXT",
+    ),
+    # 4: failed send counter; articles that keep failing get status 'failed'
+    (
+        "ALTER TABLE articles ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE articles_archive ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+    ),
+    # 5: per-channel deliveries; scheduling, retries and status move from the article here
+    (
+        """
+        CREATE TABLE deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            article_id INTEGER NOT NULL REFERENCES articles (id),
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL,
+            scheduled_at TIMESTAMP,
+            posted_at TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (article_id, channel)
+        )
+        """,
+        "CREATE INDEX idx_deliveries_status_scheduled ON deliveries (status, scheduled_at)",
+        """
+        CREATE TABLE deliveries_archive (
+            id INTEGER PRIMARY KEY,
+            article_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL,
+            scheduled_at TIMESTAMP,
+            posted_at TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        _backfill_deliveries,
+    ),
+    # 6: LLM rewrite cache keyed by a hash of model, prompt and normalized input
+    (
+        """
+        CREATE TABLE rewrite_cache (
+            key TEXT PRIMARY KEY,
+            processed_text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            last_used_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_rewrite_cache_last_used ON rewrite_cache (last_used_at)",
+    ),
+    # 7: aiogram FSM states and data, so in-flight submissions survive restarts
+    (
+        """
+        CREATE TABLE fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_fsm_states_updated ON fsm_states (updated_at)",
+    ),
+    # 8: sanitized HTML, its size and the delivery mode, computed once at enqueue time
+    (
+        "ALTER TABLE articles ADD COLUMN post_html TEXT",
+        "ALTER TABLE articles ADD COLUMN post_bytes INTEGER",
+        "ALTER TABLE articles ADD COLUMN post_mode TEXT",
+    ),
+    # 9: the post split into a caption or message plus continuation messages
+    (
+        "ALTER TABLE articles ADD COLUMN post_parts TEXT",
+    ),
+    # 10: delivery claims with a lease, and the Telegram message ids of sent parts
+    (
+        "ALTER TABLE deliveries ADD COLUMN claimed_by TEXT",
+        "ALTER TABLE deliveries ADD COLUMN lease_until TIMESTAMP",
+        "ALTER TABLE deliveries ADD COLUMN sent_parts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE deliveries ADD COLUMN message_ids TEXT",
+        "ALTER TABLE deliveries_archive ADD COLUMN message_ids TEXT",
+    ),
+    # 11: near-duplicate index over the original texts (MinHash signatures and LSH bands)
+    (
+        """
+        CREATE TABLE text_signatures (
+            article_id INTEGER PRIMARY KEY,
+            signature BLOB NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_text_signatures_created ON text_signatures (created_at)",
+        """
+        CREATE TABLE text_bands (
+            band INTEGER NOT NULL,
+            article_id INTEGER NOT NULL,
+            PRIMARY KEY (band, article_id)
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 12: albums: the images of a multi-photo post as [{"file_id", "path"}, ...]
+    (
+        "ALTER TABLE articles ADD COLUMN album TEXT",
+    ),
+)
+
+
+def create_connection(database_file=DATABASE_FILE):
+    conn = sqlite3.connect(
+        database_file, check_same_thread=False, cached_statements=128
     )
-    conn.commit()
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending schema migrations, each in its own transaction"""
+    version = get_schema_version(conn)
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info(f"Applied database migration {number}")
+
+
+class ArticleRepository:
+    """Holds one SQLite connection and runs every query on a dedicated worker thread"""
+
+    def __init__(self, database_file=DATABASE_FILE):
+        self.database_file = database_file
+        self._conn = None
+        # A single worker serialises access to the connection and keeps it off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = create_connection(self.database_file)
+        return self._conn
+
+    @staticmethod
+    def _timed(func, *args):
+        with db_query_seconds.time(method=func.__name__):
+            return func(*args)
+
+    def call(self, func, *args):
+        """Run a repository method on the worker thread and wait for the result"""
+        return self._executor.submit(self._timed, func, *args).result()
+
+    async def run(self, func, *args):
+        """Run a repository method on the worker thread without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._timed, func, *args)
+
+    def initialize(self):
+        migrate(self.conn)
+
+    def rebuild_derived_data(self, signatures_since):
+        """Prepare queued articles and index texts stored before those columns existed
+
+        Texts created before signatures_since are not indexed; None skips
+        the index. Returns the number of posts prepared and texts indexed.
+        """
+        with self.conn:
+            rows = self.conn.execute(SELECT_UNPREPARED_ARTICLES).fetchall()
+            for article_id, processed_text, image_path, image_file_id in rows:
+                post = prepare_post(processed_text or "", bool(image_path or image_file_id))
+                self.conn.execute(
+                    UPDATE_ARTICLE_POST,
+                    (post.html, post.byte_length, post.mode, json.dumps(post.parts), article_id),
+                )
+        if signatures_since is None:
+            return len(rows), 0
+        with self.conn:
+            texts = self.conn.execute(
+                SELECT_UNINDEXED_TEXTS, (signatures_since, signatures_since)
+            ).fetchall()
+            indexed = sum(
+                _index_text(self.conn, article_id, text, created_at)
+                for article_id, text, created_at in texts
+            )
+        return len(rows), indexed
+
+    def _insert_article(
+        self, text, processed_text, image_path, image_file_id, channels, post=None, album=None
+    ):
+        if post is None:
+            post = prepare_post(processed_text, bool(image_path or image_file_id))
+        created_at = datetime.now()
+        cursor = self.conn.execute(
+            INSERT_ARTICLE,
+            (
+                text, processed_text, image_path, image_file_id, "queued", created_at,
+                post.html, post.byte_length, post.mode, json.dumps(post.parts),
+                json.dumps([{"file_id": file_id, "path": None} for file_id in album]) if album else None,
+            ),
+        )
+        article_id = cursor.lastrowid
+        self.conn.executemany(
+            INSERT_DELIVERY, [(article_id, channel) for channel in channels]
+        )
+        _index_text(self.conn, article_id, text, created_at)
+        return article_id
+
+    def add_article(
+        self, text, processed_text, image_path=None, image_file_id=None, channels=(), post=None,
+        album=None,
+    ):
+        """Insert an article with one queued delivery per target channel
+
+        `post` is the article's PreparedPost; it is computed here when not given.
+        `album` lists the file_ids of a multi-photo post, cover first.
+        """
+        with self.conn:
+            return self._insert_article(
+                text, processed_text, image_path, image_file_id, channels, post, album
+            )
+
+    def add_articles(self, articles, channels=()):
+        """Insert (text, processed_text, image_path, image_file_id, album, post) tuples in one transaction"""
+        with self.conn:
+            return [
+                self._insert_article(
+                    text, processed_text, image_path, image_file_id, channels, post, album
+                )
+                for text, processed_text, image_path, image_file_id, album, post in articles
+            ]
+
+    def get_queued_articles(self):
+        return self.conn.execute(SELECT_QUEUED).fetchall()
+
+    def get_article_by_id(self, article_id):
+        return self.conn.execute(SELECT_BY_ID, (article_id,)).fetchone()
+
+    def get_queue_page(self, after_id=0, before_id=None, limit=10, preview_length=60):
+        """One page of the queue as (rows, has_prev, has_next, total)
+
+        Rows are (id, preview, scheduled_at) in id order, starting after
+        `after_id`, or ending before `before_id` when that is given. A page
+        that has emptied out (its articles were posted or deleted) falls
+        back to the first one.
+        """
+        if before_id is not None:
+            rows = self.conn.execute(
+                SELECT_QUEUE_PAGE_BEFORE, (preview_length, before_id, limit)
+            ).fetchall()
+            rows.reverse()
+        else:
+            rows = self.conn.execute(
+                SELECT_QUEUE_PAGE_AFTER, (preview_length, after_id, limit)
+            ).fetchall()
+        if not rows and (after_id or before_id is not None):
+            return self.get_queue_page(limit=limit, preview_length=preview_length)
+
+        total = self.conn.execute(COUNT_QUEUED).fetchone()[0]
+        if not rows:
+            return rows, False, False, total
+        has_prev = bool(self.conn.execute(SELECT_QUEUED_BEFORE, (rows[0][0],)).fetchone()[0])
+        has_next = bool(self.conn.execute(SELECT_QUEUED_AFTER, (rows[-1][0],)).fetchone()[0])
+        return rows, has_prev, has_next, total
+
+    def count_by_status(self):
+        """Row counts of the hot articles and deliveries tables as {(table, status): count}"""
+        counts = {}
+        for table, statement in (
+            ("articles", COUNT_ARTICLES_BY_STATUS),
+            ("deliveries", COUNT_DELIVERIES_BY_STATUS),
+        ):
+            for status, count in self.conn.execute(statement):
+                counts[table, status] = count
+        return counts
+
+    def delete_article(self, article_id):
+        """Delete an article and return (delivery id, channel) of its still queued deliveries"""
+        with self.conn:
+            deliveries = [
+                (row[0], row[1])
+                for row in self.conn.execute(SELECT_ARTICLE_DELIVERIES, (article_id,))
+            ]
+            self.conn.execute(MARK_DELIVERIES_DELETED, (article_id,))
+            self.conn.execute(MARK_DELETED, (article_id,))
+            # A deleted article no longer counts as a copy of anything
+            self.conn.execute(DELETE_SIGNATURE, (article_id,))
+        return deliveries
+
+    def get_queued_deliveries(self):
+        return self.conn.execute(SELECT_QUEUED_DELIVERIES).fetchall()
+
+    def get_article_deliveries(self, article_id):
+        return self.conn.execute(SELECT_ARTICLE_DELIVERIES, (article_id,)).fetchall()
+
+    def get_unscheduled_deliveries(self):
+        return self.conn.execute(SELECT_UNSCHEDULED_DELIVERIES).fetchall()
+
+    def get_delivery(self, delivery_id):
+        return self.conn.execute(SELECT_DELIVERY, (delivery_id,)).fetchone()
+
+    def update_delivery_scheduled(self, delivery_id, scheduled_at):
+        with self.conn:
+            self.conn.execute(UPDATE_DELIVERY_SCHEDULED, (scheduled_at, delivery_id))
+
+    def _finish_article(self, delivery_id):
+        row = self.conn.execute(SELECT_DELIVERY_ARTICLE, (delivery_id,)).fetchone()
+        if row:
+            self.conn.execute(FINISH_ARTICLE, (row[0],))
+
+    def claim_delivery(self, delivery_id, claim, lease):
+        """Take a queued delivery (or one whose lease ran out) for `lease`
+
+        `claim` is a token unique to this claim; every later write of the
+        claim passes it. Returns the delivery row followed by the number of
+        parts already sent, or None if it is posted, finished or held by
+        another claim.
+        """
+        now = datetime.now()
+        with self.conn:
+            claimed = self.conn.execute(
+                CLAIM_DELIVERY, (claim, now + lease, delivery_id, now)
+            ).rowcount
+        if not claimed:
+            return None
+        return self.conn.execute(SELECT_CLAIMED_DELIVERY, (delivery_id, claim)).fetchone()
+
+    def renew_delivery_lease(self, delivery_id, claim, lease):
+        """Extend the lease of a claim; False if the claim was lost"""
+        with self.conn:
+            return bool(self.conn.execute(
+                RENEW_DELIVERY_LEASE, (datetime.now() + lease, delivery_id, claim)
+            ).rowcount)
+
+    def record_delivery_part(self, delivery_id, claim, message_id, lease):
+        """Store the message id of a sent part and extend the lease; False if the claim was lost"""
+        with self.conn:
+            return bool(self.conn.execute(
+                RECORD_DELIVERY_PART, (message_id, datetime.now() + lease, delivery_id, claim)
+            ).rowcount)
+
+    def release_delivery(self, delivery_id, claim):
+        """Put a claimed delivery back in the queue without counting a failure"""
+        with self.conn:
+            self.conn.execute(RELEASE_DELIVERY, (delivery_id, claim))
+
+    def mark_delivery_posted(self, delivery_id, claim):
+        with self.conn:
+            self.conn.execute(MARK_DELIVERY_POSTED, (datetime.now(), delivery_id, claim))
+            self._finish_article(delivery_id)
+
+    def record_delivery_failure(self, delivery_id, claim):
+        """Count a failed post, release the claim and return the number of failures so far"""
+        with self.conn:
+            self.conn.execute(RECORD_DELIVERY_FAILURE, (delivery_id, claim))
+            row = self.conn.execute(SELECT_DELIVERY_ATTEMPTS, (delivery_id,)).fetchone()
+        return row[0] if row else 0
+
+    def mark_delivery_failed(self, delivery_id):
+        with self.conn:
+            self.conn.execute(MARK_DELIVERY_FAILED, (delivery_id,))
+            self._finish_article(delivery_id)
+
+    def mark_delivery_unconfirmed(self, delivery_id, claim):
+        with self.conn:
+            self.conn.execute(MARK_DELIVERY_UNCONFIRMED, (delivery_id, claim))
+
+    def requeue_unconfirmed(self, delivery_id, part_arrived):
+        """Put an unconfirmed delivery back in the queue; False if it was not unconfirmed
+
+        With `part_arrived` the part whose send went unanswered counts as sent.
+        """
+        with self.conn:
+            return bool(self.conn.execute(
+                REQUEUE_UNCONFIRMED, (int(part_arrived), delivery_id)
+            ).rowcount)
+
+    def recover_expired_claims(self):
+        """Requeue deliveries whose worker died mid-send; returns (id, channel, scheduled_at) rows
+
+        Parts recorded as sent are skipped when the delivery is claimed again.
+        """
+        now = datetime.now()
+        with self.conn:
+            rows = self.conn.execute(SELECT_EXPIRED_CLAIMS, (now,)).fetchall()
+            self.conn.execute(RECOVER_EXPIRED_CLAIMS, (now,))
+        return rows
+
+    def archive_finished_articles(self, failed_before):
+        """Move finished rows out of the hot articles and deliveries tables
+
+        Posted and deleted articles go at once, failed ones when they were
+        submitted before `failed_before`.
+        """
+        with self.conn:
+            self.conn.execute(ARCHIVE_FINISHED_DELIVERIES, (failed_before,))
+            self.conn.execute(DELETE_FINISHED_DELIVERIES, (failed_before,))
+            cursor = self.conn.execute(ARCHIVE_FINISHED, (datetime.now(), failed_before))
+            self.conn.execute(DELETE_FINISHED, (failed_before,))
+        return cursor.rowcount
+
+    def update_image_file_id(self, article_id, image_file_id):
+        with self.conn:
+            self.conn.execute(UPDATE_IMAGE_FILE_ID, (image_file_id, article_id))
+
+    def get_queued_image_paths(self):
+        return {row[0] for row in self.conn.execute(SELECT_QUEUED_IMAGE_PATHS)}
+
+    def set_image_paths(self, article_id, paths):
+        """Store where the local copies of an article's images went, in album order"""
+        with self.conn:
+            row = self.conn.execute(SELECT_ALBUM, (article_id,)).fetchone()
+            if row is None:
+                return
+            album = json.loads(row[0]) if row[0] else None
+            for image, path in zip(album or (), paths):
+                if path:
+                    image["path"] = path
+            self.conn.execute(
+                UPDATE_IMAGE_PATHS,
+                (paths[0] if paths else None, json.dumps(album) if album else None, article_id),
+            )
+
+    def update_album_file_ids(self, article_id, file_ids):
+        """Replace the file_ids of an album after its local copies were uploaded again"""
+        with self.conn:
+            row = self.conn.execute(SELECT_ALBUM, (article_id,)).fetchone()
+            if row is None or not row[0]:
+                return
+            album = json.loads(row[0])
+            for image, file_id in zip(album, file_ids):
+                image["file_id"] = file_id
+            self.conn.execute(UPDATE_ALBUM_FILE_IDS, (album[0]["file_id"], json.dumps(album), article_id))
+
+    def get_cached_rewrite(self, key, not_before):
+        """Return a cached rewrite created after not_before and mark it as used"""
+        row = self.conn.execute(SELECT_CACHED_REWRITE, (key, not_before)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute(TOUCH_CACHED_REWRITE, (datetime.now(), key))
+        return row[0]
+
+    def put_cached_rewrite(self, key, processed_text):
+        now = datetime.now()
+        with self.conn:
+            self.conn.execute(UPSERT_CACHED_REWRITE, (key, processed_text, now, now))
+
+    def evict_rewrite_cache(self, max_entries, not_before):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        with self.conn:
+            expired = self.conn.execute(DELETE_EXPIRED_REWRITES, (not_before,)).rowcount
+            evicted = self.conn.execute(DELETE_LRU_REWRITES, (max_entries,)).rowcount
+        return expired + evicted
+
+    def get_fsm_record(self, key, not_before):
+        """Return (state, data) for a key unless it expired before not_before"""
+        row = self.conn.execute(SELECT_FSM_RECORD, (key, not_before)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def set_fsm_state(self, key, state):
+        with self.conn:
+            self.conn.execute(UPSERT_FSM_STATE, (key, state, datetime.now()))
+
+    def set_fsm_data(self, key, data):
+        with self.conn:
+            self.conn.execute(UPSERT_FSM_DATA, (key, json.dumps(data), datetime.now()))
+
+    def update_fsm_data(self, key, patch, not_before):
+        """Merge patch into the stored data in a single transaction and return the result"""
+        with self.conn:
+            # sqlite3 would only begin the transaction at the write; taking the
+            # write lock first keeps other connections from updating the row
+            # between the read and the write
+            self.conn.execute("BEGIN IMMEDIATE")
+            _, data = self.get_fsm_record(key, not_before)
+            data.update(patch)
+            self.conn.execute(UPSERT_FSM_DATA, (key, json.dumps(data), datetime.now()))
+        return data
+
+    def delete_expired_fsm(self, not_before):
+        with self.conn:
+            return self.conn.execute(DELETE_EXPIRED_FSM, (not_before,)).rowcount
+
+    def find_similar(self, sig, threshold, not_before, limit=3, candidates=20):
+        """Indexed articles created after not_before whose text looks like a copy of `sig`
+
+        The newest `candidates` texts of each LSH band bucket are read, and of
+        them the `candidates` sharing the most bands are compared. Returns up
+        to `limit` (article_id, similarity, status) tuples, most similar
+        first; status is None if the article is no longer stored.
+        """
+        buckets = [param for key in band_keys(sig) for param in (key, candidates)]
+        rows = self.conn.execute(
+            SELECT_BAND_CANDIDATES, (*buckets, candidates, not_before)
+        ).fetchall()
+        matches = sorted(
+            (
+                (score, article_id)
+                for article_id, blob in rows
+                if (score := similarity(sig, from_blob(blob))) >= threshold
+            ),
+            reverse=True,
+        )[:limit]
+        result = []
+        for score, article_id in matches:
+            row = self.conn.execute(SELECT_ANY_STATUS, (article_id, article_id)).fetchone()
+            result.append((article_id, score, row[0] if row else None))
+        return result
+
+    def evict_signatures(self, not_before):
+        """Drop index entries of articles created before not_before, and of deleted ones"""
+        with self.conn:
+            evicted = self.conn.execute(DELETE_EXPIRED_SIGNATURES, (not_before,)).rowcount
+            self.conn.execute(DELETE_ORPHAN_BANDS)
+        return evicted
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+repository = ArticleRepository()
 
 
 def initialize_database():
-    conn = create_connection()
-    create_table(conn)
-    conn.close()
-
-
-def add_article(text, processed_text, image_path=None):
-    conn = create_connection()
-    cursor = conn.cursor()
-    status = "queued"
-    created_at = datetime.now()
-    cursor.execute(
-        """
-        INSERT INTO articles (text, processed_text, image_path, status, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    """,
-        (text, processed_text, image_path, status, created_at),
-    )
-    conn.commit()
-    conn.close()
+    repository.call(repository.initialize)
 
 
-def get_queued_articles():
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM articles WHERE status = 'queued'")
-    articles = cursor.fetchall()
-    conn.close()
-    return articles
+async def rebuild_derived_data(signatures_since):
+    return await repository.run(repository.rebuild_derived_data, signatures_since)
 
 
-def get_article_by_id(article_id):
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM articles WHERE id = ? AND status = 'queued'", (article_id,)
+async def add_article(
+    text, processed_text, image_path=None, image_file_id=None, channels=(), post=None, album=None
+):
+    return await repository.run(
+        repository.add_article, text, processed_text, image_path, image_file_id, channels, post,
+        album,
     )
-    article = cursor.fetchone()
-    conn.close()
-    return article
 
 
-def delete_article(article_id):
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE articles SET status = 'deleted' WHERE id = ?", (article_id,))
-    conn.commit()
-    conn.close()
+async def add_articles(articles, channels=()):
+    return await repository.run(repository.add_articles, articles, channels)
+
+
+async def get_queued_articles():
+    return await repository.run(repository.get_queued_articles)
+
+
+async def get_queue_page(after_id=0, before_id=None, limit=10):
+    return await repository.run(repository.get_queue_page, after_id, before_id, limit)
+
+
+async def count_by_status():
+    return await repository.run(repository.count_by_status)
+
+
+async def get_article_by_id(article_id):
+    return await repository.run(repository.get_article_by_id, article_id)
+
+
+async def delete_article(article_id):
+    return await repository.run(repository.delete_article, article_id)
+
+
+async def get_queued_deliveries():
+    return await repository.run(repository.get_queued_deliveries)
+
+
+async def get_article_deliveries(article_id):
+    return await repository.run(repository.get_article_deliveries, article_id)
+
+
+async def get_unscheduled_deliveries():
+    return await repository.run(repository.get_unscheduled_deliveries)
+
+
+async def get_delivery(delivery_id):
+    return await repository.run(repository.get_delivery, delivery_id)
+
+
+async def update_delivery_scheduled(delivery_id, scheduled_at):
+    await repository.run(repository.update_delivery_scheduled, delivery_id, scheduled_at)
+
+
+async def claim_delivery(delivery_id, claim, lease):
+    return await repository.run(repository.claim_delivery, delivery_id, claim, lease)
+
 
+async def renew_delivery_lease(delivery_id, claim, lease):
+    return await repository.run(repository.renew_delivery_lease, delivery_id, claim, lease)
 
-def update_time_scheduled(article_id, scheduled_at):
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE articles SET scheduled_at = ? WHERE id = ?", (scheduled_at, article_id)
+
+async def record_delivery_part(delivery_id, claim, message_id, lease):
+    return await repository.run(
+        repository.record_delivery_part, delivery_id, claim, message_id, lease
     )
-    conn.commit()
-    conn.close()
+
+
+async def release_delivery(delivery_id, claim):
+    await repository.run(repository.release_delivery, delivery_id, claim)
+
+
+async def mark_delivery_posted(delivery_id, claim):
+    await repository.run(repository.mark_delivery_posted, delivery_id, claim)
+
+
+async def record_delivery_failure(delivery_id, claim):
+    return await repository.run(repository.record_delivery_failure, delivery_id, claim)
+
+
+async def mark_delivery_failed(delivery_id):
+    await repository.run(repository.mark_delivery_failed, delivery_id)
+
+
+async def mark_delivery_unconfirmed(delivery_id, claim):
+    await repository.run(repository.mark_delivery_unconfirmed, delivery_id, claim)
+
+
+async def requeue_unconfirmed(delivery_id, part_arrived):
+    return await repository.run(repository.requeue_unconfirmed, delivery_id, part_arrived)
+
+
+async def recover_expired_claims():
+    return await repository.run(repository.recover_expired_claims)
+
+
+async def archive_finished_articles(failed_before):
+    return await repository.run(repository.archive_finished_articles, failed_before)
+
+
+async def update_image_file_id(article_id, image_file_id):
+    await repository.run(repository.update_image_file_id, article_id, image_file_id)
+
+
+async def get_queued_image_paths():
+    return await repository.run(repository.get_queued_image_paths)
+
+
+async def set_image_paths(article_id, paths):
+    await repository.run(repository.set_image_paths, article_id, paths)
+
+
+async def update_album_file_ids(article_id, file_ids):
+    await repository.run(repository.update_album_file_ids, article_id, file_ids)
+
+
+async def get_cached_rewrite(key, not_before):
+    return await repository.run(repository.get_cached_rewrite, key, not_before)
+
+
+async def put_cached_rewrite(key, processed_text):
+    await repository.run(repository.put_cached_rewrite, key, processed_text)
+
+
+async def evict_rewrite_cache(max_entries, not_before):
+    return await repository.run(repository.evict_rewrite_cache, max_entries, not_before)
+
+
+async def get_fsm_record(key, not_before):
+    return await repository.run(repository.get_fsm_record, key, not_before)
+
+
+async def set_fsm_state(key, state):
+    await repository.run(repository.set_fsm_state, key, state)
+
+
+async def set_fsm_data(key, data):
+    await repository.run(repository.set_fsm_data, key, data)
+
+
+async def update_fsm_data(key, patch, not_before):
+    return await repository.run(repository.update_fsm_data, key, patch, not_before)
+
+
+async def delete_expired_fsm(not_before):
+    return await repository.run(repository.delete_expired_fsm, not_before)
+
+
+async def find_similar(sig, threshold, not_before, limit=3):
+    return await repository.run(repository.find_similar, sig, threshold, not_before, limit)
+
+
+async def evict_signatures(not_before):
+    return await repository.run(repository.evict_signatures, not_before)
+
+
+async def close_database():
+    await repository.run(repository.close)
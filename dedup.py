@@ -0,0 +1,97 @@
+import hashlib
+import operator
+import re
+import struct
+import zlib
+from array import array
+from functools import lru_cache
+
+# One-permutation MinHash: every shingle is hashed once and lands in one of
+# NUM_BINS bins, each keeping its minimum. LSH splits the signature into
+# BANDS bands of ROWS bins; texts sharing any band are compared in full.
+# With 21 bands of 3 rows, pairs above ~0.4 estimated Jaccard similarity
+# become candidates with high probability while unrelated texts rarely do.
+NUM_BINS = 64
+BANDS = 21
+ROWS = 3
+# Word pairs tolerate the small rewordings between outlets better than longer shingles
+SHINGLE_WORDS = 2
+
+EMPTY = 0xFFFFFFFF
+# Odd multiplier spreading CRC-32 values over the bins
+MIX = 0x9E3779B1
+WORD = re.compile(r"\w+")
+BAND_FORMAT = struct.Struct(f"<I{ROWS}I")
+
+
+def shingles(text):
+    words = WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {
+        " ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+# The check before the rewrite and the indexing at enqueue sign the same text;
+# recent signatures and band keys are kept so the second one is free. Callers
+# must not modify the returned arrays.
+@lru_cache(maxsize=256)
+def signature(text):
+    """MinHash signature of a text as an array of NUM_BINS 32-bit values, or None if it has no words"""
+    items = shingles(text)
+    if not items:
+        return None
+    bins = [EMPTY] * NUM_BINS
+    for item in items:
+        # CRC-32 is several times cheaper than a cryptographic hash and good enough here
+        value = zlib.crc32(item.encode("utf-8")) * MIX & EMPTY
+        index = value % NUM_BINS
+        value //= NUM_BINS
+        if value < bins[index]:
+            bins[index] = value
+
+    # Empty bins borrow from the next filled one, shifted by the distance, so
+    # that similar texts fill them the same way (rotation densification)
+    for index in range(NUM_BINS):
+        if bins[index] == EMPTY:
+            distance = 1
+            while bins[(index + distance) % NUM_BINS] == EMPTY:
+                distance += 1
+            bins[index] = (bins[(index + distance) % NUM_BINS] + distance * MIX) % EMPTY
+    return array("I", bins)
+
+
+def band_keys(sig):
+    """One signed 64-bit key per band, ready to store as an SQLite INTEGER"""
+    return _band_keys(sig.tobytes())
+
+
+@lru_cache(maxsize=256)
+def _band_keys(packed):
+    sig = from_blob(packed)
+    return tuple(
+        int.from_bytes(
+            hashlib.blake2b(
+                BAND_FORMAT.pack(band, *sig[band * ROWS:(band + 1) * ROWS]), digest_size=8
+            ).digest(),
+            "little",
+            signed=True,
+        )
+        for band in range(BANDS)
+    )
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    return sum(map(operator.eq, a, b)) / NUM_BINS
+
+
+def to_blob(sig):
+    return sig.tobytes()
+
+
+def from_blob(blob):
+    sig = array("I")
+    sig.frombytes(blob)
+    return sig
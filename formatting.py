@@ -0,0 +1,497 @@
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from html import escape, unescape
+
+# Telegram limits, counted in UTF-16 code units of the text without markup
+CAPTION_MAX_LENGTH = 1024
+MESSAGE_MAX_LENGTH = 4096
+
+# How a prepared post is sent: a photo with the first part as caption, or text
+# messages only. Remaining parts follow as text messages in both modes.
+MODE_PHOTO = "photo"
+MODE_TEXT = "text"
+
+PreparedPost = namedtuple("PreparedPost", "html byte_length mode parts warnings")
+
+# Where a part may end, best first: paragraph, line and word breaks
+BREAKS = (('\n\n',), ('\n',), (' ', '\t'))
+
+# Tags, comments, doctypes and entities in raw HTML; anything else is text
+MARKUP = re.compile(
+    r"""<(?P<slash>/?)(?P<tag>[a-zA-Z][\w:-]*)"""
+    r"""(?P<attrs>(?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?)*)\s*/?>"""
+    r"""|<!--.*?-->|<[!?][^>]*>"""
+    r"""|&(?P<entity>#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*)(?P<semicolon>;?)""",
+    re.DOTALL,
+)
+ATTRIBUTE = re.compile(r"""([^\s/>"'=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+# The start of a tag or an entity that may continue in the next chunk
+PARTIAL_TAG = re.compile(
+    r"""</?(?:[a-zA-Z][\w:-]*(?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"?|'[^']*'?|[^\s"'>]+))?)*"""
+    r"""\s*(?:=\s*|/)?)?$|<!--(?:[^-]|-(?!->))*$|<[!?][^>]*$""",
+    re.DOTALL,
+)
+PARTIAL_ENTITY = re.compile(r"&#?[a-zA-Z0-9]*$")
+# Held-back markup longer than this is treated as complete
+MAX_PARTIAL = 4096
+NEWLINE_RUN = re.compile(r"\n{3,}")
+LANGUAGE = re.compile(r"[\w+#.-]+")
+
+SIMPLE_TAGS = frozenset({
+    'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'pre', 'tg-spoiler',
+})
+FORMATTING_TAGS = SIMPLE_TAGS | {'code', 'a', 'span', 'blockquote'}
+PREFORMATTED_TAGS = frozenset({'code', 'pre'})
+# The only named entities Telegram understands, and the characters they stand for
+KEPT_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"'}
+LIST_TAGS = frozenset({'ul', 'ol'})
+
+
+class TelegramHTMLSanitizer:
+    """Single-pass HTML sanitizer producing the markup Telegram accepts
+
+    Input can be fed in chunks; markup is written out as soon as it is
+    parsed, except for a tag or entity cut in half at the end of a chunk.
+    Closing a tag that is not the innermost one closes and reopens the tags
+    nested in it, so interleaved markup keeps its text. The text runs and
+    tags written are recorded, so split() can cut the result into parts
+    without parsing it again. An instance can be reused after
+    get_sanitized_text() or reset().
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.result = []
+        # Open tags as (name, opening markup, closing markup), innermost last
+        self.tag_stack = []
+        self.pending = ''  # whitespace held back until something follows it
+        # Text since the last markup, escaped for output and as displayed;
+        # written out in one piece when the next markup comes
+        self.escaped = []
+        self.decoded = []
+        self.rawdata = ''  # an incomplete tag or entity from the previous chunk
+        # Tags that had to be dropped or closed, for warning the admin
+        self.dropped_tags = set()
+        self.unclosed_tags = set()
+        # Where the output stands, for split(): offsets into it and into the
+        # visible text, every text run written and every tag opened or closed
+        self.offset = 0
+        self.visible = 0
+        # (offset, visible offset, visible end, run, whether each character is one unit)
+        self.text_runs = []
+        # (offset, opening markup, closing markup); both None for a close
+        self.tag_events = []
+
+    def feed(self, data):
+        self._parse(self.rawdata + data, final=False)
+
+    def close(self):
+        self._parse(self.rawdata, final=True)
+
+    def sanitize(self, text):
+        """Sanitize a whole document, reusing this instance"""
+        self.reset()
+        self._parse(text, final=True)
+        return self.get_sanitized_text()
+
+    def _parse(self, data, final):
+        end = len(data)
+        if not final:
+            end = _incomplete_markup(data)
+        self.rawdata = data[end:]
+
+        pos = 0
+        for match in MARKUP.finditer(data, 0, end):
+            start = match.start()
+            if start > pos:
+                self.handle_data(data[pos:start])
+            pos = match.end()
+            slash, tag, attrs, entity, semicolon = match.groups()
+            if entity:
+                self.handle_entity(entity, semicolon)
+            elif slash:
+                self.handle_endtag(tag.lower())
+            elif tag:
+                self.handle_starttag(tag.lower(), attrs)
+            # Comments, doctypes and processing instructions are dropped
+        if end > pos:
+            self.handle_data(data[pos:end])
+
+    def handle_starttag(self, tag, attrs):
+        inside = self.tag_stack[-1][0] if self.tag_stack else None
+        if tag in LIST_TAGS:
+            # Start of list - add newline
+            self._text('\n')
+        elif tag == 'li':
+            # List item - add bullet point
+            self._text('• ')
+        elif tag == 'br':
+            self._text('\n')
+        elif inside in PREFORMATTED_TAGS and not (tag == 'code' and inside == 'pre'):
+            # Telegram allows no formatting inside code, except a language for pre
+            self.dropped_tags.add(tag)
+        elif tag in SIMPLE_TAGS:
+            self._open(tag, f'<{tag}>')
+        elif tag == 'code':
+            language = _attributes(attrs).get('class', '') if inside == 'pre' else ''
+            if language.startswith('language-') and LANGUAGE.fullmatch(language[9:]):
+                self._open(tag, f'<code class="{language}">')
+            else:
+                self._open(tag, '<code>')
+        elif tag == 'a':
+            href = _attributes(attrs).get('href', '').strip()
+            if href and not any(entry[0] == 'a' for entry in self.tag_stack):
+                self._open(tag, f'<a href="{escape(href)}">')
+            else:
+                self.dropped_tags.add(tag)
+        elif tag == 'span' and _attributes(attrs).get('class') == 'tg-spoiler':
+            self._open(tag, '<tg-spoiler>')
+        elif tag == 'blockquote':
+            if 'expandable' in _attributes(attrs):
+                self._open(tag, '<blockquote expandable>')
+            else:
+                self._open(tag, '<blockquote>')
+        else:
+            self.dropped_tags.add(tag)
+
+    def handle_endtag(self, tag):
+        if tag == 'li':
+            # End of list item - add newline
+            self._text('\n')
+            return
+        if tag in LIST_TAGS:
+            # End of list - add extra newline
+            self._text('\n')
+            return
+        stack = self.tag_stack
+        if stack and stack[-1][0] == tag:
+            self._close()
+            return
+        for index in range(len(stack) - 2, -1, -1):
+            if stack[index][0] == tag:
+                break
+        else:
+            # A closing tag with nothing to close would break Telegram's parser
+            self.dropped_tags.add(f'/{tag}' if tag in FORMATTING_TAGS else tag)
+            return
+        # Close everything nested in the tag, then reopen it after
+        nested = stack[index + 1:]
+        for _ in range(len(stack) - index):
+            self._close()
+        for name, markup, _ in nested:
+            self._open(name, markup)
+
+    def handle_data(self, data):
+        self.decoded.append(data)
+        # Bare <, > and & would make Telegram reject the whole message
+        self.escaped.append(data.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'))
+
+    def handle_entity(self, name, semicolon):
+        # Telegram only understands these named entities; decode the rest
+        char = KEPT_ENTITIES.get(name)
+        if char:
+            self.decoded.append(char)
+            self.escaped.append(f'&{name};')
+            return
+        # Not an entity at all, e.g. "AT&T", comes back unchanged
+        self.handle_data(unescape(f'&{name}{semicolon}'))
+
+    def _open(self, name, markup):
+        closing = _closing_tag(name)
+        self.tag_stack.append((name, markup, closing))
+        self._markup(markup, markup, closing)
+
+    def _close(self):
+        self._markup(self.tag_stack.pop()[2])
+
+    def _markup(self, markup, opening=None, closing=None):
+        if self.escaped:
+            self._flush()
+        if self.pending and self.result:
+            pending = _collapse_newlines(self.pending)
+            self._write(pending, len(pending))
+        # Whitespace before the first output is dropped
+        self.pending = ''
+        self.tag_events.append((self.offset, opening, closing))
+        self.result.append(markup)
+        self.offset += len(markup)
+
+    def _write(self, text, length):
+        # `length` is the visible length; written text holds no entities
+        # but &lt; &gt; &amp; and &quot;
+        self.text_runs.append(
+            (self.offset, self.visible, self.visible + length, text,
+             length == len(text) and '&' not in text)
+        )
+        self.result.append(text)
+        self.offset += len(text)
+        self.visible += length
+
+    def _text(self, text):
+        # Buffered like handle_data; list bullets and line breaks have no entities
+        self.decoded.append(text)
+        self.escaped.append(text)
+
+    def _flush(self):
+        text = ''.join(self.escaped)
+        length = text_length(''.join(self.decoded))
+        self.escaped = []
+        self.decoded = []
+        # Whitespace is the same escaped or not and one UTF-16 unit per
+        # character, so trimming it takes as many units off as characters
+        if self.pending:
+            text = self.pending + text
+            length += len(self.pending)
+        core = text.rstrip()
+        self.pending = text[len(core):]
+        if not self.result:
+            core = core.lstrip()
+        length -= len(text) - len(core)
+        if core:
+            collapsed = _collapse_newlines(core)
+            self._write(collapsed, length - (len(core) - len(collapsed)))
+
+    def get_sanitized_text(self):
+        if self.escaped:
+            self._flush()
+        # Close any unclosed tags
+        while self.tag_stack:
+            self.unclosed_tags.add(self.tag_stack[-1][0])
+            self._close()
+        # Trailing whitespace is never written out
+        self.pending = ''
+        return ''.join(self.result)
+
+    def split(self, first_limit, limit=MESSAGE_MAX_LENGTH):
+        """Split the sanitized text into parts that each fit a Telegram limit
+
+        Call after get_sanitized_text(). The first part gets `first_limit`
+        (a caption or a message), the rest `limit`, which must not be
+        smaller. A part ends on the last paragraph, line or word break that
+        keeps it at least half full; tags open at the cut are closed there
+        and reopened in the next part. Cuts are found from the text runs and
+        tags recorded while sanitizing, so the markup is not parsed again.
+        """
+        html = ''.join(self.result)
+        runs = self.text_runs
+        total = self.visible
+        if total <= first_limit:
+            return [html]
+        starts = [run[0] for run in runs]
+        ends = [run[2] for run in runs]
+
+        def visible_at(pos):
+            index = bisect_right(starts, pos) - 1
+            if index < 0:
+                return 0
+            start, visible, end, text, simple = runs[index]
+            if pos - start >= len(text):
+                return end
+            if simple:
+                return visible + pos - start
+            head = text[:pos - start]
+            return visible + text_length(unescape(head) if '&' in head else head)
+
+        def in_text(pos):
+            index = bisect_right(starts, pos) - 1
+            return index >= 0 and pos < starts[index] + len(runs[index][3])
+
+        def offset_of(units):
+            # The furthest point in the text with at most `units` before it
+            start, visible, _, text, simple = runs[bisect_left(ends, units)]
+            if simple:
+                return start + units - visible
+            return start + _text_offset(text, units - visible)
+
+        def last_break(separators, start, end):
+            best = -1
+            for separator in separators:
+                found = html.rfind(separator, start, end)
+                while found >= 0 and not in_text(found):
+                    # Inside a tag, e.g. a space in an href: look before it
+                    found = html.rfind(separator, start, html.rfind('<', start, found))
+                if found >= 0:
+                    best = max(best, found + len(separator))
+            return best
+
+        def skip_space(pos):
+            # Whitespace before the first visible character of a part is
+            # dropped, tags in between are kept; returns them and where the text starts
+            tags = []
+            while pos < len(html):
+                if html[pos] == '<':
+                    end = html.index('>', pos) + 1
+                    tags.append(html[pos:end])
+                    pos = end
+                elif html[pos].isspace():
+                    pos += 1
+                else:
+                    break
+            return ''.join(tags), pos
+
+        parts = []
+        events = self.tag_events
+        event = 0
+        stack = []  # (opening, closing) markup of the tags open at the cut
+        opened = ''  # markup the current part starts with
+        lead, pos = skip_space(0)
+        visible = visible_at(pos)
+        budget = first_limit
+        while total - visible > budget:
+            end = offset_of(visible + budget)
+            latest = -1
+            for separators in BREAKS:
+                cut = last_break(separators, pos, end)
+                if cut >= 0 and visible_at(cut) - visible >= budget // 2:
+                    break
+                latest = max(latest, cut)
+            else:
+                # No break keeps the part half full: take the last one, or
+                # cut a word longer than a whole part where it stops fitting
+                cut = latest if latest >= 0 else end
+            while event < len(events) and events[event][0] < cut:
+                _, opening, closing = events[event]
+                if opening:
+                    stack.append((opening, closing))
+                elif stack:
+                    stack.pop()
+                event += 1
+
+            head = html[pos:cut].rstrip()
+            if visible_at(pos + len(head)) > visible:
+                parts.append(
+                    opened + lead + head + ''.join(closing for _, closing in reversed(stack))
+                )
+            opened = ''.join(opening for opening, _ in stack)
+            lead, pos = skip_space(cut)
+            visible = visible_at(pos)
+            budget = limit
+
+        if total > visible:
+            parts.append(opened + lead + html[pos:])
+        return parts
+
+
+def _incomplete_markup(data):
+    """Where markup that may continue in the next chunk starts, or len(data)"""
+    window = max(0, len(data) - MAX_PARTIAL)
+    start = data.find('<', window)
+    while start >= 0:
+        if PARTIAL_TAG.match(data, start):
+            return start
+        start = data.find('<', start + 1)
+    partial = PARTIAL_ENTITY.search(data, max(window, len(data) - 32))
+    return partial.start() if partial else len(data)
+
+
+def _closing_tag(name):
+    return f'</{name}>' if name != 'span' else '</tg-spoiler>'
+
+
+def _attributes(attrs):
+    result = {}
+    for name, value in ATTRIBUTE.findall(attrs or ''):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        result[name.lower()] = unescape(value)
+    return result
+
+
+def _collapse_newlines(text):
+    # Runs of blank lines become a single empty line
+    return NEWLINE_RUN.sub('\n\n', text) if '\n\n\n' in text else text
+
+
+def sanitize_html_for_telegram(text):
+    """Sanitize HTML content for Telegram posting"""
+    return TelegramHTMLSanitizer().sanitize(text)
+
+
+def text_length(text):
+    """Length as Telegram counts it: UTF-16 code units"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def visible_length(html):
+    """Length of the text Telegram displays, i.e. without tags and with entities decoded"""
+    return text_length(unescape(re.sub(r'<[^>]+>', '', html)))
+
+
+def _text_offset(text, units):
+    """Index into sanitized text after its first `units` UTF-16 code units
+
+    Never inside an entity or a surrogate pair, so it may fall short by one.
+    """
+    pos = 0
+    while pos < len(text):
+        if text[pos] == '&':
+            after, size = text.index(';', pos) + 1, 1
+        else:
+            after, size = pos + 1, 2 if ord(text[pos]) > 0xFFFF else 1
+        if size > units:
+            break
+        units -= size
+        pos = after
+    return pos
+
+
+def split_post(html, first_limit, limit=MESSAGE_MAX_LENGTH):
+    """Split HTML into parts that each fit a Telegram limit
+
+    Runs `html` through the sanitizer to find where it may be cut; see
+    TelegramHTMLSanitizer.split().
+    """
+    parser = TelegramHTMLSanitizer()
+    parser.sanitize(html)
+    return parser.split(first_limit, limit)
+
+
+def prepare_post(text, has_image):
+    """Sanitize an article once and decide how it will be sent
+
+    Warnings are in Russian and meant for the admin who submits the article.
+    A text with nothing visible gets no parts and must not be enqueued.
+    """
+    warnings = []
+    parser = splitter = TelegramHTMLSanitizer()
+    try:
+        parser.feed(text)
+        parser.close()
+        html = parser.get_sanitized_text()
+    except Exception as e:
+        logging.error(f"Error sanitizing HTML: {e}")
+        html = escape(unescape(re.sub(r'<[^>]+>', '', text)), quote=False)
+        warnings.append("Не удалось разобрать HTML, форматирование удалено.")
+        # Plain escaped text goes through the sanitizer unchanged
+        splitter = TelegramHTMLSanitizer()
+        splitter.sanitize(html)
+    if parser.dropped_tags:
+        warnings.append(
+            "Удалены неподдерживаемые теги: " + ", ".join(sorted(parser.dropped_tags))
+        )
+    if parser.unclosed_tags:
+        warnings.append(
+            "Закрыты незакрытые теги: " + ", ".join(sorted(parser.unclosed_tags))
+        )
+
+    mode = MODE_PHOTO if has_image else MODE_TEXT
+    if not splitter.visible:
+        # Telegram rejects a message without text, so there are no parts to send
+        warnings.append("Текст публикации пуст: в нём нет ничего, кроме разметки.")
+        return PreparedPost(html, len(html.encode('utf-8')), mode, [], warnings)
+    parts = splitter.split(CAPTION_MAX_LENGTH if has_image else MESSAGE_MAX_LENGTH)
+    if len(parts) > 1:
+        if has_image:
+            warnings.append(
+                "Текст не помещается в подпись к изображению и будет продолжен "
+                f"в следующих сообщениях (всего частей: {len(parts)})."
+            )
+        else:
+            warnings.append(
+                f"Текст длиннее лимита Telegram и будет опубликован частями: {len(parts)}."
+            )
+    return PreparedPost(html, len(html.encode('utf-8')), mode, parts, warnings)
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database import (
+    delete_expired_fsm,
+    get_fsm_record,
+    set_fsm_data,
+    set_fsm_state,
+    update_fsm_data,
+)
+
+
+def storage_key(key):
+    """Flatten an aiogram StorageKey into a single text primary key"""
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the articles database, so drafts survive restarts
+
+    States and data untouched for longer than `ttl` read as empty and are
+    purged by `purge_expired`. All processes sharing the database file see
+    the same states.
+    """
+
+    def __init__(self, ttl=timedelta(hours=72)):
+        self.ttl = ttl
+
+    def _not_before(self):
+        return datetime.now() - self.ttl
+
+    async def set_state(self, key, state=None):
+        value = state.state if isinstance(state, State) else state
+        await set_fsm_state(storage_key(key), value)
+
+    async def get_state(self, key):
+        state, _ = await get_fsm_record(storage_key(key), self._not_before())
+        return state
+
+    async def set_data(self, key, data):
+        await set_fsm_data(storage_key(key), dict(data))
+
+    async def get_data(self, key):
+        _, data = await get_fsm_record(storage_key(key), self._not_before())
+        return data
+
+    async def update_data(self, key, data):
+        # Read and write in one transaction so concurrent updates don't drop keys
+        return await update_fsm_data(storage_key(key), dict(data), self._not_before())
+
+    async def purge_expired(self):
+        """Delete expired states; returns how many were removed"""
+        return await delete_expired_fsm(self._not_before())
+
+    async def close(self):
+        # The connection belongs to the repository and is closed with it
+        pass
+
+
+def create_storage(backend, ttl):
+    """Build the FSM storage named in config: "sqlite", "memory" or a redis:// URL"""
+    if backend == "memory":
+        return MemoryStorage()
+    if backend.startswith(("redis://", "rediss://")):
+        # Optional dependency, only needed when several hosts share the bot
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            backend, state_ttl=ttl, data_ttl=ttl
+        )
+    if backend == "sqlite":
+        return SQLiteStorage(ttl)
+    raise ValueError(f"Unknown FSM storage backend: {backend}")
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # re-encoding is optional
+    Image = None
+
+IMAGES_DIR = "images"
+# Telegram puts at most this many photos into one album
+ALBUM_MAX_SIZE = 10
+
+
+def cleanup_images(directory, max_age_days, max_total_bytes, keep=frozenset()):
+    """Evict old images and then the oldest ones until the directory fits the size cap
+
+    Paths in `keep` (images of queued articles) are never removed.
+    Returns the number of files deleted.
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.path not in keep:
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    kept_bytes = sum(os.path.getsize(path) for path in keep if os.path.isfile(path))
+
+    # Oldest first, so both policies evict the least recently written files
+    entries.sort()
+    expire_before = time.time() - max_age_days * 86400
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= expire_before and total_bytes + kept_bytes <= max_total_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Error removing image {path}: {e}")
+            continue
+        total_bytes -= size
+        removed += 1
+    return removed
+
+
+def shrink_image(data, max_side, quality):
+    """Re-encode JPEG bytes with the longer side at most max_side; runs in a worker process"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+    result = output.getvalue()
+    # Small photos can grow when re-encoded; keep whichever is smaller
+    return result if len(result) < len(data) else data
+
+
+def _store(path, data):
+    if os.path.exists(path):
+        # Refresh the age so cleanup treats the shared copy as recently used
+        os.utime(path)
+        return
+    # A unique temporary name, since two downloads of the same picture may race
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+class AlbumCollector:
+    """Groups the messages of a Telegram album, which arrive as separate updates
+
+    Every part calls collect(); the call for the part that arrived last
+    gets the whole album once no more parts came for `delay` seconds, the
+    other calls get None.
+    """
+
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        self._albums = {}
+
+    async def collect(self, album_id, item):
+        items = self._albums.setdefault(album_id, [])
+        items.append(item)
+        position = len(items)
+        await asyncio.sleep(self.delay)
+        if len(items) != position:
+            return None
+        del self._albums[album_id]
+        return items
+
+
+class ImagePipeline:
+    """Downloads local image copies in the background
+
+    Files are named by a hash of their content, so the same picture sent
+    twice is stored once. With max_side set and Pillow installed, images are
+    shrunk in a process pool before they are written.
+    """
+
+    def __init__(self, directory, download, concurrency=4, max_side=0, quality=85, workers=2):
+        # download(file_id) returns a file-like object with the image bytes
+        self.directory = directory
+        self.download = download
+        self.max_side = max_side
+        self.quality = quality
+        self.workers = workers
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pool = None
+        self._tasks = set()
+        if max_side and Image is None:
+            logging.warning("IMAGE_MAX_SIDE is set but Pillow is not installed; images are kept as sent")
+
+    def submit(self, file_ids, on_stored):
+        """Fetch all file_ids in parallel, then `await on_stored(paths)`; returns immediately
+
+        `paths` follows the order of file_ids, with None for images that
+        could not be fetched.
+        """
+        task = asyncio.create_task(self._ingest_all(file_ids, on_stored))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _ingest_all(self, file_ids, on_stored):
+        results = await asyncio.gather(
+            *(self.ingest(file_id) for file_id in file_ids), return_exceptions=True
+        )
+        paths = []
+        for file_id, result in zip(file_ids, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error downloading image {file_id}: {result!r}")
+                result = None
+            paths.append(result)
+        try:
+            await on_stored(paths)
+        except Exception as e:
+            logging.error(f"Error saving image paths: {e}")
+
+    async def ingest(self, file_id):
+        """Download one image and return the path of its local copy"""
+        async with self._semaphore:
+            data = (await self.download(file_id)).read()
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest()[:32])
+        path = os.path.join(self.directory, f"{digest}.jpg")
+        if not os.path.exists(path) and self.max_side and Image is not None:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._pool, shrink_image, data, self.max_side, self.quality)
+        os.makedirs(self.directory, exist_ok=True)
+        await asyncio.to_thread(_store, path, data)
+        return path
+
+    async def close(self):
+        """Wait for downloads in flight and stop the worker processes"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,484 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+import httpx
+from openai import AsyncOpenAI
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from config import (
+    API_KEY,
+    CHUNK_SUMMARY_PROMPT,
+    LLM_BASE_URL,
+    LLM_COMPLETION_PRICE,
+    LLM_CONTEXT_TOKENS,
+    LLM_FALLBACKS,
+    LLM_HEDGE_DELAY,
+    LLM_INPUT_TOKENS,
+    LLM_MAX_CONCURRENCY,
+    LLM_PROMPT_PRICE,
+    LLM_TIMEOUT,
+    MODEL,
+    REWRITE_CACHE_MAX_ENTRIES,
+    REWRITE_CACHE_TTL_DAYS,
+    REWRITE_MAX_TOKENS,
+    REWRITE_TARGET_LENGTH,
+    TEXT_PROCESSING_PROMPT,
+)
+from database import evict_rewrite_cache, get_cached_rewrite, put_cached_rewrite
+from llm_router import LLMRouter, Route
+from metrics import (
+    llm_cache_requests,
+    llm_cost,
+    llm_request_seconds,
+    llm_rewrite_tokens,
+    llm_tokens,
+)
+
+# Paragraphs, lines, sentences and words: where long texts are split, coarsest first
+SPLITTERS = (
+    (re.compile(r"\n\s*\n"), "\n\n"),
+    (re.compile(r"\n"), "\n"),
+    (re.compile(r"(?<=[.!?…])\s+"), " "),
+    (re.compile(r"\s+"), " "),
+)
+# Tokens left for message framing and the error of estimated counts
+TOKEN_MARGIN = 100
+# Summaries of summaries, for texts many times the input budget
+MAX_CONDENSE_ROUNDS = 3
+
+
+def normalize_text(text):
+    """Canonical form of the source text used for cache keys"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"Tokenizer unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text):
+    """Tokens in `text`: exact for current OpenAI models with tiktoken installed, otherwise an overestimate"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Four bytes per token holds for English and overestimates Cyrillic
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def split_by_tokens(text, max_tokens, level=0):
+    """Split `text` into chunks of at most `max_tokens`, at the coarsest breaks that allow it"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+    if level == len(SPLITTERS):
+        # A single "word" over the budget, such as a huge link: cut it by characters
+        step = max(1, len(text) * max_tokens // tokens)
+        return [text[start:start + step] for start in range(0, len(text), step)]
+
+    pattern, separator = SPLITTERS[level]
+    separator_tokens = count_tokens(separator)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for part in pattern.split(text):
+        if not part.strip():
+            continue
+        part_tokens = count_tokens(part)
+        if current and current_tokens + separator_tokens + part_tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current = []
+            current_tokens = 0
+        if part_tokens > max_tokens:
+            chunks.extend(split_by_tokens(part, max_tokens, level + 1))
+            continue
+        current_tokens += part_tokens + (separator_tokens if current else 0)
+        current.append(part)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def rewrite_cache_key(model, prompt, text):
+    digest = hashlib.sha256()
+    for part in (model, prompt, normalize_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TokenUsage:
+    """Tokens spent on one rewrite, over all of its requests"""
+
+    def __init__(self):
+        self.prompt = 0
+        self.completion = 0
+        self.requests = 0
+
+    @property
+    def total(self):
+        return self.prompt + self.completion
+
+
+class OpenStream:
+    """A streamed completion read up to some point, and the concurrency slot it holds"""
+
+    def __init__(self, route, stream, started, deadline, spent):
+        self.route = route
+        self.stream = stream
+        self.chunks = stream.__aiter__()
+        self.started = started
+        self.deadline = deadline
+        self.spent = spent
+        self.text = ""
+
+
+class RewriteService:
+    """Long-lived async LLM clients shared by all handlers
+
+    Requests go to `model` at `base_url` and to the `fallbacks` (model names
+    or {"model", "base_url", "api_key"} objects) through an LLMRouter.
+    Source texts over the input budget are first summarized in chunks with
+    `chunk_prompt`, concurrently, and the rewrite is made from the summaries.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url,
+        model,
+        prompt,
+        max_concurrency=10,
+        timeout=120.0,
+        cache_max_entries=5000,
+        cache_ttl_days=30,
+        prompt_price=0.0,
+        completion_price=0.0,
+        fallbacks=(),
+        hedge_delay=15.0,
+        context_tokens=32000,
+        input_tokens=8000,
+        max_output_tokens=2000,
+        target_length=0,
+        chunk_prompt=CHUNK_SUMMARY_PROMPT,
+    ):
+        self.model = model
+        if target_length:
+            prompt = f"{prompt}\nДлина публикации — не более {target_length} символов.\n"
+        self.prompt = prompt
+        self.chunk_prompt = chunk_prompt
+        self.context_tokens = context_tokens
+        self.input_tokens = input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.timeout = timeout
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._clients = {}
+        self.routes = [Route(model, base_url, api_key)]
+        for fallback in fallbacks:
+            if isinstance(fallback, str):
+                fallback = {"model": fallback}
+            self.routes.append(Route(
+                fallback["model"],
+                fallback.get("base_url", base_url),
+                fallback.get("api_key", api_key),
+            ))
+        self.router = LLMRouter(self.routes, hedge_delay=hedge_delay)
+        self.cache_max_entries = cache_max_entries
+        self.cache_ttl = timedelta(days=cache_ttl_days)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # USD per million tokens, used when the provider doesn't report the cost
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+
+    def _get_client(self, route):
+        # Created on first use so the pooled HTTP client binds to the running loop
+        key = (route.base_url, route.api_key)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                timeout=self.timeout,
+            )
+            client = self._clients[key] = AsyncOpenAI(
+                base_url=route.base_url,
+                api_key=route.api_key,
+                timeout=self.timeout,
+                http_client=http_client,
+            )
+        return client
+
+    async def rewrite(self, text, force=False):
+        """Rewrite the original text into a channel post
+
+        Identical inputs are served from the rewrite cache unless `force` is set.
+        """
+        key = rewrite_cache_key(self.model, self.prompt, text)
+        if not force:
+            cached = await get_cached_rewrite(key, datetime.now() - self.cache_ttl)
+            if cached is not None:
+                self.cache_hits += 1
+                llm_cache_requests.inc(result="hit")
+                logging.info(f"Rewrite cache hit ({self.cache_hits} hits, {self.cache_misses} misses)")
+                return cached
+        self.cache_misses += 1
+        llm_cache_requests.inc(result="miss")
+
+        spent = TokenUsage()
+        source = await self._condense(text, spent)
+        processed_text = await self._complete(self.prompt, source, spent, self.max_output_tokens)
+        self._report_usage(spent, source is not text)
+        await put_cached_rewrite(key, processed_text)
+        return processed_text
+
+    async def stream_rewrite(self, text, force=False):
+        """Yield the rewrite as it grows; the last value is the complete text
+
+        Closing the generator early aborts the completion and nothing is cached.
+        """
+        key = rewrite_cache_key(self.model, self.prompt, text)
+        if not force:
+            cached = await get_cached_rewrite(key, datetime.now() - self.cache_ttl)
+            if cached is not None:
+                self.cache_hits += 1
+                llm_cache_requests.inc(result="hit")
+                yield cached
+                return
+        self.cache_misses += 1
+        llm_cache_requests.inc(result="miss")
+
+        spent = TokenUsage()
+        source = await self._condense(text, spent)
+        route, opened = await self.router.run(
+            "stream",
+            lambda route: self._open_stream(route, source, spent),
+            discard=lambda opened: self._close_stream(opened, "cancelled"),
+        )
+        outcome = "error"
+        try:
+            if opened.text:
+                yield opened.text
+            while await self._next_text(opened):
+                yield opened.text
+            outcome = "ok"
+        except GeneratorExit:
+            # The caller stopped the rewrite
+            outcome = "aborted"
+            raise
+        except Exception:
+            self.router.record_failure(route)
+            raise
+        finally:
+            await self._close_stream(opened, outcome)
+            self._report_usage(spent, source is not text)
+
+        if opened.text:
+            await put_cached_rewrite(key, opened.text)
+
+    async def evict_cache(self):
+        return await evict_rewrite_cache(
+            self.cache_max_entries, datetime.now() - self.cache_ttl
+        )
+
+    def _messages(self, prompt, text):
+        return [
+            {"role": "user", "content": prompt},
+            {"role": "user", "content": text},
+        ]
+
+    def _input_budget(self):
+        """Most source tokens one request may carry next to the prompt and the completion"""
+        window = (
+            self.context_tokens - self.max_output_tokens - count_tokens(self.prompt) - TOKEN_MARGIN
+        )
+        return max(TOKEN_MARGIN, min(self.input_tokens, window))
+
+    async def _condense(self, text, spent):
+        """Summarize `text` chunk by chunk until it fits the input budget; short texts pass as is"""
+        budget = self._input_budget()
+        for _ in range(MAX_CONDENSE_ROUNDS):
+            tokens = count_tokens(text)
+            if tokens <= budget:
+                break
+            chunks = split_by_tokens(text, budget)
+            # Together the summaries should fit the budget of the final rewrite
+            summary_tokens = max(TOKEN_MARGIN, budget // len(chunks))
+            summaries = await asyncio.gather(*(
+                self._complete(
+                    self.chunk_prompt.format(
+                        index=index, total=len(chunks), words=summary_tokens // 3
+                    ),
+                    chunk,
+                    spent,
+                    summary_tokens,
+                )
+                for index, chunk in enumerate(chunks, 1)
+            ))
+            text = "\n\n".join(summaries)
+            logging.info(
+                f"Condensed a {tokens}-token source in {len(chunks)} chunks to {count_tokens(text)} tokens"
+            )
+        return text
+
+    def _report_usage(self, spent, chunked):
+        llm_rewrite_tokens.observe(spent.total, chunked="yes" if chunked else "no")
+        logging.info(
+            f"Rewrite used {spent.total} tokens ({spent.prompt} prompt, {spent.completion} completion) "
+            f"in {spent.requests} requests"
+        )
+
+    async def _open_stream(self, route, text, spent):
+        """Start a streamed completion on `route` and read it up to the first content"""
+        loop = asyncio.get_running_loop()
+        await self._semaphore.acquire()
+        started = time.perf_counter()
+        opened = None
+        try:
+            stream = await asyncio.wait_for(
+                self._get_client(route).chat.completions.create(
+                    model=route.model,
+                    messages=self._messages(self.prompt, text),
+                    max_tokens=self.max_output_tokens,
+                    stream=True,
+                    # The last chunk then carries the token usage
+                    stream_options={"include_usage": True},
+                ),
+                timeout=self.timeout,
+            )
+            opened = OpenStream(route, stream, started, loop.time() + self.timeout, spent)
+            await self._next_text(opened)
+            return opened
+        except (Exception, asyncio.CancelledError) as e:
+            outcome = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            if opened is not None:
+                await self._close_stream(opened, outcome)
+            else:
+                self._semaphore.release()
+                llm_request_seconds.observe(
+                    time.perf_counter() - started, model=route.model, mode="stream", outcome=outcome
+                )
+            raise
+
+    async def _next_text(self, opened):
+        """Read chunks until more content arrives; False once the stream has ended"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(
+                    anext(opened.chunks), timeout=max(0, opened.deadline - loop.time())
+                )
+            except StopAsyncIteration:
+                return False
+            if chunk.usage:
+                self._record_usage(opened.route.model, chunk.usage, opened.spent)
+            if chunk.choices and chunk.choices[0].delta.content:
+                opened.text += chunk.choices[0].delta.content
+                return True
+
+    async def _close_stream(self, opened, outcome):
+        try:
+            await opened.stream.close()
+        finally:
+            self._semaphore.release()
+            llm_request_seconds.observe(
+                time.perf_counter() - opened.started,
+                model=opened.route.model, mode="stream", outcome=outcome,
+            )
+
+    async def _complete(self, prompt, text, spent, max_tokens):
+        _, content = await self.router.run(
+            "complete", lambda route: self._complete_on(route, prompt, text, spent, max_tokens)
+        )
+        return content
+
+    async def _complete_on(self, route, prompt, text, spent, max_tokens):
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                completion = await asyncio.wait_for(
+                    self._get_client(route).chat.completions.create(
+                        model=route.model,
+                        messages=self._messages(prompt, text),
+                        max_tokens=max_tokens,
+                    ),
+                    timeout=self.timeout,
+                )
+                outcome = "ok"
+            except asyncio.CancelledError:
+                # A hedged request answered first
+                outcome = "cancelled"
+                raise
+            finally:
+                llm_request_seconds.observe(
+                    time.perf_counter() - started, model=route.model, mode="complete", outcome=outcome
+                )
+        if completion.usage:
+            self._record_usage(route.model, completion.usage, spent)
+        return completion.choices[0].message.content
+
+    def _record_usage(self, model, usage, spent):
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        spent.prompt += prompt_tokens
+        spent.completion += completion_tokens
+        spent.requests += 1
+        llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+        llm_tokens.inc(completion_tokens, model=model, type="completion")
+        # OpenRouter reports the charged cost; otherwise estimate it from the price list
+        cost = getattr(usage, "cost", None)
+        if cost is None:
+            cost = (
+                prompt_tokens * self.prompt_price + completion_tokens * self.completion_price
+            ) / 1_000_000
+        llm_cost.inc(cost, model=model)
+
+    async def close(self):
+        if self._clients:
+            for client in self._clients.values():
+                await client.close()
+            self._clients = {}
+            logging.info("Rewrite service closed")
+
+
+rewrite_service = RewriteService(
+    api_key=API_KEY,
+    base_url=LLM_BASE_URL,
+    model=MODEL,
+    prompt=TEXT_PROCESSING_PROMPT,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    timeout=LLM_TIMEOUT,
+    cache_max_entries=REWRITE_CACHE_MAX_ENTRIES,
+    cache_ttl_days=REWRITE_CACHE_TTL_DAYS,
+    prompt_price=LLM_PROMPT_PRICE,
+    completion_price=LLM_COMPLETION_PRICE,
+    fallbacks=LLM_FALLBACKS,
+    hedge_delay=LLM_HEDGE_DELAY,
+    context_tokens=LLM_CONTEXT_TOKENS,
+    input_tokens=LLM_INPUT_TOKENS,
+    max_output_tokens=REWRITE_MAX_TOKENS,
+    target_length=REWRITE_TARGET_LENGTH,
+)
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import llm_hedged_requests
+
+
+class RouteStats:
+    """Rolling latencies of one route for one kind of request"""
+
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+
+    def percentile(self, fraction):
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Route:
+    """A model at an OpenAI-compatible endpoint"""
+
+    def __init__(self, model, base_url, api_key, window=100):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        # "complete": whole completions, "stream": time to the first token
+        self.stats = {"complete": RouteStats(window), "stream": RouteStats(window)}
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def __repr__(self):
+        return f"Route({self.model!r}, {self.base_url!r})"
+
+
+class LLMRouter:
+    """Runs a request on the fastest healthy route, hedging and falling back to the others
+
+    Routes are ranked by health, then by median latency once they have
+    `min_samples` measurements, then by their configured order. The first
+    one is tried; if it has not answered after its p95 latency (or
+    `hedge_delay` until that is known), the next route is started alongside
+    it and whichever answers first wins, the other one is cancelled. A
+    failed attempt starts the next route at once. Routes that fail
+    `max_failures` times in a row are tried last for `cooldown` seconds.
+    """
+
+    def __init__(
+        self,
+        routes,
+        hedge_delay=15.0,
+        hedge_percentile=0.95,
+        min_hedge_delay=1.0,
+        min_samples=10,
+        max_failures=3,
+        cooldown=60.0,
+        clock=time.monotonic,
+    ):
+        self.routes = list(routes)
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.clock = clock
+
+    def ranked(self, mode):
+        now = self.clock()
+
+        def key(item):
+            index, route = item
+            stats = route.stats[mode]
+            measured = len(stats.latencies) >= self.min_samples
+            return (
+                route.unhealthy_until > now,
+                not measured,
+                stats.percentile(0.5) if measured else 0,
+                index,
+            )
+
+        return [route for _, route in sorted(enumerate(self.routes), key=key)]
+
+    def hedge_after(self, route, mode):
+        """Seconds to wait for `route` before starting a hedged request; None never hedges"""
+        if not self.hedge_delay:
+            return None
+        stats = route.stats[mode]
+        if len(stats.latencies) < self.min_samples:
+            return self.hedge_delay
+        return max(self.min_hedge_delay, stats.percentile(self.hedge_percentile))
+
+    def record_success(self, route, mode, latency):
+        route.stats[mode].latencies.append(latency)
+        route.consecutive_failures = 0
+        route.unhealthy_until = 0.0
+
+    def record_failure(self, route):
+        route.consecutive_failures += 1
+        if route.consecutive_failures >= self.max_failures:
+            route.unhealthy_until = self.clock() + self.cooldown
+            logging.warning(
+                f"LLM route {route.model} failed {route.consecutive_failures} times in a row, "
+                f"deprioritised for {self.cooldown:.0f} s"
+            )
+
+    async def _attempt(self, route, mode, start):
+        started = self.clock()
+        try:
+            result = await start(route)
+        except Exception:
+            self.record_failure(route)
+            raise
+        # Only completed attempts are timed. A cancelled one (it lost the race)
+        # ran for a lower bound of its latency; mixed in with real latencies it
+        # would pull the percentiles, and with them the hedge delay, down
+        self.record_success(route, mode, self.clock() - started)
+        return result
+
+    async def run(self, mode, start, discard=None):
+        """Return (route, result) of the first route whose `await start(route)` succeeds
+
+        `await discard(result)` releases results of attempts that succeeded
+        too late, such as a second opened stream. Raises the last error
+        when every route failed.
+        """
+        queue = self.ranked(mode)
+        primary = queue[0]
+        pending = {}
+        launched_at = {}
+        last_error = None
+        hedged = False
+        winner = None
+        losers = []
+
+        def launch():
+            route = queue.pop(0)
+            task = asyncio.create_task(self._attempt(route, mode, start))
+            pending[task] = route
+            launched_at[task] = self.clock()
+
+        launch()
+        try:
+            while pending and winner is None:
+                timeout = None
+                if queue and len(pending) == 1:
+                    (task, route), = pending.items()
+                    delay = self.hedge_after(route, mode)
+                    if delay is not None:
+                        timeout = max(0.0, launched_at[task] + delay - self.clock())
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logging.info(f"LLM route {route.model} is slow, hedging with {queue[0].model}")
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    route = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        logging.warning(f"LLM route {route.model} failed: {e!r}")
+                        continue
+                    if winner is None:
+                        winner = route, result
+                    else:
+                        losers.append(result)
+                # Failed attempts are replaced right away, keeping a hedge running if there was one
+                while winner is None and queue and len(pending) < (2 if hedged else 1):
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            # An attempt may finish between the last wait and its cancellation
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if not isinstance(result, BaseException):
+                    losers.append(result)
+            if discard is not None:
+                for result in losers:
+                    await discard(result)
+
+        if winner is None:
+            raise last_error
+        if hedged:
+            llm_hedged_requests.inc(winner="primary" if winner[0] is primary else "hedge")
+        return winner
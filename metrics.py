@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Seconds; wide enough for both SQLite queries and LLM completions
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values
+
+    Samples may be updated from any thread; rendering takes the same lock.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(key, value) for key, value in items)
+        return "\n".join(lines)
+
+    def _samples(self, key, value):
+        return f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then the sum of observed values
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return "\n".join(lines)
+
+
+class Registry:
+    """Metrics of the process plus callbacks that refresh gauges on each scrape"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """Run `await collect()` before every scrape, e.g. to read queue sizes"""
+        self._collectors.append(collect)
+
+    async def render(self):
+        for collect in self._collectors:
+            try:
+                await collect()
+            except Exception as e:
+                logging.error(f"Metrics collector {collect.__name__} failed: {e}")
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+queue_depth = registry.register(Gauge(
+    "shipai_queue_depth", "Articles and deliveries by status", ["table", "status"]
+))
+scheduler_tick_seconds = registry.register(Histogram(
+    "shipai_scheduler_tick_seconds", "Time the post scheduler spends per wakeup",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+))
+scheduler_lateness_seconds = registry.register(Histogram(
+    "shipai_scheduler_lateness_seconds", "How late deliveries are handed to the poster"
+))
+post_seconds = registry.register(Histogram(
+    "shipai_post_seconds", "Time to publish an article to a channel, retries included", ["channel"]
+))
+post_failures = registry.register(Counter(
+    "shipai_post_failures_total", "Articles that could not be published to a channel", ["channel"]
+))
+telegram_send_seconds = registry.register(Histogram(
+    "shipai_telegram_send_seconds", "Latency of single Telegram send attempts", ["chat", "outcome"]
+))
+llm_request_seconds = registry.register(Histogram(
+    "shipai_llm_request_seconds", "Latency of LLM completions", ["model", "mode", "outcome"]
+))
+llm_tokens = registry.register(Counter(
+    "shipai_llm_tokens_total", "Tokens used by LLM completions", ["model", "type"]
+))
+llm_cost = registry.register(Counter(
+    "shipai_llm_cost_usd_total", "Estimated cost of LLM completions in USD", ["model"]
+))
+llm_rewrite_tokens = registry.register(Histogram(
+    "shipai_llm_rewrite_tokens", "Tokens spent on one rewrite, chunk summaries included",
+    ["chunked"], buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+))
+llm_hedged_requests = registry.register(Counter(
+    "shipai_llm_hedged_requests_total", "LLM requests that were hedged, by which attempt answered first",
+    ["winner"],
+))
+llm_cache_requests = registry.register(Counter(
+    "shipai_llm_cache_requests_total", "Rewrite cache lookups", ["result"]
+))
+db_query_seconds = registry.register(Histogram(
+    "shipai_db_query_seconds", "Time spent running repository methods on the SQLite thread", ["method"]
+))
+backups = registry.register(Counter(
+    "shipai_backups_total", "Database snapshots by result", ["result"]
+))
+backup_seconds = registry.register(Histogram(
+    "shipai_backup_seconds", "Time to copy and verify a database snapshot",
+    buckets=(1, 5, 15, 60, 300, 900, 1800, 3600),
+))
+backup_last_success = registry.register(Gauge(
+    "shipai_backup_last_success_timestamp_seconds", "Unix time of the last verified snapshot"
+))
+event_loop_lag_seconds = registry.register(Histogram(
+    "shipai_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task"
+))
+
+
+async def monitor_event_loop(interval=1.0):
+    """Measure how late a periodic sleep wakes up; runs until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
+
+
+async def handle_metrics(request):
+    return web.Response(
+        body=(await registry.render()).encode("utf-8"),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+class MetricsServer:
+    """Serves the registry in Prometheus text format on /metrics"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._runner = None
+        self._lag_task = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._lag_task = asyncio.create_task(monitor_event_loop())
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+
+from metrics import scheduler_lateness_seconds, scheduler_tick_seconds
+
+# Upper bound for a single sleep so wall-clock changes (DST, NTP) are noticed
+MAX_SLEEP_SECONDS = 60
+
+
+class PostScheduler:
+    """Min-heap of due times that sleeps until the earliest delivery is due
+
+    Entries are invalidated lazily: `schedule` and `remove` only update the
+    `_due` map, stale heap entries are dropped when they reach the top.
+    """
+
+    def __init__(self, post_callback):
+        self._post_callback = post_callback
+        self._heap = []
+        self._due = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Callbacks run as tasks so deliveries due together are posted concurrently
+        self._running = set()
+
+    def schedule(self, delivery_id, due_at):
+        """Add or reschedule a delivery and wake the loop"""
+        self._due[delivery_id] = due_at
+        heapq.heappush(self._heap, (due_at, delivery_id))
+        self._wakeup.set()
+
+    def remove(self, delivery_id):
+        """Forget a delivery that was deleted or posted elsewhere; returns its due time"""
+        due_at = self._due.pop(delivery_id, None)
+        if due_at is not None:
+            self._wakeup.set()
+        return due_at
+
+    def __len__(self):
+        return len(self._due)
+
+    def _peek(self):
+        while self._heap:
+            due_at, delivery_id = self._heap[0]
+            if self._due.get(delivery_id) == due_at:
+                return due_at, delivery_id
+            heapq.heappop(self._heap)
+        return None
+
+    def _tick(self):
+        """Start every due delivery and return the seconds until the next one, or None"""
+        while True:
+            head = self._peek()
+            if head is None:
+                return None
+
+            due_at, delivery_id = head
+            delay = (due_at - datetime.now()).total_seconds()
+            if delay > 0:
+                return delay
+
+            heapq.heappop(self._heap)
+            del self._due[delivery_id]
+            scheduler_lateness_seconds.observe(-delay)
+            task = asyncio.create_task(self._post(delivery_id))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            started = time.perf_counter()
+            delay = self._tick()
+            scheduler_tick_seconds.observe(time.perf_counter() - started)
+            if delay is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=min(delay, MAX_SLEEP_SECONDS)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _post(self, delivery_id):
+        try:
+            await self._post_callback(delivery_id)
+        except Exception as e:
+            logging.error(f"Error posting scheduled delivery {delivery_id}: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
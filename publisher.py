@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque, namedtuple
+
+from aiohttp import ClientConnectorError
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from metrics import telegram_send_seconds
+
+# Errors worth another attempt; anything else (bad request, bot kicked) is final
+RETRYABLE_ERRORS = (TelegramServerError, TelegramNetworkError, asyncio.TimeoutError)
+
+PublishAttempt = namedtuple("PublishAttempt", "chat_id attempt latency error")
+
+
+class PublishError(Exception):
+    """Raised when a send still fails after all attempts"""
+
+
+class PublishOutcomeUnknown(PublishError):
+    """Raised when a send failed in a way that leaves open whether the message was posted"""
+
+
+def is_uncertain(error):
+    """Whether a failed send may have reached Telegram, so sending again could post twice
+
+    aiogram raises TelegramNetworkError while handling the aiohttp error, which
+    stays available as its context. A connection that could not be opened
+    (refused, DNS, TLS) carried no request; a timeout or a dropped connection
+    may have lost only the answer.
+    """
+    if isinstance(error, TelegramNetworkError):
+        return not isinstance(error.__cause__ or error.__context__, ClientConnectorError)
+    return isinstance(error, asyncio.TimeoutError)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # Waiters queue on the lock, which keeps acquisition first come first served
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Publisher:
+    """Sends to Telegram within global and per-chat rate limits, retrying transient errors"""
+
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate_per_minute=20,
+        max_concurrency=4,
+        max_attempts=5,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.chat_rate = chat_rate_per_minute / 60
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Recent attempts, newest last, for latency and failure reporting
+        self.attempts = deque(maxlen=1000)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def publish(self, chat_id, send, cost=1):
+        """Run `send()` (a coroutine factory) for a chat and return its result
+
+        `cost` is the number of messages the send creates, e.g. the photos
+        of an album; each of them takes a token from both rate limits.
+        """
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            for _ in range(cost):
+                await self._chat_bucket(chat_id).acquire()
+                await self._global_bucket.acquire()
+
+            started = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    result = await send()
+            except TelegramRetryAfter as e:
+                self._record(chat_id, attempt, started, e)
+                last_error = e
+                delay = e.retry_after
+                logging.warning(f"Flood wait for {chat_id}: retrying in {delay} s")
+            except RETRYABLE_ERRORS as e:
+                self._record(chat_id, attempt, started, e)
+                if is_uncertain(e):
+                    raise PublishOutcomeUnknown(
+                        f"No answer from Telegram for {chat_id}, the message may have been posted"
+                    ) from e
+                last_error = e
+                delay = self._backoff(attempt)
+                logging.warning(
+                    f"Send to {chat_id} failed (attempt {attempt}): {e!r}, retrying in {delay:.1f} s"
+                )
+            except Exception as e:
+                self._record(chat_id, attempt, started, e)
+                raise
+            else:
+                self._record(chat_id, attempt, started, None)
+                return result
+
+            if attempt < self.max_attempts:
+                await asyncio.sleep(delay)
+
+        raise PublishError(
+            f"Giving up on {chat_id} after {self.max_attempts} attempts: {last_error!r}"
+        ) from last_error
+
+    def _record(self, chat_id, attempt, started, error):
+        latency = time.perf_counter() - started
+        self.attempts.append(PublishAttempt(chat_id, attempt, latency, error))
+        telegram_send_seconds.observe(
+            latency, chat=chat_id, outcome="ok" if error is None else type(error).__name__
+        )
+        logging.debug(f"Send to {chat_id} attempt {attempt} took {latency * 1000:.0f} ms")
@@ -0,0 +1,114 @@
+import heapq
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+
+class SlotTemplate:
+    """Posting times within a day plus the weekdays and dates they apply to"""
+
+    def __init__(self, times, weekdays=range(7), blackout_dates=()):
+        self.times = sorted(set(times))
+        self.weekdays = frozenset(weekdays)
+        self.blackout_dates = frozenset(blackout_dates)
+        if not self.times or not self.weekdays:
+            raise ValueError("Slot template needs at least one time and one weekday")
+
+    def is_open(self, day):
+        return day.weekday() in self.weekdays and day not in self.blackout_dates
+
+    def contains(self, slot):
+        return self.is_open(slot.date()) and slot.time() in self.times
+
+    def next_slot(self, after):
+        """First slot strictly after the given datetime"""
+        day = after.date()
+        index = bisect_right(self.times, after.time())
+        # Blackout dates are finite, so this loop always terminates
+        while True:
+            if self.is_open(day) and index < len(self.times):
+                return datetime.combine(day, self.times[index])
+            day += timedelta(days=1)
+            index = 0
+
+
+class SlotAllocator:
+    """Hands out free posting slots over an unbounded horizon
+
+    Slots up to `_last` have been generated and are either reserved or
+    sitting in the `_free` heap; everything after `_last` is free. Stale
+    heap entries (past or re-reserved slots) are dropped lazily, so
+    allocate, reserve and release are amortised O(log n).
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._reserved = set()
+        self._free = []
+        self._last = None
+
+    def __len__(self):
+        return len(self._reserved)
+
+    def is_reserved(self, slot):
+        return slot in self._reserved
+
+    def allocate(self, now=None):
+        """Reserve and return the earliest free slot after now"""
+        now = now or datetime.now()
+        while self._free:
+            slot = heapq.heappop(self._free)
+            if slot > now and slot not in self._reserved:
+                self._reserved.add(slot)
+                return slot
+
+        if self._last is None or self._last < now:
+            self._last = now
+        while True:
+            self._last = self.template.next_slot(self._last)
+            if self._last not in self._reserved:
+                self._reserved.add(self._last)
+                return self._last
+
+    def reserve(self, slot):
+        """Mark a specific time as taken; returns False if it already was"""
+        if slot in self._reserved:
+            return False
+        self._reserved.add(slot)
+        if self.template.contains(slot) and (self._last is None or slot > self._last):
+            # Slots skipped over by this reservation stay available
+            cursor = self._last or datetime.now()
+            while True:
+                cursor = self.template.next_slot(cursor)
+                if cursor >= slot:
+                    break
+                if cursor not in self._reserved:
+                    heapq.heappush(self._free, cursor)
+            self._last = slot
+        return True
+
+    def discard(self, slot):
+        """Forget a slot that has been used up by a post"""
+        self._reserved.discard(slot)
+
+    def release(self, slot):
+        """Give a reserved slot back to the pool"""
+        if slot not in self._reserved:
+            return
+        self._reserved.discard(slot)
+        if self.template.contains(slot) and self._last is not None and slot <= self._last:
+            heapq.heappush(self._free, slot)
+
+
+def parse_template(times, weekdays="", blackout_dates=""):
+    """Build a SlotTemplate from comma separated config strings
+
+    times: "09:00,11:12"; weekdays: "0,1,2,3,4" (Monday is 0, empty for
+    every day); blackout_dates: "2025-01-01,2025-05-09".
+    """
+    return SlotTemplate(
+        times=[time.fromisoformat(value.strip()) for value in times.split(",") if value.strip()],
+        weekdays=[int(value) for value in weekdays.split(",") if value.strip()] or range(7),
+        blackout_dates=[
+            date.fromisoformat(value.strip()) for value in blackout_dates.split(",") if value.strip()
+        ],
+    )